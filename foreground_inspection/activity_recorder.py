@@ -0,0 +1,234 @@
+"""
+专注时段活动记录
+
+检测运行期间，每个前台窗口的停留时段记为一行 (开始, 结束, 标题 id, 判定, 来源)，
+按列追加写进 activity/ 目录下的定长数组文件（标题去重后存在 titles.txt，行号即标题 id）：
+  start.f64   开始时间（Unix 秒）
+  end.f64     结束时间
+  title.u32   标题 id
+  verdict.u8  0 = 不是娱乐，1 = 娱乐，2 = 查询失败/未知
+  source.u8   判定来源在 SOURCES 里的下标
+追加只写几个字节，不需要 numpy；查询时一次读入整列，用 numpy 按天/周 × 应用/类别/标题汇总。
+进程中途被杀时各列长度可能不一致，打开时截到最短的一列。
+"""
+
+import array
+import os
+import sys
+import threading
+import time
+
+SOURCES = ("whitelist", "blacklist", "history", "pack", "ai", "no_api",
+           "cached_failure", "circuit_open", "budget_exhausted", "rate_limited", "other")
+VERDICT_CODES = {"不是": 0, "是": 1}
+CATEGORIES = ("非娱乐", "娱乐", "未知")
+COLUMNS = (("start", "d"), ("end", "d"), ("title", "I"), ("verdict", "B"), ("source", "B"))
+NUMPY_TYPES = {"d": "float64", "I": "uint32", "B": "uint8"}
+SUFFIXES = {"d": "f64", "I": "u32", "B": "u8"}
+MIN_SPAN = 0.5  # 短于这个时长（秒）的时段不记录（切窗口时一闪而过的标题）
+
+
+def app_name(window_title):
+    """从窗口标题里取应用名：最后一个 " - " 之后的部分（"xxx - Visual Studio Code"），没有分隔符时用整个标题"""
+    name = window_title.replace("\u200b", "")  # Edge 标题里 "Microsoft\u200b Edge" 带零宽空格
+    for sep in (" - ", " — ", " | "):
+        if sep in name:
+            name = name.rsplit(sep, 1)[1]
+            break
+    return name.strip() or window_title
+
+
+class ActivityStore:
+    """activity/ 目录下的列式文件"""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.lock = threading.Lock()
+        self.titles = []  # 标题 id -> 标题
+        self.title_ids = {}  # 标题 -> 标题 id
+        self.count = 0  # 完整的行数
+        self.files = {}
+        self.titles_file = None
+        self.apps = {}  # 应用名 -> 应用 id
+        self.app_of_title = []  # 标题 id -> 应用 id（查询时按需补齐）
+
+    def path(self, name, code):
+        return os.path.join(self.folder, f"{name}.{SUFFIXES[code]}")
+
+    def open(self):
+        """读取标题表，按最短的一列修复中途写坏的文件，打开各列准备追加"""
+        os.makedirs(self.folder, exist_ok=True)
+        titles_path = os.path.join(self.folder, "titles.txt")
+        if os.path.exists(titles_path):
+            with open(titles_path, "rb+") as f:
+                content = f.read()
+                # 最后一行没写完（没有换行符）时丢掉，后面的标题接着写在完整的行后面
+                end = content.rfind(b"\n") + 1
+                if end < len(content):
+                    f.truncate(end)
+            self.titles = content[:end].decode("utf-8", errors="replace").split("\n")[:-1]
+        self.title_ids = {title: i for i, title in enumerate(self.titles)}
+
+        sizes = []
+        for name, code in COLUMNS:
+            path = self.path(name, code)
+            sizes.append(os.path.getsize(path) // array.array(code).itemsize if os.path.exists(path) else 0)
+        self.count = min(sizes)
+        for name, code in COLUMNS:
+            f = open(self.path(name, code), "ab")
+            f.truncate(self.count * array.array(code).itemsize)
+            self.files[name] = f
+        self.titles_file = open(titles_path, "a", encoding="utf-8", newline="\n")
+
+    def intern(self, window_title):
+        """标题 -> 标题 id（新标题追加到 titles.txt）"""
+        window_title = window_title.replace("\n", " ")
+        title_id = self.title_ids.get(window_title)
+        if title_id is None:
+            title_id = len(self.titles)
+            self.titles.append(window_title)
+            self.title_ids[window_title] = title_id
+            self.titles_file.write(window_title + "\n")
+            self.titles_file.flush()
+        return title_id
+
+    def append(self, start, end, window_title, verdict, source):
+        """追加一个时段"""
+        with self.lock:
+            if self.titles_file is None:  # 没打开（或打开失败）时不记录
+                return
+            row = {
+                "start": start,
+                "end": end,
+                "title": self.intern(window_title),
+                "verdict": VERDICT_CODES.get(verdict, 2),
+                "source": SOURCES.index(source) if source in SOURCES else len(SOURCES) - 1,
+            }
+            for name, code in COLUMNS:
+                f = self.files[name]
+                array.array(code, [row[name]]).tofile(f)
+                f.flush()
+            self.count += 1
+
+    def columns(self):
+        """读入整列（numpy 数组）"""
+        import numpy as np
+        with self.lock:
+            count = self.count
+            titles = list(self.titles)
+        data = {}
+        for name, code in COLUMNS:
+            data[name] = np.fromfile(self.path(name, code), dtype=NUMPY_TYPES[code], count=count)
+        return data, titles
+
+    def query(self, group="app", period="day", days=7, limit=10, now=None):
+        """
+        按时间段汇总前台时长
+        - group: "app"（按应用名）/ "category"（娱乐/非娱乐/未知）/ "title"（完整标题）
+        - period: "day" / "week"（周一开始），days: 往前统计多少天（含今天）
+        返回 {"buckets": [{"period": "2026-10-19", "total": 秒, "items": [{"key": ..., "seconds": ...}]}], ...}
+        跨过零点的时段整段算在开始那天
+        """
+        import numpy as np
+        t0 = time.perf_counter()
+        now = time.time() if now is None else now
+        local = time.localtime(now)
+        offset = local.tm_gmtoff
+        today = int((now + offset) // 86400)
+        since = (today - days + 1) * 86400 - offset
+
+        data, titles = self.columns()
+        mask = data["end"] > since
+        start = np.maximum(data["start"][mask], since)
+        seconds = data["end"][mask] - start
+        day = np.floor((start + offset) / 86400).astype(np.int64)
+        bucket = (day + 3) // 7 if period == "week" else day  # 1970-01-01 是周四，+3 让每周从周一开始
+
+        if group == "category":
+            keys = data["verdict"][mask].astype(np.int64)
+            labels = list(CATEGORIES)
+        elif group == "title":
+            keys = data["title"][mask].astype(np.int64)
+            labels = titles
+        else:
+            # 每个标题先映射到应用 id（标题数远少于时段数，只算新增的标题），再按时段查表
+            for title in titles[len(self.app_of_title):]:
+                self.app_of_title.append(self.apps.setdefault(app_name(title), len(self.apps)))
+            app_of_title = np.array(self.app_of_title[:len(titles)], dtype=np.int64)
+            keys = app_of_title[data["title"][mask]] if len(titles) else np.zeros(0, dtype=np.int64)
+            labels = list(self.apps)
+
+        buckets = []
+        if len(seconds):
+            # 天/周是连续的小整数，直接减去最小值当下标；标题可能很多，只保留出现过的
+            first = int(bucket.min())
+            bucket_index = bucket - first
+            bucket_ids = np.arange(first, first + int(bucket_index.max()) + 1)
+            if group == "title":
+                key_ids, key_index = np.unique(keys, return_inverse=True)
+            else:
+                key_ids, key_index = np.arange(len(labels)), keys
+            totals = np.bincount(bucket_index * len(key_ids) + key_index, weights=seconds,
+                                 minlength=len(bucket_ids) * len(key_ids)).reshape(len(bucket_ids), len(key_ids))
+            # 每组只取前 limit 名：先 argpartition 再对这几名排序，不用整行排序
+            if limit < len(key_ids):
+                top = np.argpartition(-totals, limit - 1, axis=1)[:, :limit]
+            else:
+                top = np.broadcast_to(np.arange(len(key_ids)), totals.shape)
+            top = np.take_along_axis(top, np.argsort(-np.take_along_axis(totals, top, axis=1), axis=1), axis=1)
+            for b, row, order in zip(bucket_ids, totals, top):
+                if not row.any():
+                    continue
+                first_day = b * 7 - 3 if period == "week" else b
+                buckets.append({
+                    "period": time.strftime("%Y-%m-%d", time.gmtime(int(first_day) * 86400)),
+                    "total": round(float(row.sum()), 1),
+                    "items": [{"key": labels[key_ids[i]], "seconds": round(float(row[i]), 1)}
+                              for i in order if row[i] > 0]
+                })
+        return {
+            "group": group,
+            "period": period,
+            "days": days,
+            "spans": int(mask.sum()),
+            "buckets": buckets,
+            "elapsed_ms": round((time.perf_counter() - t0) * 1000, 2)
+        }
+
+    def close(self):
+        with self.lock:
+            for f in self.files.values():
+                f.close()
+            self.files = {}
+            if self.titles_file:
+                self.titles_file.close()
+                self.titles_file = None
+
+
+class ActivityRecorder:
+    """跟踪当前前台时段：换窗口时结束上一段并写入，停止检测/退出时结束当前段"""
+
+    def __init__(self, store):
+        self.store = store
+        self.lock = threading.Lock()
+        self.current = None  # (开始时间, 标题, 判定, 来源)
+
+    def switch(self, window_title, verdict, source, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            previous, self.current = self.current, (now, window_title, verdict, source)
+        self.write(previous, now)
+
+    def close(self, now=None):
+        now = time.time() if now is None else now
+        with self.lock:
+            previous, self.current = self.current, None
+        self.write(previous, now)
+
+    def write(self, span, end):
+        if span is None or end - span[0] < MIN_SPAN:
+            return
+        try:
+            self.store.append(span[0], end, span[1], span[2], span[3])
+        except OSError as e:
+            print(f"写入活动记录失败: {e}", file=sys.stderr)
@@ -0,0 +1,641 @@
+"""
+前台检测程序性能测试脚本
+
+用法:
+  python benchmark.py ai
+    在本机启动一个假的 OpenAI 兼容接口（可注入延迟和 5xx 错误），测试 check_is_entertainment 的
+    限流、每日预算、熔断（打开/半开/恢复）和失败标题缓存：每种情况的调用次数、被拦下的原因和单次耗时
+  python benchmark.py pack [--titles 200000]
+    判定包：用 3 份合成的历史记录编译，对比内存映射加载与 json.load 同样大小的历史记录的耗时，
+    统计命中/未命中的查找耗时，并逐条核对查找结果
+  python benchmark.py startup [--runs 5]
+    冷启动：以子进程启动 foreground_inspection.py（-X importtime），统计启动到 ready、后台配置加载、
+    第一次 set_api_key（包含延迟导入 openai）的耗时，并列出 ready 之前和单独 import openai 时最慢的模块
+  python benchmark.py activity [--days 180 --spans-per-day 600]
+    活动记录：合成几个月的前台时段，统计打开（含修复写坏的尾部）、单次追加、按天/周 × 应用/类别/标题
+    汇总的耗时，并和逐行 Python 汇总的结果核对
+  python benchmark.py audit [--windows 30]
+    后台巡检：mock 窗口来源 + 假的 OpenAI 兼容接口，统计一次巡检的 AI 请求数和耗时、后台娱乐窗口的报告，
+    以及切到巡检预热过的窗口与没见过的窗口时，entertainment_detected 的来源和接口请求数
+  python benchmark.py stall [--latency 6 --threshold 2]
+    卡顿看门狗：假的接口每次请求挂住 latency 秒，统计检测循环从卡住到 stall_detected 的耗时、
+    报告的卡顿位置，以及恢复后 get_status 里的卡顿次数/最长一次；另外测一次心跳（beat）的耗时
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_detector(tmp):
+    """导入 foreground_inspection，配置文件都写到临时目录，不改动真实的历史记录"""
+    sys.path.insert(0, SCRIPT_DIR)
+    import foreground_inspection as fi
+    fi.LIST_CONFIG_FILE = os.path.join(tmp, "list_config.json")
+    fi.AI_USAGE_FILE = os.path.join(tmp, "ai_usage.json")
+    return fi
+
+
+# ============ 假的 OpenAI 兼容接口 ============
+
+class FakeAIServer:
+    """
+    本机的 /v1/chat/completions
+    - latency: 每次请求的延迟（秒）
+    - error_rate: 返回 500 的概率（1.0 表示全部失败）
+    标题里带"游戏"/"视频"的回答"是"，其余回答"不是"；批量请求（巡检）逐个回答，批大小记在 batches
+    """
+
+    def __init__(self):
+        self.latency = 0.0
+        self.error_rate = 0.0
+        self.requests = 0
+        self.batches = []
+        self.lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with server.lock:
+                    server.requests += 1
+                time.sleep(server.latency)
+                if random.random() < server.error_rate:
+                    self.reply(500, {"error": {"message": "injected failure", "type": "server_error"}})
+                    return
+                content = body["messages"][-1]["content"]
+                if content.startswith("窗口名称列表："):
+                    titles = json.loads(content[len("窗口名称列表："):])
+                    with server.lock:
+                        server.batches.append(len(titles))
+                    answer = {"results": {t: server.verdict(t) for t in titles}}
+                else:
+                    answer = {"is_entertainment": server.verdict(content)}
+                self.reply(200, {
+                    "id": "fake", "object": "chat.completion", "created": 0, "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant",
+                                             "content": json.dumps(answer, ensure_ascii=False)}}],
+                    "usage": {"prompt_tokens": 60, "completion_tokens": 10, "total_tokens": 70}
+                })
+
+            def reply(self, code, payload):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                try:
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # 客户端已超时断开
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.httpd.daemon_threads = True
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    @staticmethod
+    def verdict(title):
+        return "是" if ("游戏" in title or "视频" in title) else "不是"
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.httpd.server_port}/v1"
+
+    def close(self):
+        self.httpd.shutdown()
+
+
+# ============ 冷启动 ============
+
+def parse_importtime(stderr, top=8):
+    """解析 -X importtime 的输出，返回 (累计耗时最多的顶层模块 [(ms, 名称)], 导入的模块名集合)"""
+    rows, names = [], set()
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        names.add(name.strip())
+        if not name.startswith("  "):  # 只看顶层导入，子模块已算进累计耗时
+            rows.append((int(cumulative) / 1000, name.strip()))
+    rows.sort(reverse=True)
+    return rows[:top], names
+
+
+class DetectorProcess:
+    """以子进程启动 foreground_inspection.py，通过 stdin/stdout 的 JSON 协议交互"""
+
+    def __init__(self, folder, importtime=False, extra_args=()):
+        args = [sys.executable] + (["-X", "importtime"] if importtime else []) + [
+            os.path.join(folder, "foreground_inspection.py")] + list(extra_args)
+        self.started = time.perf_counter()
+        self.proc = subprocess.Popen(args, cwd=folder, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, text=True, encoding="utf-8")
+        self.stderr = []
+        threading.Thread(target=lambda: self.stderr.extend(self.proc.stderr), daemon=True).start()
+
+    def wait_event(self, name, timeout=30):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            line = self.proc.stdout.readline()
+            if not line:
+                break
+            message = json.loads(line)
+            if message["event"] == name:
+                return message["data"]
+        raise RuntimeError(f"没有等到 {name} 事件")
+
+    def send(self, command):
+        self.proc.stdin.write(json.dumps(command) + "\n")
+        self.proc.stdin.flush()
+
+    def close(self):
+        self.send({"command": "exit"})
+        self.proc.wait(timeout=10)
+        return "".join(self.stderr)
+
+
+def copy_detector(folder, server):
+    """把检测程序复制到临时目录，模型配置指向假的接口（历史记录等运行时文件都写在临时目录）"""
+    for name in ("foreground_inspection.py", "verdict_pack.py", "activity_recorder.py", "list_config.json"):
+        shutil.copy(os.path.join(SCRIPT_DIR, name), folder)
+    for name in ("metrics.py", "profiler.py", "stall_watchdog.py"):
+        shutil.copy(os.path.join(SCRIPT_DIR, os.pardir, "sidecar", name), folder)
+    with open(os.path.join(folder, "model_config.json"), "w", encoding="utf-8") as f:
+        json.dump({"base_url": server.base_url, "model": "fake-chat"}, f)
+
+
+def bench_startup(runs):
+    server = FakeAIServer()
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_detector(tmp, server)
+
+        ready, config, first_key, openai_ms = [], [], [], []
+        for _ in range(runs):
+            detector = DetectorProcess(tmp)
+            detector.wait_event("ready")
+            ready.append((time.perf_counter() - detector.started) * 1000)
+            detector.send({"command": "set_api_key", "api_key": "sk-bench"})
+            first_key.append(detector.wait_event("api_key_updated")["elapsed_ms"])
+            detector.send({"command": "get_status"})
+            startup = detector.wait_event("status")["startup"]
+            config.append(startup["config"])
+            openai_ms.append(startup["openai"])
+            detector.close()
+
+        print(f"启动到 ready（子进程启动计时，含解释器）: 中位数 {statistics.median(ready):.1f} ms")
+        print(f"ready 之后后台加载配置: 中位数 {statistics.median(config):.1f} ms")
+        print(f"第一次 set_api_key 到 api_key_updated: 中位数 {statistics.median(first_key):.1f} ms"
+              f"（其中导入 openai {statistics.median(openai_ms):.1f} ms）")
+
+        detector = DetectorProcess(tmp, importtime=True)
+        detector.wait_event("ready")
+        detector.proc.stdin.close()
+        detector.proc.kill()
+        detector.proc.wait()
+        time.sleep(0.1)
+        rows, names = parse_importtime("".join(detector.stderr))
+        print(f"ready 之前导入的模块: {len(names)} 个，openai {'已' if 'openai' in names else '未'}导入，最慢的顶层模块:")
+        for ms, name in rows:
+            print(f"  {ms:8.1f} ms  {name}")
+
+        result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import openai"],
+                                capture_output=True, text=True, encoding="utf-8")
+        rows, names = parse_importtime(result.stderr, top=1)
+        print(f"单独 import openai: {rows[0][0]:.1f} ms，{len(names)} 个模块（原来这部分都在 ready 之前）")
+    server.close()
+
+
+# ============ 后台巡检 ============
+
+def write_mock_windows(path, foreground, windows):
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"foreground": foreground, "windows": windows}, f, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def switch_foreground(detector, mock_path, title, windows, server):
+    """切换 mock 前台窗口，返回 (entertainment_detected 的来源, 期间的接口请求数)"""
+    before = server.requests
+    write_mock_windows(mock_path, title, windows)
+    data = detector.wait_event("entertainment_detected")
+    return data["source"], server.requests - before
+
+
+def print_metrics(snapshot):
+    """get_metrics 的 JSON 结果：直方图打印次数/平均/最大，计数器打印值"""
+    for name, family in snapshot.items():
+        for series in family["series"]:
+            labels = ",".join(f"{k}={v}" for k, v in series["labels"].items())
+            if family["type"] == "histogram":
+                mean = series["sum"] / series["count"] * 1000 if series["count"] else 0
+                print(f"  {name}{{{labels}}}: {series['count']} 次，平均 {mean:.2f} ms，最大 {series['max'] * 1000:.2f} ms")
+            else:
+                print(f"  {name}{{{labels}}}: {series['value']}")
+
+
+def bench_audit(count):
+    server = FakeAIServer()
+    server.latency = 0.3
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_detector(tmp, server)
+        mock_path = os.path.join(tmp, "windows.json")
+        videos = [f"第 {i} 集 视频 - 播放器" for i in range(count // 3)]
+        docs = [f"笔记 {i} - 记事本" for i in range(count - len(videos))]
+        windows = ["编辑器 - Visual Studio Code"] + videos + docs
+        write_mock_windows(mock_path, windows[0], windows)
+
+        metrics_path = os.path.join(tmp, "foreground.prom")
+        detector = DetectorProcess(tmp, extra_args=["--window-source", "mock", "--mock-windows", mock_path,
+                                                    "--metrics-file", metrics_path, "--metrics-interval", "0.5"])
+        detector.wait_event("ready")
+        detector.send({"command": "set_api_key", "api_key": "sk-bench"})
+        detector.wait_event("api_key_updated")
+        server.requests = 0
+        detector.send({"command": "start"})
+
+        print(f"可见窗口 {len(windows)} 个（后台视频 {len(videos)} 个），接口延迟 {server.latency * 1000:.0f} ms")
+        t0 = time.perf_counter()
+        detector.send({"command": "set_audit", "enabled": True, "interval": 1})
+        flagged = detector.wait_event("background_entertainment")
+        print(f"第一次巡检: {(time.perf_counter() - t0) * 1000:.0f} ms 后报告 {len(flagged['windows'])} 个后台娱乐窗口，"
+              f"接口请求 {server.requests} 次，批大小 {server.batches}")
+
+        late = "新开的 游戏 - 启动器"
+        write_mock_windows(mock_path, windows[0], windows + [late])
+        flagged = detector.wait_event("background_entertainment")
+        print(f"新出现后台窗口: 只报告 {[w['window_title'] for w in flagged['windows']]}，批大小 {server.batches[1:]}")
+
+        detector.send({"command": "set_audit", "enabled": False})
+        detector.wait_event("audit_updated")
+        warm = [switch_foreground(detector, mock_path, t, windows, server) for t in videos[:3]]
+        cold = [switch_foreground(detector, mock_path, f"没见过的 视频 {i}", windows, server) for i in range(3)]
+        for name, rows in (("巡检预热过", warm), ("没见过", cold)):
+            print(f"切到{name}的 {len(rows)} 个视频窗口: 来源 {sorted(set(r[0] for r in rows))}，"
+                  f"接口请求 {sum(r[1] for r in rows)} 次（每次 {server.latency * 1000:.0f} ms）")
+
+        detector.send({"command": "get_status"})
+        print(f"get_status 中的 audit: {detector.wait_event('status')['audit']}")
+        detector.send({"command": "get_metrics"})
+        print_metrics(detector.wait_event("metrics")["metrics"])
+        with open(metrics_path, encoding="utf-8") as f:
+            samples = [line for line in f if not line.startswith("#")]
+        print(f"指标文件 {os.path.basename(metrics_path)}: {len(samples)} 个样本")
+        detector.close()
+    server.close()
+
+
+# ============ 卡顿看门狗 ============
+
+def bench_stall(latency, threshold):
+    sys.path.append(os.path.join(SCRIPT_DIR, os.pardir, "sidecar"))
+    from stall_watchdog import Watchdog
+    heartbeat = Watchdog("bench").heartbeat("loop")
+    n = 200000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        heartbeat.beat()
+    print(f"一次心跳 beat(): {(time.perf_counter() - t0) / n * 1e6:.3f} µs")
+
+    server = FakeAIServer()
+    server.latency = latency
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_detector(tmp, server)
+        mock_path = os.path.join(tmp, "windows.json")
+        write_mock_windows(mock_path, "编辑器 - Visual Studio Code", [])
+        detector = DetectorProcess(tmp, extra_args=["--window-source", "mock", "--mock-windows", mock_path,
+                                                    "--stall-threshold", str(threshold)])
+        detector.wait_event("ready")
+        server.latency = 0.0
+        detector.send({"command": "set_api_key", "api_key": "sk-bench"})
+        detector.wait_event("api_key_updated")
+        detector.send({"command": "start"})
+        time.sleep(1.5)
+
+        server.latency = latency
+        t0 = time.perf_counter()
+        write_mock_windows(mock_path, "没见过的 视频 - 播放器", [])
+        stall = detector.wait_event("stall_detected", timeout=latency + 10)
+        print(f"接口挂住 {latency:.0f} 秒，阈值 {threshold} 秒：切换窗口后 {time.perf_counter() - t0:.2f} 秒"
+              f"收到 stall_detected（报告已卡 {stall['stalled']} 秒）")
+        print(f"  循环 {stall['loop']}（线程 {stall['thread']}），卡在 {stall['location']}")
+        print(f"  最内层 {stall['innermost']}，抓到 {len(stall['threads'])} 个线程的栈")
+        detector.wait_event("entertainment_detected", timeout=latency + 10)
+        time.sleep(0.5)
+        detector.send({"command": "get_status"})
+        print(f"恢复后 get_status 中的 stalls: {detector.wait_event('status')['stalls']}")
+        detector.send({"command": "get_metrics"})
+        metrics = detector.wait_event("metrics")["metrics"]
+        print_metrics({k: v for k, v in metrics.items() if "stall" in k})
+        detector.close()
+    server.close()
+
+
+# ============ 活动记录 ============
+
+def write_synthetic_activity(folder, days, spans_per_day, now, seed=3):
+    """直接写列文件：days 天、每天 spans_per_day 个时段（白天 8 点到 23 点之间），返回标题表"""
+    import numpy as np
+    import activity_recorder as ar
+
+    rng = np.random.default_rng(seed)
+    apps = ["Visual Studio Code", "Microsoft Edge", "哔哩哔哩", "Steam", "WeGame", "Word", "PowerShell",
+            "网易云音乐", "PyCharm", "微信", "QQ", "文件资源管理器"]
+    titles = [f"文档 {i} - {apps[i % len(apps)]}" for i in range(5000)]
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "titles.txt"), "w", encoding="utf-8", newline="\n") as f:
+        f.writelines(t + "\n" for t in titles)
+
+    offset = time.localtime(now).tm_gmtoff
+    today = int((now + offset) // 86400)
+    total = days * spans_per_day
+    day = np.repeat(np.arange(today - days + 1, today + 1), spans_per_day)
+    start = day * 86400.0 - offset + rng.uniform(8 * 3600, 23 * 3600, total)
+    start.sort()
+    end = start + rng.exponential(90, total) + ar.MIN_SPAN
+    columns = {
+        "start": start,
+        "end": end,
+        "title": rng.integers(0, len(titles), total).astype(np.uint32),
+        "verdict": rng.choice(np.array([0, 1, 2], dtype=np.uint8), total, p=[0.7, 0.25, 0.05]),
+        "source": rng.integers(0, len(ar.SOURCES), total).astype(np.uint8),
+    }
+    for name, code in ar.COLUMNS:
+        columns[name].astype(ar.NUMPY_TYPES[code]).tofile(os.path.join(folder, f"{name}.{ar.SUFFIXES[code]}"))
+    return titles
+
+
+def python_totals(store, group, days, now):
+    """逐行 Python 汇总（按天），用来核对 numpy 的结果"""
+    import activity_recorder as ar
+    data, titles = store.columns()
+    offset = time.localtime(now).tm_gmtoff
+    since = ((now + offset) // 86400 - days + 1) * 86400 - offset
+    totals = {}
+    for s, e, t, v in zip(data["start"].tolist(), data["end"].tolist(), data["title"].tolist(), data["verdict"].tolist()):
+        if e <= since:
+            continue
+        s = max(s, since)
+        day = time.strftime("%Y-%m-%d", time.gmtime(int((s + offset) // 86400) * 86400))
+        key = ar.CATEGORIES[v] if group == "category" else ar.app_name(titles[t])
+        totals[(day, key)] = totals.get((day, key), 0.0) + (e - s)
+    return totals
+
+
+def bench_activity(days, spans_per_day):
+    sys.path.insert(0, SCRIPT_DIR)
+    import activity_recorder as ar
+
+    now = time.time()
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "activity")
+        write_synthetic_activity(folder, days, spans_per_day, now)
+        # 模拟写到一半被杀：一列多出半行
+        with open(os.path.join(folder, "title.u32"), "ab") as f:
+            f.write(b"\x01\x02")
+        size = sum(os.path.getsize(os.path.join(folder, n)) for n in os.listdir(folder))
+
+        store = ar.ActivityStore(folder)
+        t0 = time.perf_counter()
+        store.open()
+        opened = time.perf_counter() - t0
+        print(f"{store.count} 个时段（{days} 天）、{len(store.titles)} 个标题，{size / 1e6:.1f} MB，"
+              f"打开并修复 {opened * 1000:.1f} ms，title 列长度 {os.path.getsize(store.path('title', 'I')) // 4}")
+
+        recorder = ar.ActivityRecorder(store)
+        t = now
+        t0 = time.perf_counter()
+        for i in range(2000):
+            recorder.switch(f"新窗口 {i % 50} - 测试", "不是", "ai", t)
+            t += 1.0
+        recorder.close(t)
+        print(f"追加: 每个时段 {(time.perf_counter() - t0) / 2000 * 1e6:.1f} us（每列写入后 flush）")
+
+        store.query(days=1)  # 第一次查询包含导入 numpy
+        for group in ("app", "category", "title"):
+            for period in ("day", "week"):
+                times = []
+                for _ in range(5):
+                    result = store.query(group=group, period=period, days=days, limit=5, now=t)
+                    times.append(result["elapsed_ms"])
+                top = result["buckets"][-1]["items"][0] if result["buckets"] else None
+                print(f"  {group:<9}{period:<5} {result['spans']} 个时段 → {len(result['buckets'])} 组，"
+                      f"中位数 {statistics.median(times):.1f} ms，最近一组第一名 {top['key']} {top['seconds'] / 3600:.1f} 小时")
+
+        for group in ("category", "app"):
+            result = store.query(group=group, period="day", days=30, limit=10000, now=t)
+            expected = python_totals(store, group, 30, t)
+            got = {(b["period"], item["key"]): item["seconds"] for b in result["buckets"] for item in b["items"]}
+            wrong = sum(1 for k, v in expected.items() if abs(got.get(k, 0.0) - v) > 0.1)
+            print(f"核对 {group}/day 30 天: {len(expected)} 组，不一致 {wrong}")
+        store.close()
+
+
+# ============ 判定包 ============
+
+def synthetic_histories(titles, copies=3, seed=1):
+    """几台机器的历史记录：大部分标题相同，判定偶尔不一致，各自还有一些独有的标题"""
+    rng = random.Random(seed)
+    apps = ["哔哩哔哩", "Steam", "WeGame", "Visual Studio Code", "Microsoft Edge", "网易云音乐", "Word", "PyCharm"]
+    common = {f"{rng.choice(apps)} - 标题 {i} - {rng.random():.6f}": rng.choice(["是", "不是"]) for i in range(titles)}
+    histories = []
+    for c in range(copies):
+        history = {}
+        for title, verdict in common.items():
+            if rng.random() < 0.05:
+                verdict = "不是" if verdict == "是" else "是"
+            elif rng.random() < 0.01:
+                verdict = "查询失败"
+            history[title] = verdict
+        for i in range(titles // 20):
+            history[f"机器 {c} 独有 {i}"] = rng.choice(["是", "不是"])
+        histories.append(history)
+    return histories
+
+
+def bench_pack(titles):
+    sys.path.insert(0, SCRIPT_DIR)
+    import verdict_pack
+
+    histories = synthetic_histories(titles)
+    with tempfile.TemporaryDirectory() as tmp:
+        history_paths = []
+        for i, history in enumerate(histories):
+            path = os.path.join(tmp, f"list_config_{i}.json")
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"whitelist": [], "blacklist": [], "history": history}, f, ensure_ascii=False, indent=4)
+            history_paths.append(path)
+
+        t0 = time.perf_counter()
+        merged = verdict_pack.merge_histories(verdict_pack.load_history(p) for p in history_paths)
+        pack_path = os.path.join(tmp, "fleet.vpk")
+        verdict_pack.write_pack(pack_path, merged)
+        build = time.perf_counter() - t0
+        print(f"编译: {len(merged)} 个标题, {os.path.getsize(pack_path) / 1e6:.1f} MB, 耗时 {build:.2f} 秒")
+
+        loads = []
+        for _ in range(5):
+            t0 = time.perf_counter()
+            pack = verdict_pack.VerdictPack(pack_path)
+            loads.append(time.perf_counter() - t0)
+            pack.close()
+        json_loads = []
+        for _ in range(3):
+            t0 = time.perf_counter()
+            with open(history_paths[0], "r", encoding="utf-8") as f:
+                json.load(f)
+            json_loads.append(time.perf_counter() - t0)
+        print(f"加载: 判定包 {min(loads) * 1000:.3f} ms | json.load 单份历史记录 {min(json_loads) * 1000:.1f} ms "
+              f"({os.path.getsize(history_paths[0]) / 1e6:.1f} MB)")
+
+        pack = verdict_pack.VerdictPack(pack_path)
+        keys = list(merged)
+        random.Random(2).shuffle(keys)
+        sample = keys[:20000]
+        t0 = time.perf_counter()
+        wrong = sum(1 for k in sample if pack.lookup(k) != merged[k])
+        hit = (time.perf_counter() - t0) / len(sample)
+        misses = [k + " (未收录)" for k in sample]
+        t0 = time.perf_counter()
+        found = sum(1 for k in misses if pack.lookup(k) is not None)
+        miss = (time.perf_counter() - t0) / len(misses)
+        print(f"查找: 命中 {hit * 1e6:.1f} us | 未命中 {miss * 1e6:.1f} us | 结果不一致 {wrong} | 误命中 {found}")
+        wrong = sum(1 for k, v in merged.items() if pack.lookup(k) != v)
+        print(f"全量核对: {len(merged)} 个标题，不一致 {wrong}")
+        pack.close()
+
+
+# ============ AI 调用限制 ============
+
+def classify(fi, titles, model_config, list_config):
+    """依次分类，返回 [(结果, 来源, 耗时 ms)]"""
+    results = []
+    for title in titles:
+        t0 = time.perf_counter()
+        verdict, source, _, _ = fi.check_is_entertainment(title, "sk-bench", model_config, list_config)
+        results.append((verdict, source, (time.perf_counter() - t0) * 1000))
+    return results
+
+
+def report(name, results, server_requests):
+    sources = {}
+    for _, source, ms in results:
+        sources.setdefault(source, []).append(ms)
+    parts = ", ".join(f"{s} {len(v)} 次/平均 {sum(v) / len(v):.2f} ms" for s, v in sources.items())
+    print(f"  {name:<22} 请求接口 {server_requests:>3} 次 | {parts}")
+
+
+def bench_ai():
+    server = FakeAIServer()
+    with tempfile.TemporaryDirectory() as tmp:
+        fi = import_detector(tmp)
+        model_config = {"base_url": server.base_url, "model": "fake-chat"}
+
+        def fresh(limits):
+            fi.ai_guard = fi.AIGuard(limits)
+            server.requests = 0
+            return {"whitelist": [], "blacklist": [], "history": {}}
+
+        print("限流（令牌桶 burst=5, 60 次/分钟），40 个新标题连续到来:")
+        server.latency, server.error_rate = 0.02, 0.0
+        lists = fresh({"burst": 5, "rate_per_minute": 60})
+        results = classify(fi, [f"窗口 {i}" for i in range(40)], model_config, lists)
+        report("无延迟间隔", results, server.requests)
+
+        print("每日预算（daily_calls=8）:")
+        lists = fresh({"daily_calls": 8, "burst": 100, "rate_per_minute": 6000})
+        results = classify(fi, [f"预算 {i}" for i in range(20)], model_config, lists)
+        report("20 个新标题", results, server.requests)
+        print(f"  ai_usage.json: {json.load(open(fi.AI_USAGE_FILE, encoding='utf-8'))}")
+
+        print("熔断（接口全部 500、每次 200 ms，连续 3 次失败熔断，冷却 1 秒）:")
+        server.latency, server.error_rate = 0.2, 1.0
+        lists = fresh({"breaker_failures": 3, "breaker_cooldown": 1, "burst": 100, "rate_per_minute": 6000})
+        t0 = time.perf_counter()
+        results = classify(fi, [f"故障 {i}" for i in range(30)], model_config, lists)
+        report("30 个新标题", results, server.requests)
+        print(f"  总耗时 {time.perf_counter() - t0:.2f} 秒（不熔断时约 {30 * server.latency:.1f} 秒）")
+        print(f"  状态: {fi.ai_guard.snapshot()['breaker']}")
+
+        results = classify(fi, ["故障 0", "故障 1"], model_config, lists)
+        report("冷却内重访失败标题", results, 0)
+
+        time.sleep(1.1)
+        server.requests = 0
+        results = classify(fi, ["半开试探 失败"], model_config, lists)
+        report("冷却后试探（仍失败）", results, server.requests)
+        print(f"  状态: {fi.ai_guard.snapshot()['breaker']}")
+
+        time.sleep(1.1)
+        server.latency, server.error_rate = 0.02, 0.0
+        server.requests = 0
+        results = classify(fi, ["半开试探 恢复", "恢复后 视频", "恢复后 文档"], model_config, lists)
+        report("接口恢复后", results, server.requests)
+        print(f"  状态: {fi.ai_guard.snapshot()['breaker']}")
+
+        print("失败标题缓存（failure_ttl=300 秒，接口 30% 失败）:")
+        server.error_rate = 0.3
+        lists = fresh({"burst": 1000, "rate_per_minute": 60000, "breaker_failures": 1000})
+        titles = [f"标题 {i % 20}" for i in range(200)]
+        results = classify(fi, titles, model_config, lists)
+        report("20 个标题来回切换", results, server.requests)
+
+        print(f"get_status 中的 ai: {json.dumps(fi.ai_guard.snapshot(), ensure_ascii=False)}")
+    server.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="前台检测程序性能测试")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    sub.add_parser("ai", help="AI 调用的限流、预算、熔断和失败缓存（假的 OpenAI 兼容接口）")
+
+    p_pack = sub.add_parser("pack", help="判定包的编译、加载和查找耗时")
+    p_pack.add_argument("--titles", type=int, default=200000)
+
+    p_startup = sub.add_parser("startup", help="冷启动到 ready 的耗时和导入耗时（-X importtime）")
+    p_startup.add_argument("--runs", type=int, default=5)
+
+    p_audit = sub.add_parser("audit", help="后台巡检（mock 窗口来源 + 假的 OpenAI 兼容接口）")
+    p_audit.add_argument("--windows", type=int, default=30)
+
+    p_activity = sub.add_parser("activity", help="活动记录的追加和汇总查询耗时")
+    p_activity.add_argument("--days", type=int, default=180)
+    p_activity.add_argument("--spans-per-day", type=int, default=600)
+
+    p_stall = sub.add_parser("stall", help="卡顿看门狗（假的接口挂住时的 stall_detected）")
+    p_stall.add_argument("--latency", type=float, default=6.0)
+    p_stall.add_argument("--threshold", type=float, default=2.0)
+
+    args = parser.parse_args()
+    if args.bench == "ai":
+        bench_ai()
+    elif args.bench == "pack":
+        bench_pack(args.titles)
+    elif args.bench == "startup":
+        bench_startup(args.runs)
+    elif args.bench == "audit":
+        bench_audit(args.windows)
+    elif args.bench == "activity":
+        bench_activity(args.days, args.spans_per_day)
+    elif args.bench == "stall":
+        bench_stall(args.latency, args.threshold)
+
+
+if __name__ == "__main__":
+    main()
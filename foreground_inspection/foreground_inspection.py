@@ -7,32 +7,74 @@
   - {"command": "start"} - 开始检测
   - {"command": "stop"} - 停止检测
   - {"command": "get_status"} - 获取当前状态
-  - {"command": "set_api_key", "api_key": "xxx"} - 设置 API Key（运行时）
+  - {"command": "set_api_key", "api_key": "xxx"} - 设置 API Key（运行时，后台验证，结果通过 api_key_updated 返回）
   - {"command": "add_whitelist", "keyword": "xxx"} - 添加到白名单
   - {"command": "add_blacklist", "keyword": "xxx"} - 添加到黑名单
+  - {"command": "set_audit", "enabled": true, "interval": 30} - 后台巡检：定期分类所有可见窗口（检测运行期间）
+  - {"command": "query_activity", "group": "app", "period": "day", "days": 7, "limit": 10}
+    汇总检测期间各窗口的前台时长（group: app/category/title，period: day/week），结果通过 activity 事件返回
+  - {"command": "get_metrics", "format": "json"} - 获取指标（format 为 "prometheus" 时返回文本格式）
+  - {"command": "start_profile", "interval_ms": 5, "duration": 60, "path": "..."} - 开始对所有线程栈采样
+    （省略 path 时写到 profiles/foreground-时间.folded）
+  - {"command": "stop_profile"} - 结束采样并写出 collapsed stack 文件（可以直接画火焰图）
   
 - Python -> Electron: JSON格式字符串，以换行符结束
-  - {"event": "ready", "data": {}}
+  - {"event": "ready", "data": {"api_key_valid": false, "startup": {"ready": 12.3}}}
+    openai 在第一次用到 AI 时才导入，黑白名单/历史记录、判定包在 ready 之后的后台线程里加载
   - {"event": "entertainment_detected", "data": {"window_title": "xxx"}}
   - {"event": "status", "data": {"running": true, "current_window": "xxx"}}
+  - {"event": "background_entertainment", "data": {"windows": [{"window_title": "xxx", "source": "ai", "keyword": "xxx"}]}}
+    巡检发现新的后台娱乐窗口时发送（同一窗口持续可见时只报一次）
+  - {"event": "activity", "data": {"group": "app", "period": "day", "buckets": [
+        {"period": "2026-10-19", "total": 5400, "items": [{"key": "Visual Studio Code", "seconds": 3600}]}]}}
+  - {"event": "api_key_updated", "data": {"valid": true, "reason": null, "cached": false, "applied": true, "elapsed_ms": 320}}
+    reason 为 timeout / error 时 applied 为 false，继续使用旧 key
+  - {"event": "metrics", "data": {"format": "json", "uptime": 120.5, "metrics": {"foreground_classify_seconds": {...}}}}
+  - {"event": "profile_started", "data": {"running": true, "path": "...", "interval_ms": 5, "duration": 60}}
+  - {"event": "profile_saved", "data": {"running": false, "path": "...", "samples": 1200, "stacks": 35, "overhead_pct": 0.4, ...}}
+    stop_profile 或到达 duration 时发送；采样出错（已在采样、没有在采样、写文件失败）时发送 profile_error
+  - {"event": "profile_error", "data": {"message": "..."}}
+  - {"event": "stall_detected", "data": {"loop": "detection", "thread": "MainThread", "stalled": 5.2, "threshold": 5.0,
+                                          "location": "ai_request (foreground_inspection.py:219)",
+                                          "innermost": "...", "stack": [...], "threads": {"线程名": [...]}}}
+    检测循环（含 AI 请求）或巡检超过 --stall-threshold 秒没有推进时发送，同一次卡顿只发一次；
+    卡顿次数和最长一次见 get_status 的 stalls，以及指标 foreground_stalls / foreground_stall_seconds
   - {"event": "error", "data": {"message": "xxx"}}
+
+命令行参数（Electron 不传，用于测试和性能测试）:
+  --window-source win32|mock  窗口来源（非 Windows 默认 mock）
+  --mock-windows path.json    mock 窗口文件：{"foreground": "标题", "windows": ["标题", ...]}，修改后自动重新读取
+  --audit-interval 30         启动即开启后台巡检（秒，0 关闭）
+  --metrics-file path.prom    每 --metrics-interval 秒（默认 10）把指标写成 Prometheus 文本文件
+  --stall-threshold 5         检测循环多少秒没有推进算卡顿（巡检用 3 倍），0 关闭
 """
 
-import ctypes
 import time
+
+STARTED_AT = time.perf_counter()
+
+import argparse
+import ctypes
+import hashlib
 import json
 import os
 import sys
 import threading
-from openai import OpenAI
+from activity_recorder import ActivityRecorder, ActivityStore
+from verdict_pack import VerdictPacks
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "sidecar"))
+from metrics import Registry
+from profiler import Profiler
+from stall_watchdog import Watchdog
 
 # 设置UTF-8编码（用于与Electron通信）
 sys.stdin.reconfigure(encoding='utf-8')
 sys.stdout.reconfigure(encoding='utf-8')
 sys.stderr.reconfigure(encoding='utf-8')
 
-# Windows API 函数
-user32 = ctypes.windll.user32
+# Windows API 函数（非 Windows 下用 mock 窗口来源）
+user32 = ctypes.windll.user32 if sys.platform == "win32" else None
 
 
 def get_base_path():
@@ -48,6 +90,21 @@ def get_base_path():
 BASE_PATH = get_base_path()
 MODEL_CONFIG_FILE = os.path.join(BASE_PATH, "model_config.json")
 LIST_CONFIG_FILE = os.path.join(BASE_PATH, "list_config.json")
+AI_USAGE_FILE = os.path.join(BASE_PATH, "ai_usage.json")
+VERDICT_PACK_DIR = os.path.join(BASE_PATH, "verdict_packs")  # 预编译的判定包（*.vpk）
+ACTIVITY_DIR = os.path.join(BASE_PATH, "activity")  # 前台时段记录（列式文件）
+
+API_TIMEOUT = 10.0  # 单次 API 请求的超时（秒），端点卡住时不会无限等待
+AUDIT_BATCH = 20  # 巡检时一次 AI 请求最多分类多少个标题
+
+metrics = Registry("foreground")
+ai_in_flight = metrics.gauge("ai_requests_in_flight", "正在进行的 AI 请求数（挂住的请求会一直计在这里）")
+# 按需采样（start_profile / stop_profile），到时间自动结束时也发送 profile_saved
+profiler = Profiler("foreground", on_saved=lambda result: state.send_event("profile_saved", result))
+# 卡顿看门狗：检测循环和巡检线程每轮发一次心跳（AI 请求挂住时能看到卡在哪）
+watchdog = Watchdog("foreground", metrics, on_stall=lambda data: state.send_event("stall_detected", data))
+detection_heartbeat = watchdog.heartbeat("detection")
+audit_heartbeat = watchdog.heartbeat("audit")
 
 
 # ============ 默认配置 ============
@@ -57,6 +114,17 @@ DEFAULT_MODEL_CONFIG = {
     "model": "deepseek-chat"
 }
 
+# AI 调用限制，可在 model_config.json 的 "limits" 里覆盖
+DEFAULT_AI_LIMITS = {
+    "rate_per_minute": 20,       # 令牌桶：每分钟补充的调用次数
+    "burst": 5,                  # 令牌桶容量（允许的突发调用次数）
+    "daily_calls": 500,          # 每天最多调用次数
+    "daily_tokens": 200000,      # 每天最多消耗的 token 数
+    "breaker_failures": 3,       # 连续失败多少次后熔断
+    "breaker_cooldown": 60,      # 熔断后多少秒放一次试探请求
+    "failure_ttl": 300           # 查询失败的标题在多少秒内不再重试
+}
+
 DEFAULT_LIST_CONFIG = {
     "whitelist": [
         "文件资源管理器",
@@ -94,8 +162,11 @@ def load_json_file(file_path, default_config):
 
 def save_json_file(file_path, config):
     """保存 JSON 配置文件"""
+    t0 = time.perf_counter()
     with open(file_path, 'w', encoding='utf-8') as f:
         json.dump(config, f, ensure_ascii=False, indent=4)
+    metrics.histogram("config_save_seconds", "配置文件（历史记录、AI 用量）保存耗时",
+                      file=os.path.basename(file_path)).observe(time.perf_counter() - t0)
 
 
 def load_model_config():
@@ -113,26 +184,73 @@ def save_list_config(config):
     save_json_file(LIST_CONFIG_FILE, config)
 
 
+openai = None  # 第一次用到 AI 时由 load_openai 导入
+openai_lock = threading.Lock()
+
+
+def load_openai():
+    """
+    导入 openai（连带 httpx/pydantic，打包后要几百毫秒）
+    启动时还没有 API Key 用不到它，放到 set_api_key 的后台验证或第一次 AI 查询时再导入
+    """
+    global openai
+    with openai_lock:
+        if openai is None:
+            t0 = time.perf_counter()
+            import openai as module
+            openai = module
+            state.startup["openai"] = round((time.perf_counter() - t0) * 1000, 1)
+    return openai
+
+
+def create_client(api_key, model_config):
+    """创建 OpenAI 客户端（带超时，不自动重试）"""
+    return load_openai().OpenAI(
+        api_key=api_key,
+        base_url=model_config.get("base_url", "https://api.deepseek.com"),
+        timeout=API_TIMEOUT,
+        max_retries=0,
+    )
+
+
+def ai_request(client, kind, **kwargs):
+    """发一次 chat.completions 请求，往返耗时按 kind（validate/single/batch）和结果记入 ai_request_seconds"""
+    t0 = time.perf_counter()
+    outcome = "error"
+    ai_in_flight.inc()
+    try:
+        response = client.chat.completions.create(**kwargs)
+        outcome = "ok"
+        if response.usage:
+            metrics.counter("ai_tokens", "AI 请求消耗的 token 数", kind=kind).inc(response.usage.total_tokens)
+        return response
+    finally:
+        ai_in_flight.dec()
+        metrics.histogram("ai_request_seconds", "AI 请求往返耗时", kind=kind,
+                          outcome=outcome).observe(time.perf_counter() - t0)
+
+
 def validate_api_key(api_key, model_config):
     """
     验证 API key 是否有效
-    返回: (is_valid, error_message)
+    返回: (is_valid, reason)
+    - reason: None（有效）/ "empty" / "invalid"（服务端明确拒绝）/ "timeout" / "error"（网络等临时问题）
     注意：无效时不报错，只是返回 False，让后续逻辑跳过 AI 验证
     """
     # 检查是否是空值
     if not api_key:
-        return False, None
+        return False, "empty"
+    
+    openai = load_openai()
     
     # 尝试一次简单请求验证
     try:
-        client = OpenAI(
-            api_key=api_key,
-            base_url=model_config.get("base_url", "https://api.deepseek.com"),
-        )
+        client = create_client(api_key, model_config)
         
         model = model_config.get("model", "deepseek-chat")
         
-        response = client.chat.completions.create(
+        response = ai_request(
+            client, "validate",
             model=model,
             messages=[
                 {"role": "user", "content": "hi"}
@@ -140,28 +258,386 @@ def validate_api_key(api_key, model_config):
             max_tokens=5
         )
         return True, None
+    except openai.APITimeoutError:
+        return False, "timeout"
+    except (openai.AuthenticationError, openai.PermissionDeniedError, openai.NotFoundError):
+        # 401/403/404：key 或模型不可用，结果是确定的
+        return False, "invalid"
     except Exception as e:
         # 验证失败，静默处理
-        return False, None
+        print(f"API key 验证请求失败: {e}", file=sys.stderr)
+        return False, "error"
 
 
-# ============ 窗口检测 ============
+class KeyValidator:
+    """
+    API Key 后台验证
+    - set_api_key 只登记新 key，验证请求在后台线程里做，不持有 state.lock
+    - 结果按 (base_url, model, key) 缓存，重复设置同一个 key 不再请求
+      只缓存确定的结果（有效 / 被服务端拒绝），超时和网络错误下次重新验证
+    - 连续设置多次时只有最后一次的结果生效
+    - 请求超过 API_TIMEOUT 仍未返回时按超时上报，迟到的结果直接丢弃
+    - 只有确定的结果（有效 / 无效 / 清除）才切换 key，超时和网络错误保留旧 key 和有效性
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.cache = {}  # 摘要 -> is_valid
+        self.generation = 0  # 每次 set_api_key 加一
+        self.reported = 0  # 已上报结果的 generation
+        self.pending = False  # 是否有验证正在进行
+    
+    @staticmethod
+    def cache_key(api_key, model_config):
+        """缓存键：只保存摘要，不在缓存里再存一份明文 key"""
+        text = "\n".join([
+            model_config.get("base_url", ""),
+            model_config.get("model", ""),
+            api_key,
+        ])
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+    
+    def submit(self, api_key, model_config):
+        """登记新的 API Key 并开始验证（立即返回）"""
+        start = time.time()
+        with self.lock:
+            self.generation += 1
+            generation = self.generation
+            digest = self.cache_key(api_key, model_config) if api_key else None
+            cached = self.cache.get(digest) if digest else None
+            self.pending = bool(api_key) and cached is None
+        
+        if not api_key:
+            self.finish(generation, api_key, False, "empty", False, start)
+        elif cached is not None:
+            self.finish(generation, api_key, cached, None if cached else "invalid", True, start)
+        else:
+            def worker():
+                is_valid, reason = validate_api_key(api_key, model_config)
+                if reason in (None, "invalid"):
+                    with self.lock:
+                        self.cache[digest] = is_valid
+                self.finish(generation, api_key, is_valid, reason, False, start)
+            
+            threading.Thread(target=worker, daemon=True).start()
+            # 兜底：请求库的超时没生效时也按时给出结果
+            timer = threading.Timer(
+                API_TIMEOUT + 1.0, self.finish,
+                args=(generation, api_key, False, "timeout", False, start)
+            )
+            timer.daemon = True
+            timer.start()
+    
+    def finish(self, generation, api_key, is_valid, reason, cached, start):
+        """上报验证结果（过期或已上报的结果直接丢弃）"""
+        with self.lock:
+            if generation != self.generation or generation == self.reported:
+                return
+            self.reported = generation
+            self.pending = False
+        
+        # key 和有效性一起切换，检测循环不会拿新 key 配旧的有效性
+        applied = reason in (None, "invalid", "empty")
+        if applied:
+            with state.lock:
+                state.api_key = api_key
+                state.api_key_valid = is_valid
+        
+        if is_valid:
+            print("API key 设置成功，AI 识别功能可用", file=sys.stderr)
+        elif reason == "empty":
+            print("API key 已清除", file=sys.stderr)
+        elif reason == "invalid":
+            print("API key 无效，AI 识别功能不可用", file=sys.stderr)
+        else:
+            print(f"API key 验证失败（{reason}），继续使用原来的 key", file=sys.stderr)
+        
+        state.send_event("api_key_updated", {
+            "valid": is_valid,
+            "reason": reason,
+            "cached": cached,
+            "applied": applied,
+            "elapsed_ms": round((time.time() - start) * 1000)
+        })
+
 
-def get_foreground_window_title():
-    """获取前台窗口的标题"""
-    hwnd = user32.GetForegroundWindow()
-    if hwnd == 0:
+# ============ AI 调用限制 ============
+
+class AIGuard:
+    """
+    分类接口的调用限制（只在 check_is_entertainment 的 AI 步骤前后使用）
+    - 令牌桶限速 + 每日调用次数/token 预算（按天计数，保存在 ai_usage.json）
+    - 熔断器：连续失败 breaker_failures 次后打开，冷却 breaker_cooldown 秒后半开，
+      只放一个试探请求，成功则关闭，失败则重新打开
+    - 查询失败的标题在 failure_ttl 秒内直接返回"查询失败"，不再重复请求
+    """
+    
+    def __init__(self, limits=None):
+        self.lock = threading.Lock()
+        self.limits = dict(DEFAULT_AI_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.tokens = float(self.limits["burst"])
+        self.refilled_at = time.monotonic()
+        
+        self.breaker = "closed"  # closed / open / half_open
+        self.failures = 0  # 连续失败次数
+        self.opened_at = 0.0
+        self.probing = False  # 半开状态下试探请求是否在进行
+        
+        self.failed_titles = {}  # 窗口标题 -> 过期时间（monotonic）
+        self.usage = {"date": time.strftime("%Y-%m-%d"), "calls": 0, "tokens": 0}
+        self.counters = {"allowed": 0, "succeeded": 0, "failed": 0, "rate_limited": 0,
+                         "budget_exhausted": 0, "circuit_open": 0, "cached_failure": 0}
+    
+    def configure(self, limits):
+        """按 model_config.json 的 "limits" 覆盖默认值"""
+        with self.lock:
+            self.limits.update(limits or {})
+            self.tokens = min(self.tokens, float(self.limits["burst"]))
+    
+    def load_usage(self):
+        """读取今天已用的调用次数和 token（跨天自动清零）"""
+        usage = load_json_file(AI_USAGE_FILE, self.usage)
+        with self.lock:
+            if usage.get("date") == time.strftime("%Y-%m-%d"):
+                self.usage = {"date": usage["date"], "calls": usage.get("calls", 0), "tokens": usage.get("tokens", 0)}
+    
+    def roll_day(self):
+        """跨天时清零每日计数（调用方持有 self.lock）"""
+        today = time.strftime("%Y-%m-%d")
+        if self.usage["date"] != today:
+            self.usage = {"date": today, "calls": 0, "tokens": 0}
+    
+    def acquire(self, window_title=None):
+        """
+        请求一次 AI 调用的许可（批量请求不传标题，先用 recently_failed 过滤）
+        返回: None 表示允许；否则是拒绝原因
+        "cached_failure" / "circuit_open" / "budget_exhausted" / "rate_limited"
+        """
+        now = time.monotonic()
+        with self.lock:
+            if window_title is not None and self.is_failed(window_title, now):
+                return self.reject("cached_failure")
+            
+            if self.breaker == "open":
+                if now - self.opened_at < self.limits["breaker_cooldown"]:
+                    return self.reject("circuit_open")
+                self.breaker = "half_open"
+            if self.breaker == "half_open":
+                if self.probing:
+                    return self.reject("circuit_open")
+            
+            self.roll_day()
+            if (self.usage["calls"] >= self.limits["daily_calls"]
+                    or self.usage["tokens"] >= self.limits["daily_tokens"]):
+                return self.reject("budget_exhausted")
+            
+            rate = self.limits["rate_per_minute"] / 60.0
+            self.tokens = min(float(self.limits["burst"]), self.tokens + (now - self.refilled_at) * rate)
+            self.refilled_at = now
+            if self.tokens < 1.0:
+                return self.reject("rate_limited")
+            
+            self.tokens -= 1.0
+            if self.breaker == "half_open":
+                self.probing = True
+            self.usage["calls"] += 1
+            self.counters["allowed"] += 1
+        self.save_usage()
         return None
     
-    length = user32.GetWindowTextLengthW(hwnd)
-    if length == 0:
-        return ""
+    def is_failed(self, window_title, now):
+        """标题是否还在失败缓存里（调用方持有 self.lock）"""
+        expires = self.failed_titles.get(window_title)
+        if expires is None:
+            return False
+        if expires > now:
+            return True
+        del self.failed_titles[window_title]
+        return False
+    
+    def recently_failed(self, titles):
+        """过滤出还在失败缓存里的标题"""
+        now = time.monotonic()
+        with self.lock:
+            return {t for t in titles if self.is_failed(t, now)}
+    
+    def reject(self, reason):
+        """记一次拒绝（调用方持有 self.lock）"""
+        self.counters[reason] += 1
+        return reason
+    
+    def record_success(self, tokens_used):
+        """AI 调用成功：关闭熔断器，累计 token"""
+        with self.lock:
+            self.roll_day()
+            self.usage["tokens"] += tokens_used
+            self.failures = 0
+            self.probing = False
+            if self.breaker != "closed":
+                print("AI 接口已恢复，熔断器关闭", file=sys.stderr)
+            self.breaker = "closed"
+            self.counters["succeeded"] += 1
+        self.save_usage()
     
-    buffer = ctypes.create_unicode_buffer(length + 1)
-    user32.GetWindowTextW(hwnd, buffer, length + 1)
-    return buffer.value
+    def record_failure(self, *window_titles):
+        """AI 调用失败（批量请求失败也只算一次）：短时间内不再查询这些标题，连续失败达到阈值时熔断"""
+        with self.lock:
+            now = time.monotonic()
+            for window_title in window_titles:
+                self.failed_titles[window_title] = now + self.limits["failure_ttl"]
+            # 顺便清掉过期的失败记录，避免无限增长
+            if len(self.failed_titles) > 1000:
+                self.failed_titles = {t: e for t, e in self.failed_titles.items() if e > now}
+            self.failures += 1
+            self.probing = False
+            self.counters["failed"] += 1
+            if self.breaker == "half_open" or self.failures >= self.limits["breaker_failures"]:
+                if self.breaker != "open":
+                    print(f"AI 接口连续失败 {self.failures} 次，熔断 {self.limits['breaker_cooldown']} 秒", file=sys.stderr)
+                self.breaker = "open"
+                self.opened_at = now
+    
+    def save_usage(self):
+        with self.lock:
+            usage = dict(self.usage)
+        try:
+            save_json_file(AI_USAGE_FILE, usage)
+        except IOError as e:
+            print(f"保存 AI 用量失败: {e}", file=sys.stderr)
+    
+    def snapshot(self):
+        """当前限流/熔断状态（get_status 用）"""
+        with self.lock:
+            now = time.monotonic()
+            self.roll_day()
+            rate = self.limits["rate_per_minute"] / 60.0
+            tokens = min(float(self.limits["burst"]), self.tokens + (now - self.refilled_at) * rate)
+            retry_in = 0.0
+            if self.breaker == "open":
+                retry_in = max(0.0, self.limits["breaker_cooldown"] - (now - self.opened_at))
+            return {
+                "breaker": self.breaker,
+                "consecutive_failures": self.failures,
+                "retry_in": round(retry_in, 1),
+                "rate_tokens": round(tokens, 2),
+                "calls_today": self.usage["calls"],
+                "tokens_today": self.usage["tokens"],
+                "daily_calls": self.limits["daily_calls"],
+                "daily_tokens": self.limits["daily_tokens"],
+                "failed_titles": sum(1 for e in self.failed_titles.values() if e > now),
+                "counters": dict(self.counters)
+            }
 
 
+ai_guard = AIGuard()
+BREAKER_STATES = {"closed": 0, "half_open": 1, "open": 2}
+metrics.gauge("ai_breaker_state", "AI 熔断器状态：0 关闭，1 半开，2 打开", fn=lambda: BREAKER_STATES[ai_guard.breaker])
+metrics.gauge("ai_rate_tokens", "AI 限速令牌桶里剩余的令牌", fn=lambda: ai_guard.snapshot()["rate_tokens"])
+verdict_packs = VerdictPacks()
+activity_store = ActivityStore(ACTIVITY_DIR)
+activity = ActivityRecorder(activity_store)
+
+
+# ============ 窗口来源 ============
+
+class Win32WindowSource:
+    """Windows：前台窗口标题、所有可见顶层窗口的标题"""
+    name = "win32"
+    
+    GW_OWNER = 4
+    GWL_EXSTYLE = -20
+    WS_EX_TOOLWINDOW = 0x00000080
+    DWMWA_CLOAKED = 14
+    
+    def __init__(self):
+        self.enum_proc_type = ctypes.WINFUNCTYPE(ctypes.c_bool, ctypes.c_void_p, ctypes.c_void_p)
+        self.dwmapi = ctypes.windll.dwmapi
+    
+    def window_text(self, hwnd):
+        length = user32.GetWindowTextLengthW(hwnd)
+        if length == 0:
+            return ""
+        buffer = ctypes.create_unicode_buffer(length + 1)
+        user32.GetWindowTextW(hwnd, buffer, length + 1)
+        return buffer.value
+    
+    def foreground_title(self):
+        """获取前台窗口的标题"""
+        hwnd = user32.GetForegroundWindow()
+        if hwnd == 0:
+            return None
+        return self.window_text(hwnd)
+    
+    def is_cloaked(self, hwnd):
+        """被系统隐藏的窗口（其他虚拟桌面上的、挂起的 UWP 应用）"""
+        cloaked = ctypes.c_int(0)
+        self.dwmapi.DwmGetWindowAttribute(hwnd, self.DWMWA_CLOAKED, ctypes.byref(cloaked), ctypes.sizeof(cloaked))
+        return cloaked.value != 0
+    
+    def visible_titles(self):
+        """所有可见的顶层应用窗口（跳过最小化、工具窗口、被其他窗口拥有的弹窗和被隐藏的窗口）"""
+        titles = []
+        
+        def callback(hwnd, lparam):
+            if (user32.IsWindowVisible(hwnd) and not user32.IsIconic(hwnd)
+                    and not user32.GetWindow(hwnd, self.GW_OWNER)
+                    and not user32.GetWindowLongW(hwnd, self.GWL_EXSTYLE) & self.WS_EX_TOOLWINDOW
+                    and not self.is_cloaked(hwnd)):
+                title = self.window_text(hwnd)
+                if title:
+                    titles.append(title)
+            return True
+        
+        user32.EnumWindows(self.enum_proc_type(callback), 0)
+        return titles
+
+
+class MockWindowSource:
+    """
+    模拟窗口来源（非 Windows 下测试用）
+    从 JSON 文件读取 {"foreground": "标题", "windows": ["标题", ...]}，文件修改后下次调用时重新读取
+    没有文件时既没有前台窗口也没有可见窗口
+    """
+    name = "mock"
+    
+    def __init__(self, path=None):
+        self.path = path
+        self.mtime = None
+        self.data = {}
+    
+    def load(self):
+        if not self.path:
+            return self.data
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime != self.mtime:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.data = json.load(f)
+                self.mtime = mtime
+        except (OSError, json.JSONDecodeError):
+            pass  # 正在被改写时下次再读
+        return self.data
+    
+    def foreground_title(self):
+        return self.load().get("foreground")
+    
+    def visible_titles(self):
+        return list(self.load().get("windows", []))
+
+
+def create_window_source(args):
+    if args.window_source == "mock":
+        return MockWindowSource(args.mock_windows)
+    return Win32WindowSource()
+
+
+window_source = MockWindowSource()  # 主程序里按命令行参数替换
+
+
+# ============ 窗口检测 ============
+
 def check_list(window_title, keyword_list):
     """检查窗口标题是否包含关键字列表中的任意关键字"""
     for keyword in keyword_list:
@@ -170,43 +646,63 @@ def check_list(window_title, keyword_list):
     return False
 
 
-def check_is_entertainment(window_title, api_key, model_config, list_config, api_key_valid=True):
+def check_local(window_title, list_config):
     """
-    检查窗口是否为娱乐类应用
-    优先级：白名单 -> 黑名单 -> 历史记录 -> AI API
-    
-    返回: (结果, 来源, 关键字, list_config)
-    - 结果: "是" / "不是" / "查询失败"
-    - 来源: "whitelist" / "blacklist" / "history" / "ai" / "no_api"
-    - 关键字: 匹配到的关键字（黑名单时为匹配的关键字，history时为完整窗口标题）
+    只查本地：白名单 -> 黑名单 -> 历史记录 -> 判定包
+    返回 (结果, 来源, 关键字)，都没有命中时返回 None
     """
     # 1. 先查白名单（优先级最高）
     whitelist = list_config.get("whitelist", [])
     for keyword in whitelist:
         if keyword in window_title:
-            return "不是", "whitelist", keyword, list_config
+            return "不是", "whitelist", keyword
     
     # 2. 再查黑名单
     blacklist = list_config.get("blacklist", [])
     for keyword in blacklist:
         if keyword in window_title:
-            return "是", "blacklist", keyword, list_config
+            return "是", "blacklist", keyword
     
     # 3. 查历史记录
     history = list_config.get("history", {})
     if window_title in history:
-        return history[window_title], "history", window_title, list_config
+        return history[window_title], "history", window_title
     
-    # 4. API Key 无效时，跳过 AI 验证，默认返回"不是"
+    # 4. 查判定包（其他机器的历史记录编译成的只读表，本机历史记录优先）
+    verdict = verdict_packs.lookup(window_title)
+    if verdict is not None:
+        return verdict, "pack", window_title
+    return None
+
+
+def check_is_entertainment(window_title, api_key, model_config, list_config, api_key_valid=True):
+    """
+    检查窗口是否为娱乐类应用
+    优先级：白名单 -> 黑名单 -> 历史记录 -> 判定包 -> AI API
+    
+    返回: (结果, 来源, 关键字, list_config)
+    - 结果: "是" / "不是" / "查询失败"
+    - 来源: "whitelist" / "blacklist" / "history" / "pack" / "ai" / "no_api"，
+      被 ai_guard 拦下时是拒绝原因（"cached_failure" / "circuit_open" / "budget_exhausted" / "rate_limited"）
+    - 关键字: 匹配到的关键字（黑名单时为匹配的关键字，history/pack 时为完整窗口标题）
+    """
+    # 1~4. 白名单、黑名单、历史记录、判定包
+    local = check_local(window_title, list_config)
+    if local is not None:
+        return local + (list_config,)
+    
+    # 5. API Key 无效时，跳过 AI 验证，默认返回"不是"
     if not api_key_valid:
         return "不是", "no_api", window_title, list_config
     
-    # 5. 调用 AI API
+    # 6. 限流/预算/熔断检查
+    rejected = ai_guard.acquire(window_title)
+    if rejected:
+        return "查询失败", rejected, window_title, list_config
+    
+    # 7. 调用 AI API
     try:
-        client = OpenAI(
-            api_key=api_key,
-            base_url=model_config.get("base_url", "https://api.deepseek.com"),
-        )
+        client = create_client(api_key, model_config)
         
         model = model_config.get("model", "deepseek-chat")
         
@@ -221,7 +717,8 @@ def check_is_entertainment(window_title, api_key, model_config, list_config, api
 
         user_prompt = f"窗口名称：{window_title}"
 
-        response = client.chat.completions.create(
+        response = ai_request(
+            client, "single",
             model=model,
             messages=[
                 {"role": "system", "content": system_prompt},
@@ -231,17 +728,139 @@ def check_is_entertainment(window_title, api_key, model_config, list_config, api
         )
         result = json.loads(response.choices[0].message.content)
         is_entertainment = result.get("is_entertainment", "不是")
+        ai_guard.record_success(response.usage.total_tokens if response.usage else 0)
         
-        # 保存到历史记录
-        list_config["history"][window_title] = is_entertainment
-        save_list_config(list_config)
+        # 保存到历史记录（巡检线程也会写历史记录）
+        with state.lock:
+            list_config["history"][window_title] = is_entertainment
+            save_list_config(list_config)
         
         return is_entertainment, "ai", window_title, list_config
     except Exception as e:
         print(f"AI查询失败: {e}", file=sys.stderr)
+        ai_guard.record_failure(window_title)
         return "查询失败", "ai", window_title, list_config
 
 
+def classify_batch(titles, api_key, model_config):
+    """
+    一次请求分类多个窗口标题（巡检用）
+    返回 {标题: "是"/"不是"}，回答里缺少或格式不对的标题不在结果里；请求失败时抛出异常
+    """
+    client = create_client(api_key, model_config)
+    
+    system_prompt = """你是一个窗口分类助手。用户会提供一组窗口名称（JSON 数组），逐个判断该应用是否属于娱乐类（如游戏、视频、音乐、直播、社交媒体等）。
+
+请仅输出 JSON 格式，键为原样的窗口名称：
+{
+    "results": {"窗口名称": "是" 或 "不是"}
+}
+
+不确定时回答"不是"。"""
+
+    user_prompt = "窗口名称列表：" + json.dumps(titles, ensure_ascii=False)
+    
+    response = ai_request(
+        client, "batch",
+        model=model_config.get("model", "deepseek-chat"),
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ],
+        response_format={'type': 'json_object'}
+    )
+    results = json.loads(response.choices[0].message.content).get("results", {})
+    ai_guard.record_success(response.usage.total_tokens if response.usage else 0)
+    return {t: results[t] for t in titles if results.get(t) in ("是", "不是")}
+
+
+# ============ 后台巡检 ============
+
+def audit_pass():
+    """
+    巡检一次所有可见窗口
+    - 本地（黑白名单/历史记录/判定包）查不到的标题合并成一次 AI 请求，结果写入历史记录，
+      之后切到这些窗口时直接命中历史记录
+    - 新出现的后台娱乐窗口（不是当前前台）发送 background_entertainment
+    """
+    t0 = time.perf_counter()
+    titles = list(dict.fromkeys(t for t in window_source.visible_titles() if t))
+    with state.lock:
+        list_config = state.list_config
+        api_key, api_key_valid = state.api_key, state.api_key_valid
+        foreground = state.current_window
+    
+    verdicts = {}
+    unknown = []
+    for title in titles:
+        local = check_local(title, list_config)
+        if local is not None:
+            verdicts[title] = local
+        else:
+            unknown.append(title)
+    
+    classified = 0
+    if unknown and api_key_valid:
+        failed = ai_guard.recently_failed(unknown)
+        batch = [t for t in unknown if t not in failed][:AUDIT_BATCH]
+        if batch and ai_guard.acquire() is None:
+            try:
+                results = classify_batch(batch, api_key, state.model_config)
+            except Exception as e:
+                print(f"巡检 AI 查询失败: {e}", file=sys.stderr)
+                ai_guard.record_failure(*batch)
+                results = {}
+            if results:
+                with state.lock:
+                    list_config["history"].update(results)
+                    save_list_config(list_config)
+            for title, verdict in results.items():
+                verdicts[title] = (verdict, "ai", title)
+            classified = len(results)
+    
+    flagged = {t: v for t, v in verdicts.items() if v[0] == "是" and t != foreground}
+    with state.lock:
+        new = [t for t in flagged if t not in state.audit_flagged]
+        state.audit_flagged = set(flagged)
+        state.audit["passes"] += 1
+        state.audit["windows"] = len(titles)
+        state.audit["classified"] += classified
+        state.audit["flagged"] = len(flagged)
+        state.audit["last_pass_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+    metrics.histogram("audit_pass_seconds", "后台巡检一次的耗时（含批量 AI 请求）").observe(time.perf_counter() - t0)
+    
+    if new:
+        timestamp = time.strftime("%H:%M:%S", time.localtime())
+        print(f"[{timestamp}] 巡检发现后台娱乐窗口: {new}", file=sys.stderr)
+        state.send_event("background_entertainment", {
+            "windows": [{"window_title": t, "source": flagged[t][1], "keyword": flagged[t][2]} for t in new],
+            "timestamp": timestamp
+        })
+
+
+def audit_loop():
+    """后台巡检线程：检测运行且开启巡检时，每 audit_interval 秒巡检一次"""
+    last_pass = 0.0
+    while True:
+        audit_heartbeat.beat()
+        with state.lock:
+            if state.should_exit:
+                audit_heartbeat.idle()
+                break
+            interval = state.audit_interval
+            running = state.running
+        
+        if (running and interval > 0 and state.config_ready.is_set()
+                and time.monotonic() - last_pass >= interval):
+            last_pass = time.monotonic()
+            try:
+                audit_pass()
+            except Exception as e:
+                print(f"巡检失败: {e}", file=sys.stderr)
+        
+        time.sleep(0.2)
+
+
 # ============ 状态管理 ============
 
 class DetectionState:
@@ -251,36 +870,65 @@ class DetectionState:
         self.current_window = ""  # 当前窗口标题
         self.last_title = None  # 上次检测的窗口标题
         self.lock = threading.Lock()
+        self.output_lock = threading.Lock()  # 多个线程都会发事件，逐行写出
+        self.stream = None  # 事件输出流，None 表示 stdout（合并宿主进程里换成共享的输出通道）
+        self.service = None  # 合并宿主进程里给每条事件加上 "service" 字段
         
         # 配置
         self.api_key = None  # API Key（运行时设置，内存中）
         self.model_config = None
         self.list_config = None
         self.api_key_valid = False  # API Key 是否有效
+        self.config_ready = threading.Event()  # 黑白名单/历史记录已在后台加载完
+        self.startup = {}  # 启动各步骤耗时（毫秒）
+        
+        # 后台巡检
+        self.audit_interval = 0.0  # 巡检间隔（秒），0 表示关闭
+        self.audit_flagged = set()  # 上次巡检发现的后台娱乐窗口（只报告新出现的）
+        self.audit = {"passes": 0, "windows": 0, "classified": 0, "flagged": 0, "last_pass_ms": 0.0}
     
     def send_event(self, event_type, data):
         """向stdout发送事件（给Electron）"""
-        output = json.dumps({"event": event_type, "data": data}, ensure_ascii=False)
-        sys.stdout.write(output + "\n")
-        sys.stdout.flush()
+        message = {"event": event_type, "data": data}
+        if self.service:
+            message["service"] = self.service
+        output = json.dumps(message, ensure_ascii=False)
+        stream = self.stream or sys.stdout
+        with self.output_lock:
+            stream.write(output + "\n")
+            stream.flush()
     
     def send_status(self):
         """发送当前状态"""
         with self.lock:
             self.send_event("status", {
                 "running": self.running,
-                "current_window": self.current_window
+                "current_window": self.current_window,
+                "api_key_valid": self.api_key_valid,
+                "api_key_validating": validator.pending,
+                "ai": ai_guard.snapshot(),
+                "audit": dict(self.audit, interval=self.audit_interval),
+                "stalls": watchdog.snapshot(),
+                "startup": dict(self.startup)
             })
 
 
 state = DetectionState()
+validator = KeyValidator()
 
 
 # ============ 命令处理 ============
 
+# 需要黑白名单/历史记录、活动记录的命令，要等后台加载完
+CONFIG_COMMANDS = ("add_whitelist", "add_blacklist", "mark_history_not", "move_blacklist_to_whitelist",
+                   "query_activity")
+
+
 def process_command(command_obj):
     """处理来自Electron的命令"""
     command = command_obj.get("command")
+    if command in CONFIG_COMMANDS:
+        state.config_ready.wait()
     
     if command == "start":
         with state.lock:
@@ -295,29 +943,36 @@ def process_command(command_obj):
                 state.running = False
                 state.current_window = ""
                 state.last_title = None
+                state.audit_flagged = set()
+                activity.close()
                 print("检测已停止", file=sys.stderr)
                 state.send_event("status", {"running": False, "current_window": ""})
     
     elif command == "get_status":
         state.send_status()
     
+    elif command == "get_metrics":
+        state.send_event("metrics", metrics.payload(command_obj.get("format", "json")))
+    
+    elif command == "start_profile":
+        path = command_obj.get("path") or os.path.join(
+            BASE_PATH, "profiles", time.strftime("foreground-%Y%m%d-%H%M%S.folded"))
+        try:
+            state.send_event("profile_started", profiler.start(
+                path, command_obj.get("interval_ms", 5), command_obj.get("duration", 60)))
+        except (RuntimeError, OSError, ValueError, TypeError) as e:
+            state.send_event("profile_error", {"message": str(e)})
+    
+    elif command == "stop_profile":
+        try:
+            state.send_event("profile_saved", profiler.stop())
+        except (RuntimeError, OSError) as e:
+            state.send_event("profile_error", {"message": str(e)})
+    
     elif command == "set_api_key":
-        # 运行时设置 API Key
+        # 运行时设置 API Key：后台验证，验证期间继续使用旧 key，结果通过 api_key_updated 返回
         api_key = command_obj.get("api_key")
-        with state.lock:
-            state.api_key = api_key
-            # 验证新的 API Key
-            if api_key:
-                is_valid, _ = validate_api_key(api_key, state.model_config)
-                state.api_key_valid = is_valid
-                if is_valid:
-                    print("API key 设置成功，AI 识别功能可用", file=sys.stderr)
-                else:
-                    print("API key 无效，AI 识别功能不可用", file=sys.stderr)
-            else:
-                state.api_key_valid = False
-                print("API key 已清除", file=sys.stderr)
-            state.send_event("api_key_updated", {"valid": state.api_key_valid})
+        validator.submit(api_key, state.model_config)
     
     elif command == "add_whitelist":
         keyword = command_obj.get("keyword")
@@ -364,6 +1019,34 @@ def process_command(command_obj):
                 print(f"已将 '{keyword}' 从黑名单移到白名单", file=sys.stderr)
                 state.send_event("moved_to_whitelist", {"keyword": keyword})
     
+    elif command == "set_audit":
+        # 开关后台巡检（只在检测运行期间巡检）
+        enabled = bool(command_obj.get("enabled", True))
+        interval = float(command_obj.get("interval") or state.audit_interval or 30)
+        with state.lock:
+            state.audit_interval = interval if enabled else 0.0
+            if not enabled:
+                state.audit_flagged = set()
+        if enabled:
+            print(f"后台巡检已开启，间隔 {interval} 秒", file=sys.stderr)
+        else:
+            print("后台巡检已关闭", file=sys.stderr)
+        state.send_event("audit_updated", {"enabled": enabled, "interval": interval})
+    
+    elif command == "query_activity":
+        # 在 stdin 线程里汇总，几个月的记录也只要几毫秒
+        try:
+            result = activity_store.query(
+                group=command_obj.get("group", "app"),
+                period=command_obj.get("period", "day"),
+                days=int(command_obj.get("days", 7)),
+                limit=int(command_obj.get("limit", 10))
+            )
+            state.send_event("activity", result)
+        except Exception as e:
+            print(f"查询活动记录失败: {e}", file=sys.stderr)
+            state.send_event("error", {"message": f"查询活动记录失败: {e}"})
+    
     elif command == "exit":
         with state.lock:
             state.should_exit = True
@@ -395,17 +1078,18 @@ def detection_loop():
     """检测循环（主线程）"""
     print("前台检测程序已启动，等待命令...", file=sys.stderr)
     
-    # 发送准备就绪事件（API Key 需要运行时设置）
+    # 发送准备就绪事件（API Key 需要运行时设置，黑白名单还在后台加载）
+    state.startup["ready"] = round((time.perf_counter() - STARTED_AT) * 1000, 1)
     state.send_event("ready", {
-        "whitelist_count": len(state.list_config.get("whitelist", [])),
-        "blacklist_count": len(state.list_config.get("blacklist", [])),
-        "api_key_valid": False  # 初始时没有 API Key
+        "api_key_valid": False,  # 初始时没有 API Key
+        "startup": dict(state.startup)
     })
     
     last_check_time = 0
     check_interval = 1.0  # 检测间隔（秒）
     
     while True:
+        detection_heartbeat.beat()
         # 检查是否应该退出
         with state.lock:
             if state.should_exit:
@@ -418,23 +1102,32 @@ def detection_loop():
         with state.lock:
             is_running = state.running
         
-        if is_running and (current_time - last_check_time >= check_interval):
+        if is_running and state.config_ready.is_set() and (current_time - last_check_time >= check_interval):
             last_check_time = current_time
             
             # 获取前台窗口标题
-            current_title = get_foreground_window_title()
+            current_title = window_source.foreground_title()
             
             if current_title is not None and current_title != state.last_title:
                 if current_title:  # 非空标题才查询
+                    with state.lock:
+                        api_key, api_key_valid = state.api_key, state.api_key_valid
+                    
                     # 判断是否为娱乐应用
+                    t0 = time.perf_counter()
                     is_entertainment, source, keyword, state.list_config = check_is_entertainment(
-                        current_title, state.api_key, state.model_config, state.list_config, state.api_key_valid
+                        current_title, api_key, state.model_config, state.list_config, api_key_valid
                     )
+                    metrics.histogram("classify_seconds", "前台窗口分类耗时（按判定来源）",
+                                      source=source).observe(time.perf_counter() - t0)
                     
                     with state.lock:
                         state.current_window = current_title
                         state.last_title = current_title
                     
+                    # 上一个窗口的停留时段到此结束
+                    activity.switch(current_title, is_entertainment, source, current_time)
+                    
                     # 如果是娱乐应用，发送事件
                     if is_entertainment == "是":
                         timestamp = time.strftime("%H:%M:%S", time.localtime())
@@ -448,25 +1141,107 @@ def detection_loop():
                     else:
                         timestamp = time.strftime("%H:%M:%S", time.localtime())
                         print(f"[{timestamp}] 当前前台: {current_title} ({is_entertainment})", file=sys.stderr)
-        
+                else:
+                    # 没有标题（桌面、锁屏等）：不查询，但上一个窗口的停留时段到此结束
+                    with state.lock:
+                        state.current_window = ""
+                        state.last_title = current_title
+                    activity.close(current_time)
+
         time.sleep(0.1)  # 短暂休眠，避免占用CPU
     
+    detection_heartbeat.idle()
+    activity.close()
     print("前台检测程序已退出", file=sys.stderr)
 
 
 # ============ 主程序 ============
 
-if __name__ == "__main__":
-    # 加载配置（不再加载 API 配置文件）
+def set_base_path(folder):
+    """把配置和数据文件换到 folder（合并宿主进程的 exe 不在 foreground_inspection 目录时使用）"""
+    global BASE_PATH, MODEL_CONFIG_FILE, LIST_CONFIG_FILE, AI_USAGE_FILE, VERDICT_PACK_DIR, ACTIVITY_DIR
+    BASE_PATH = folder
+    MODEL_CONFIG_FILE = os.path.join(BASE_PATH, "model_config.json")
+    LIST_CONFIG_FILE = os.path.join(BASE_PATH, "list_config.json")
+    AI_USAGE_FILE = os.path.join(BASE_PATH, "ai_usage.json")
+    VERDICT_PACK_DIR = os.path.join(BASE_PATH, "verdict_packs")
+    ACTIVITY_DIR = os.path.join(BASE_PATH, "activity")
+    activity_store.folder = ACTIVITY_DIR
+
+
+def load_detector_config():
+    """ready 之后在后台加载黑白名单/历史记录、AI 用量和判定包，耗时记入 state.startup"""
+    t0 = time.perf_counter()
+    try:
+        list_config = load_list_config()
+        ai_guard.configure(state.model_config.get("limits"))
+        ai_guard.load_usage()
+        verdict_packs.load_dir(VERDICT_PACK_DIR)
+    except Exception as e:
+        print(f"加载配置失败: {e}", file=sys.stderr)
+        list_config = DEFAULT_LIST_CONFIG.copy()
+    try:
+        activity_store.open()
+    except OSError as e:
+        print(f"打开活动记录失败，本次不记录: {e}", file=sys.stderr)
+    with state.lock:
+        state.list_config = list_config
+    state.startup["config"] = round((time.perf_counter() - t0) * 1000, 1)
+    state.config_ready.set()
+    print(f"白名单 {len(list_config.get('whitelist', []))} 项 | 黑名单 {len(list_config.get('blacklist', []))} 项 | "
+          f"历史记录 {len(list_config.get('history', {}))} 条", file=sys.stderr)
+    if verdict_packs.packs:
+        print(f"已加载 {len(verdict_packs.packs)} 个判定包，共 {len(verdict_packs)} 个标题", file=sys.stderr)
+
+
+def parse_args(argv=None):
+    """命令行参数；Electron 不传参数，其余用于测试和性能测试"""
+    parser = argparse.ArgumentParser(description="前台窗口检测")
+    parser.add_argument("--window-source", choices=("win32", "mock"),
+                        default="win32" if sys.platform == "win32" else "mock", help="窗口来源")
+    parser.add_argument("--mock-windows", help="mock 窗口来源读取的 JSON 文件")
+    parser.add_argument("--audit-interval", type=float, default=0.0, help="后台巡检间隔（秒），0 关闭")
+    parser.add_argument("--config-dir", help="配置和数据文件所在目录（默认程序所在目录）")
+    parser.add_argument("--metrics-file", help="定期把指标写成 Prometheus 文本文件")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="写指标文件的间隔（秒）")
+    parser.add_argument("--stall-threshold", type=float, default=5.0,
+                        help="检测循环超过多少秒没有推进算卡顿（发送 stall_detected），0 关闭")
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def main(args, read_stdin=True):
+    """
+    检测程序主流程：发 ready、后台加载配置，检测循环运行到收到 exit
+    单独运行时由 __main__ 调用；合并宿主进程（sidecar/sidecar_host.py）在线程里调用，read_stdin=False
+    """
+    global window_source
+    if args.config_dir:
+        set_base_path(args.config_dir)
+    window_source = create_window_source(args)
+    state.audit_interval = args.audit_interval
+    metrics.start_export(args.metrics_file, args.metrics_interval)
+    # 巡检一次要批量请求 AI，比检测循环慢得多，阈值放宽
+    audit_heartbeat.threshold = args.stall_threshold * 3
+    watchdog.start(args.stall_threshold)
+    
+    # 模型配置很小，set_api_key 验证要用，先同步加载（不再加载 API 配置文件）
     state.model_config = load_model_config()
-    state.list_config = load_list_config()
     
     print(f"API 地址: {state.model_config.get('base_url')} | 模型: {state.model_config.get('model')}", file=sys.stderr)
     print("等待 Electron 发送 API Key...", file=sys.stderr)
     
-    # 启动stdin读取线程
-    stdin_thread = threading.Thread(target=stdin_reader, daemon=True)
-    stdin_thread.start()
+    # 启动stdin读取线程（合并宿主进程里由宿主读 stdin 并转发命令）
+    if read_stdin:
+        stdin_thread = threading.Thread(target=stdin_reader, daemon=True)
+        stdin_thread.start()
+    
+    threading.Thread(target=load_detector_config, daemon=True).start()
+    threading.Thread(target=audit_loop, daemon=True).start()
     
-    # 主线程运行检测循环
+    # 检测循环（单独运行时在主线程）
     detection_loop()
+
+
+if __name__ == "__main__":
+    main(parse_args())
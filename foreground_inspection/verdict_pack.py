@@ -0,0 +1,202 @@
+"""
+判定包（verdict pack）：预先编译好的 窗口标题 -> 是否娱乐 只读表
+
+每台机器都会通过 AI 重新学一遍同样的判定（Steam、WeGame、bilibili...），
+判定包把多份导出的历史记录（list_config.json）合并成一个文件，启动时内存映射，
+在 check_is_entertainment 里排在历史记录之后、AI 之前查询。
+
+文件格式（小端）:
+  header   "VPK1" | u32 条目数 n | u32 字符串区长度
+  offsets  u32 × (n + 1)     第 i 个标题在字符串区的 [offsets[i], offsets[i+1])
+  verdicts u8 × n            1 = "是"，0 = "不是"
+  strings  UTF-8 标题，按字节序排好，首尾相接
+查找在内存映射上二分，O(log n)；加载只读 header，多个进程共享同一份页缓存。
+
+用法:
+  python verdict_pack.py build out.vpk list_config.json [更多 list_config.json ...] [--min-votes 1]
+    合并历史记录（多数表决，平票算"不是"，忽略"查询失败"）并写出判定包
+  python verdict_pack.py lookup pack.vpk "窗口标题"
+  python verdict_pack.py info pack.vpk
+"""
+
+import argparse
+import json
+import mmap
+import os
+import struct
+import sys
+from collections import Counter
+
+MAGIC = b"VPK1"
+HEADER = struct.Struct("<4sII")
+VERDICTS = {"是": 1, "不是": 0}
+
+
+class VerdictPack:
+    """一个内存映射的判定包（只读）"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.count, strings_size = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(f"不是判定包: {path}")
+        self.offsets_at = HEADER.size
+        self.verdicts_at = self.offsets_at + 4 * (self.count + 1)
+        self.strings_at = self.verdicts_at + self.count
+        if self.strings_at + strings_size > len(self.mm):
+            self.mm.close()
+            raise ValueError(f"判定包已损坏: {path}")
+        if sys.byteorder == "little" and struct.calcsize("I") == 4:
+            # 文件里是小端 u32，和本机 "I" 相同时直接在映射上转换，不复制
+            self.offsets = memoryview(self.mm)[self.offsets_at:self.verdicts_at].cast("I")
+        else:
+            self.offsets = struct.unpack_from(f"<{self.count + 1}I", self.mm, self.offsets_at)
+
+    def key(self, i):
+        start = self.strings_at + self.offsets[i]
+        return self.mm[start:self.strings_at + self.offsets[i + 1]]
+
+    def lookup(self, window_title):
+        """二分查找标题，返回 "是" / "不是"，没有则返回 None"""
+        target = window_title.encode("utf-8")
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            key = self.key(mid)
+            if key < target:
+                lo = mid + 1
+            elif key > target:
+                hi = mid
+            else:
+                return "是" if self.mm[self.verdicts_at + mid] else "不是"
+        return None
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+        self.mm.close()
+
+
+class VerdictPacks:
+    """一个目录下的所有判定包，按文件名顺序查询，先命中的为准"""
+
+    def __init__(self):
+        self.packs = []
+
+    def load_dir(self, folder):
+        if not os.path.isdir(folder):
+            return
+        for name in sorted(os.listdir(folder)):
+            if not name.endswith(".vpk"):
+                continue
+            try:
+                self.packs.append(VerdictPack(os.path.join(folder, name)))
+            except (OSError, ValueError) as e:
+                print(f"加载判定包失败 {name}: {e}", file=sys.stderr)
+
+    def lookup(self, window_title):
+        for pack in self.packs:
+            verdict = pack.lookup(window_title)
+            if verdict is not None:
+                return verdict
+        return None
+
+    def __len__(self):
+        return sum(len(pack) for pack in self.packs)
+
+
+# ============ 编译 ============
+
+def merge_histories(histories, min_votes=1):
+    """
+    合并多份历史记录：每个标题多数表决，平票算"不是"（和 AI 提示词"不确定时回答不是"一致）
+    返回 {标题: "是"/"不是"}，票数不足 min_votes 的标题丢弃
+    """
+    votes = {}
+    for history in histories:
+        for title, verdict in history.items():
+            if verdict in VERDICTS and title:
+                votes.setdefault(title, Counter())[verdict] += 1
+    merged = {}
+    for title, counter in votes.items():
+        if sum(counter.values()) < min_votes:
+            continue
+        merged[title] = "是" if counter["是"] > counter["不是"] else "不是"
+    return merged
+
+
+def write_pack(path, verdicts):
+    """
+    把 {标题: "是"/"不是"} 写成判定包（先写临时文件再替换，不会留下写了一半的包）
+    Windows 上不能替换正在被映射的文件：前台检测程序运行时覆盖它加载的包会抛出 PermissionError，
+    要先停止前台检测再重建
+    """
+    items = sorted((title.encode("utf-8"), VERDICTS[verdict]) for title, verdict in verdicts.items())
+    offsets = [0]
+    for key, _ in items:
+        offsets.append(offsets[-1] + len(key))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, len(items), offsets[-1]))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(bytes(v for _, v in items))
+        for key, _ in items:
+            f.write(key)
+    try:
+        os.replace(tmp, path)
+    except PermissionError:
+        os.remove(tmp)
+        raise
+    return len(items)
+
+
+def load_history(path):
+    """读取导出的历史：list_config.json（取 "history"）或者直接是 {标题: 判定}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("history", data) if isinstance(data, dict) else {}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="判定包编译/查询工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_build = sub.add_parser("build", help="把导出的历史记录编译成判定包")
+    p_build.add_argument("output")
+    p_build.add_argument("histories", nargs="+")
+    p_build.add_argument("--min-votes", type=int, default=1, help="至少几份历史记录里出现过才收录")
+
+    p_lookup = sub.add_parser("lookup", help="查询一个标题")
+    p_lookup.add_argument("pack")
+    p_lookup.add_argument("title")
+
+    p_info = sub.add_parser("info", help="判定包统计")
+    p_info.add_argument("pack")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        merged = merge_histories((load_history(p) for p in args.histories), args.min_votes)
+        try:
+            count = write_pack(args.output, merged)
+        except PermissionError as e:
+            print(f"无法替换 {args.output}: {e}（判定包正在被前台检测程序使用，请先退出番茄钟再重建）", file=sys.stderr)
+            sys.exit(1)
+        entertainment = sum(1 for v in merged.values() if v == "是")
+        print(f"已写入 {args.output}: {count} 个标题（娱乐 {entertainment}），{os.path.getsize(args.output)} 字节")
+    elif args.command == "lookup":
+        pack = VerdictPack(args.pack)
+        print(pack.lookup(args.title))
+    elif args.command == "info":
+        pack = VerdictPack(args.pack)
+        entertainment = sum(pack.mm[pack.verdicts_at:pack.strings_at])
+        print(f"{args.pack}: {len(pack)} 个标题（娱乐 {entertainment}），{len(pack.mm)} 字节")
+
+
+if __name__ == "__main__":
+    main()
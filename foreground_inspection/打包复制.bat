@@ -1,2 +1,2 @@
-pyinstaller --onefile foreground_inspection.py
+pyinstaller --onefile --paths ..\sidecar foreground_inspection.py
 copy /Y "dist\foreground_inspection.exe" "foreground_inspection.exe"
\ No newline at end of file
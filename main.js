@@ -4,9 +4,12 @@
 
 const { app, BrowserWindow, ipcMain, Notification, Tray, nativeImage, Menu } = require('electron')
 const path = require('path')
+const fs = require('fs')
 const musicProcess = require('./src/modules/musicProcess')
+const downloaderProcess = require('./src/modules/downloaderProcess')
 const aiAssistant = require('./src/modules/aiAssistant')
 const foregroundInspection = require('./src/modules/foregroundInspection')
+const sidecarHost = require('./src/modules/sidecarHost')
 const cloudAuth = require('./src/modules/cloudAuth')
 const dataManager = require('./src/modules/dataManager')
 
@@ -108,7 +111,25 @@ function createWindow() {
   // 用户需要先登录，admin 用户才能获取 API Key
   console.log('[Main] 等待用户登录...')
   
-  musicProcess.start(musicExePath, savedDeviceId)
+  // 合并模式（保存的数据里 combinedSidecar 为 true 且 sidecar_host.exe 存在）：
+  // 音乐播放器和前台检测运行在同一个宿主进程里，否则仍然分别启动两个进程
+  const hostExePath = app.isPackaged
+    ? path.join(process.resourcesPath, 'sidecar_host.exe')
+    : path.join(__dirname, 'sidecar', 'sidecar_host.exe')
+  const useSidecarHost = savedData.combinedSidecar === true && fs.existsSync(hostExePath)
+  
+  if (useSidecarHost) {
+    // 宿主 exe 的目录和两个程序的 exe 不同，音乐文件夹、快捷键和前台检测的配置目录显式传入
+    const musicDir = path.dirname(musicExePath)
+    const musicArgs = savedDeviceId !== undefined && savedDeviceId !== null ? [String(savedDeviceId)] : []
+    sidecarHost.start(hostExePath, {
+      music: [...musicArgs, '--music-dir', path.join(musicDir, 'music'), '--hotkeys', path.join(musicDir, 'hotkeys.json')],
+      foreground: ['--config-dir', app.isPackaged ? process.resourcesPath : path.join(__dirname, 'foreground_inspection')]
+    })
+    musicProcess.attach(sidecarHost)
+  } else {
+    musicProcess.start(musicExePath, savedDeviceId)
+  }
   
   // 设置音乐进程回调，转发到渲染进程
   musicProcess.onReady((data) => {
@@ -149,6 +170,49 @@ function createWindow() {
     win.webContents.send('music-volume-change', data)
   })
   
+  musicProcess.onWaveform((data) => {
+    win.webContents.send('music-waveform', data)
+  })
+  
+  musicProcess.onTrackAdded((data) => {
+    win.webContents.send('music-track-added', data)
+  })
+  
+  musicProcess.onMetrics((data) => {
+    win.webContents.send('music-metrics', data)
+  })
+  
+  musicProcess.onProfile((data) => {
+    win.webContents.send('music-profile', data)
+  })
+  
+  // 播放循环卡顿（可能在页面加载前发生，缓存到页面就绪）
+  musicProcess.onStall((data) => {
+    sendToRenderer('music-stall', data)
+  })
+  
+  // 下载器（第一次下载时才启动），下载结果保存到播放器的 music 文件夹
+  const downloaderExePath = app.isPackaged
+    ? path.join(process.resourcesPath, 'youget_download.exe')
+    : path.join(__dirname, 'music-player', 'youget_download.exe')
+  downloaderProcess.configure(downloaderExePath, path.join(path.dirname(musicExePath), 'music'))
+  
+  downloaderProcess.onProgress((data) => {
+    win.webContents.send('music-download-progress', data)
+  })
+  
+  downloaderProcess.onDone((data) => {
+    // 通知正在运行的播放器把新歌加入播放列表，不用重启
+    for (const name of data.outputs || []) {
+      musicProcess.ingest(name)
+    }
+    win.webContents.send('music-download-done', data)
+  })
+  
+  downloaderProcess.onError((data) => {
+    win.webContents.send('music-download-error', data)
+  })
+  
   // 启动前台检测进程
   let foregroundExePath
   if (app.isPackaged) {
@@ -158,7 +222,11 @@ function createWindow() {
   }
   
   // 启动前台检测，不传入 API Key（等待用户登录后设置）
-  foregroundInspection.start(foregroundExePath, null)
+  if (useSidecarHost) {
+    foregroundInspection.attach(sidecarHost)
+  } else {
+    foregroundInspection.start(foregroundExePath, null)
+  }
   
   // 设置前台检测回调，转发到渲染进程
   foregroundInspection.onReady((data) => {
@@ -184,6 +252,26 @@ function createWindow() {
   foregroundInspection.onError((data) => {
     win.webContents.send('foreground-error', data)
   })
+  
+  foregroundInspection.onActivity((data) => {
+    win.webContents.send('foreground-activity', data)
+  })
+  
+  foregroundInspection.onMetrics((data) => {
+    win.webContents.send('foreground-metrics', data)
+  })
+  
+  foregroundInspection.onProfile((data) => {
+    win.webContents.send('foreground-profile', data)
+  })
+  
+  foregroundInspection.onStall((data) => {
+    sendToRenderer('foreground-stall', data)
+  })
+  
+  foregroundInspection.onBackgroundEntertainment((data) => {
+    sendToRenderer('foreground-background-entertainment', data)
+  })
 }
 
 // 存储菜园子窗口引用
@@ -386,6 +474,30 @@ ipcMain.on('music-get-devices', () => {
   musicProcess.getDevices()
 })
 
+ipcMain.on('music-get-waveform', (event, name) => {
+  musicProcess.getWaveform(name)
+})
+
+ipcMain.on('music-refresh-devices', () => {
+  musicProcess.refreshDevices()
+})
+
+ipcMain.on('music-get-metrics', (event, format) => {
+  musicProcess.getMetrics(format)
+})
+
+ipcMain.on('music-start-profile', (event, options) => {
+  musicProcess.startProfile(options)
+})
+
+ipcMain.on('music-stop-profile', () => {
+  musicProcess.stopProfile()
+})
+
+ipcMain.on('music-download', (event, url) => {
+  downloaderProcess.download(url)
+})
+
 ipcMain.on('music-set-device', (event, deviceId) => {
   musicProcess.setDevice(deviceId)
   // 保存设备ID到数据文件
@@ -438,6 +550,26 @@ ipcMain.on('foreground-move-blacklist-to-whitelist', (event, keyword) => {
   foregroundInspection.moveBlacklistToWhitelist(keyword)
 })
 
+ipcMain.on('foreground-set-audit', (event, enabled, interval) => {
+  foregroundInspection.setAudit(enabled, interval)
+})
+
+ipcMain.on('foreground-query-activity', (event, options) => {
+  foregroundInspection.queryActivity(options)
+})
+
+ipcMain.on('foreground-get-metrics', (event, format) => {
+  foregroundInspection.getMetrics(format)
+})
+
+ipcMain.on('foreground-start-profile', (event, options) => {
+  foregroundInspection.startProfile(options)
+})
+
+ipcMain.on('foreground-stop-profile', () => {
+  foregroundInspection.stopProfile()
+})
+
 // ============ 窗口置顶 IPC 处理 ============
 
 ipcMain.on('set-always-on-top', (event, onTop) => {
@@ -606,6 +738,7 @@ app.whenReady().then(() => {
 
 app.on('window-all-closed', () => {
   musicProcess.stop()
+  downloaderProcess.stop()
   foregroundInspection.stop()
   
   if (process.platform !== 'darwin') {
@@ -615,5 +748,6 @@ app.on('window-all-closed', () => {
 
 app.on('before-quit', () => {
   musicProcess.stop()
+  downloaderProcess.stop()
   foregroundInspection.stop()
 })
\ No newline at end of file
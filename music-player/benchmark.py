@@ -0,0 +1,1178 @@
+"""
+音乐播放器性能测试脚本
+
+用法:
+  python benchmark.py wav [--minutes 10 120]
+    对比 WAV 内存映射与整段解码的首样本耗时、跳转耗时和常驻内存(RSS)
+    每种情况在独立子进程中测量，互不影响
+  python benchmark.py resample
+    离线测试重采样质量（正弦 SNR、超出奈奎斯特频率的残留）和吞吐量（倍实时）
+  python benchmark.py crossfade [--seconds 3]
+    不接声卡，检查交叉淡化前后样本是否连续，并统计每秒混音耗费的 CPU 时间（不含重采样）
+  python benchmark.py hotkeys
+    键盘钩子回调耗时：原来每次按键 5 次嵌套遍历 vs 预编译位掩码（用假的按键对象，不需要 pynput）
+  python benchmark.py downloader [--urls 12]
+    用假的 you-get/ffmpeg（放在临时目录并加到 PATH 前面）测试 youget_download.py 批量模式：
+    串行与流水线并发的总耗时、最高画质与纯音频/最小格式的下载量、复制音频流的个数、失败任务不影响其它任务、
+    换了网址写法按来源索引跳过、中断后按清单续传不重复下载、服务模式下载完成后播放器 ingest（只支持类 Unix 系统）
+  python benchmark.py dedup [--tracks 2000]
+    内容指纹的区分度（转码、音量、片头静音 vs 不同的歌）和去重索引建立/增量加入的耗时
+  python benchmark.py player [--tracks 6 --track-seconds 60]
+    端到端测试：以 null 后端启动 music.py 子进程，全部通过 stdin JSON 协议控制，统计
+    启动到 ready 的耗时（有/无会话缓存）、解码吞吐量（倍实时）、播放循环 CPU、toggle/next/seek 响应延迟、每首歌的内存增长、
+    事件速率和暂停时的空闲 CPU、get_metrics 返回的写入/解码耗时（CPU/内存读取 /proc，只支持 Linux）
+  python benchmark.py profile [--seconds 5 --interval-ms 5]
+    播放中对比采样前后的 CPU、音频块写入耗时和疑似欠载次数，打印采样次数、开销和样本最多的栈
+  python benchmark.py stall [--block 3 --threshold 1]
+    卡顿看门狗：在本进程里运行播放器（null 后端），让一次音频块写入阻塞 block 秒（模拟声卡驱动卡住），
+    统计从卡住到 stall_detected 的耗时和报告的位置；暂停超过阈值不应误报；另外测一次心跳的耗时
+"""
+
+import argparse
+import enum
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(SCRIPT_DIR, os.pardir, 'sidecar'))
+from metrics import Histogram
+CHUNK_SIZE = 4096
+
+
+def current_rss():
+    """当前进程常驻内存（MB）"""
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [
+                ("cb", wintypes.DWORD),
+                ("PageFaultCount", wintypes.DWORD),
+                ("PeakWorkingSetSize", ctypes.c_size_t),
+                ("WorkingSetSize", ctypes.c_size_t),
+                ("QuotaPeakPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t),
+                ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                ("PagefileUsage", ctypes.c_size_t),
+                ("PeakPagefileUsage", ctypes.c_size_t),
+            ]
+
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(counters), counters.cb
+        )
+        return counters.WorkingSetSize / (1024 * 1024)
+    return process_rss('self')
+
+
+def process_rss(pid):
+    """/proc 中指定进程的常驻内存（MB）"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def write_test_wav(path, minutes, samplerate=44100, channels=2):
+    """分块写入 16bit 测试 WAV（噪声），避免一次性占用大量内存"""
+    total = int(minutes * 60 * samplerate)
+    block = samplerate * 10
+    rng = np.random.default_rng(0)
+    with wave.open(path, 'wb') as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(samplerate)
+        written = 0
+        while written < total:
+            n = min(block, total - written)
+            w.writeframes(rng.integers(-8000, 8000, size=(n, channels), dtype=np.int16).tobytes())
+            written += n
+
+
+# ============ WAV 内存映射 vs 整段解码 ============
+
+def probe_wav(mode, path):
+    """子进程中执行：加载、取第一个 chunk、跳到中间再取一个 chunk"""
+    sys.path.insert(0, SCRIPT_DIR)
+    import music
+
+    rss_before = current_rss()
+    t0 = time.perf_counter()
+    if mode == 'mmap':
+        data, fs = music.load_audio(path)
+    else:
+        with music.sf.SoundFile(path) as f:
+            fs = f.samplerate
+            data = f.read(always_2d=True).astype('float32')
+    chunk = (data[0:CHUNK_SIZE] * 1.0).astype('float32')
+    first_sample = time.perf_counter() - t0
+    rss_first = current_rss()
+
+    t1 = time.perf_counter()
+    middle = len(data) // 2
+    chunk = (data[middle:middle + CHUNK_SIZE] * 1.0).astype('float32')
+    seek = time.perf_counter() - t1
+
+    print(json.dumps({
+        "first_sample_ms": first_sample * 1000,
+        "seek_ms": seek * 1000,
+        "rss_mb": rss_first - rss_before,
+        "rss_after_seek_mb": current_rss() - rss_before,
+    }))
+
+
+def bench_wav(minutes_list):
+    with tempfile.TemporaryDirectory() as tmp:
+        for minutes in minutes_list:
+            path = os.path.join(tmp, f"test_{minutes}min.wav")
+            print(f"生成 {minutes} 分钟测试文件...", file=sys.stderr)
+            write_test_wav(path, minutes)
+            size_mb = os.path.getsize(path) / (1024 * 1024)
+            print(f"\n{minutes} 分钟 WAV ({size_mb:.0f} MB)")
+            print(f"  {'模式':<8}{'首样本(ms)':>12}{'跳转(ms)':>12}{'RSS(MB)':>12}{'跳转后RSS(MB)':>16}")
+            for mode in ('mmap', 'decode'):
+                # 每次测量前清理页缓存的影响无法跨平台做到，这里只保证进程隔离
+                out = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '_probe_wav', mode, path],
+                    capture_output=True, text=True
+                )
+                if out.returncode != 0:
+                    print(f"  {mode:<8}失败: {out.stderr.strip().splitlines()[-1:]}")
+                    continue
+                r = json.loads(out.stdout.strip().splitlines()[-1])
+                print(f"  {mode:<8}{r['first_sample_ms']:>12.1f}{r['seek_ms']:>12.2f}"
+                      f"{r['rss_mb']:>12.1f}{r['rss_after_seek_mb']:>16.1f}")
+
+
+# ============ 重采样质量与吞吐量 ============
+
+class LinearResampler:
+    """对照组：逐声道线性插值（跨 chunk 保持相位连续）"""
+    def __init__(self, src_rate, dst_rate, src_channels, dst_channels):
+        self.ratio = src_rate / dst_rate
+        self.pos = 0.0          # 下一个输出样本对应的输入位置
+        self.consumed = 0       # 已输入的帧数
+        self.last = None
+
+    def process(self, chunk):
+        buf = chunk if self.last is None else np.concatenate((self.last, chunk))
+        first = self.consumed - (len(buf) - len(chunk))
+        end = self.consumed + len(chunk) - 1
+        n = max(0, int((end - self.pos) / self.ratio) + 1)
+        pos = self.pos + np.arange(n) * self.ratio
+        xp = np.arange(first, first + len(buf))
+        out = np.stack([np.interp(pos, xp, buf[:, c]) for c in range(buf.shape[1])], axis=1)
+        self.pos += n * self.ratio
+        self.consumed += len(chunk)
+        self.last = chunk[-1:]
+        return out.astype(np.float32)
+
+
+def tone(freq, samplerate, seconds, channels=2):
+    t = np.arange(int(samplerate * seconds)) / samplerate
+    return np.repeat((0.5 * np.sin(2 * np.pi * freq * t))[:, None], channels, axis=1).astype(np.float32)
+
+
+def run_resampler(resampler, x):
+    out = [resampler.process(x[i:i + CHUNK_SIZE]) for i in range(0, len(x), CHUNK_SIZE)]
+    if hasattr(resampler, 'flush'):
+        out.append(resampler.flush())
+    return np.concatenate(out)
+
+
+def spurious_level(y, samplerate, freq):
+    """输出中除 freq 附近以外的能量，相对满幅正弦（dB）；freq 高于奈奎斯特频率时即全部输出能量"""
+    seg = y[samplerate // 10:len(y) - samplerate // 10, 0].astype(np.float64)
+    # Kaiser 窗（beta=20）旁瓣足够低，不会把单音的泄漏算成混叠
+    window = np.kaiser(len(seg), 20.0)
+    power = np.abs(np.fft.rfft(seg * window)) ** 2 / np.sum(window ** 2) / len(seg) * 2
+    bins = np.fft.rfftfreq(len(seg), 1 / samplerate)
+    power[np.abs(bins - freq) < 200] = 0
+    # 整个频谱用 Parseval 换算成均方值，再和 0.5 幅度正弦的均方 0.125 比
+    return 10 * np.log10(max(power.sum(), 1e-30) / 0.125)
+
+
+def bench_resample():
+    sys.path.insert(0, SCRIPT_DIR)
+    import music
+
+    def variants(src_rate, dst_rate):
+        yield "linear", lambda: LinearResampler(src_rate, dst_rate, 2, 2)
+        for taps in (16, 32, 48, 64):
+            yield f"sinc{taps}", lambda taps=taps: music.Resampler(src_rate, dst_rate, 2, 2, taps=taps)
+
+    for src_rate, dst_rate in ((44100, 48000), (48000, 44100)):
+        print(f"\n{src_rate} -> {dst_rate}")
+        print(f"  {'算法':<8}{'1kHz SNR(dB)':>14}{'10kHz SNR(dB)':>15}{'混叠残留(dB)':>14}{'倍实时':>10}")
+        nyquist = min(src_rate, dst_rate) / 2
+        for label, factory in variants(src_rate, dst_rate):
+            snrs = []
+            for freq in (1000, 10000):
+                y = run_resampler(factory(), tone(freq, src_rate, 2))
+                ref = tone(freq, dst_rate, len(y) / dst_rate)[:len(y)]
+                seg = slice(dst_rate // 10, len(y) - dst_rate // 10)
+                err = y[seg, 0] - ref[seg, 0]
+                snrs.append(10 * np.log10(np.mean(ref[seg, 0] ** 2) / np.mean(err ** 2)))
+
+            # 降采样：高于目标奈奎斯特频率的单音应当被滤掉，输出里剩下的全是折叠回来的混叠
+            # 升采样：接近源奈奎斯特频率的单音会在 src_rate - f 处留下镜像，去掉单音本身后剩下的就是镜像
+            freq = nyquist * 1.05 if dst_rate < src_rate else nyquist * 0.9
+            alias = spurious_level(run_resampler(factory(), tone(freq, src_rate, 2)), dst_rate, freq)
+
+            x = tone(440, src_rate, 30)
+            t0 = time.perf_counter()
+            run_resampler(factory(), x)
+            speed = 30 / (time.perf_counter() - t0)
+            print(f"  {label:<8}{snrs[0]:>14.1f}{snrs[1]:>15.1f}{alias:>14.1f}{speed:>10.0f}")
+
+
+# ============ 交叉淡化 ============
+
+def bench_crossfade(seconds):
+    sys.path.insert(0, SCRIPT_DIR)
+    import music
+    import soundfile as sf
+
+    out_rate, out_channels = 48000, 2
+    music.output.samplerate = out_rate
+    music.output.channels = out_channels
+    music.state.normalize = False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        music.state.directory_path = tmp + os.sep
+        cases = [(44100, 2, 220), (48000, 1, 330), (32000, 2, 440)]
+        for i, (rate, channels, freq) in enumerate(cases):
+            sf.write(os.path.join(tmp, f"{i}.flac"), tone(freq, rate, seconds * 3, channels), rate)
+
+        print(f"交叉淡化 {seconds} 秒，输出 {out_rate}Hz/{out_channels}声道")
+        print(f"  {'曲目':<16}{'最大二阶差分':>14}{'正弦上限':>12}{'CPU(ms/秒)':>12}")
+        for (rate_a, ch_a, freq_a), (rate_b, ch_b, freq_b), name_b in (
+            (cases[0], cases[1], "1.flac"), (cases[1], cases[2], "2.flac"), (cases[2], cases[0], "0.flac")
+        ):
+            current = tone(freq_a, rate_a, seconds * 3, ch_a)
+            resampler = music.Resampler(rate_a, out_rate, ch_a, out_channels)
+            music.crossfader._prepare(name_b, seconds, music.crossfader.generation)
+            fade_start = len(current) - int(seconds * rate_a)
+
+            written = []
+            fade_index = None
+            mix_cpu = 0.0
+            mixed_frames = 0
+            fading = None
+            for start in range(0, len(current), CHUNK_SIZE):
+                chunk = current[start:start + CHUNK_SIZE]
+                if fading is None and start >= fade_start:
+                    fading = music.crossfader.take(name_b, int((len(current) - start) * out_rate / rate_a))
+                if fading is None:
+                    written.append(resampler.process(chunk))
+                else:
+                    if fade_index is None:
+                        fade_index = sum(len(w) for w in written)
+                    converted = resampler.process(chunk)
+                    t0 = time.process_time()
+                    mixed = music.crossfader.mix(converted, 1.0, fading)
+                    mix_cpu += time.process_time() - t0
+                    mixed_frames += len(mixed)
+                    written.append(mixed.copy())
+            written.append(music.crossfader.remainder(fading, 1.0))
+
+            # 交接后下一首沿用同一个 Resampler 继续
+            following = tone(freq_b, rate_b, seconds * 3, ch_b)[fading["frame"]:fading["frame"] + rate_b]
+            written.append(fading["resampler"].process(following))
+
+            # 只看淡化前 0.1 秒到交接后 1 秒（开头是从静音起播，本身就不连续）
+            y = np.concatenate(written)[fade_index - out_rate // 10:, 0]
+            second_diff = np.abs(np.diff(y, 2)).max()
+            # 两个正弦叠加时二阶差分的上限
+            bound = sum(0.5 * (2 * np.pi * f / out_rate) ** 2 for f in (freq_a, freq_b))
+            label = f"{rate_a // 1000}k/{ch_a}ch->{rate_b // 1000}k/{ch_b}ch"
+            cpu_per_second = mix_cpu / (mixed_frames / out_rate) * 1000
+            print(f"  {label:<16}{second_diff:>14.5f}{bound:>12.5f}{cpu_per_second:>12.2f}")
+
+
+# ============ 快捷键回调 ============
+
+class FakeKey(enum.Enum):
+    """代替 pynput.keyboard.Key：同样是枚举，name 是按键名"""
+    ctrl_r = 1
+    shift_r = 2
+    right = 3
+    left = 4
+    up = 5
+    down = 6
+    space = 7
+    enter = 8
+    backspace = 9
+
+
+class FakeKeyCode:
+    """代替 pynput.keyboard.KeyCode：按 char 比较和哈希"""
+    def __init__(self, char):
+        self.char = char
+        self.vk = ord(char.upper())
+
+    def __eq__(self, other):
+        return isinstance(other, FakeKeyCode) and other.char == self.char
+
+    def __hash__(self):
+        return hash(self.char)
+
+    def __str__(self):
+        return repr(self.char)
+
+
+class LegacyHotkeys:
+    """对照组：原来的实现，每次按键对 5 个组合各做一次 current_keys 的嵌套遍历和字符串转换"""
+    def __init__(self, combos, action):
+        self.combos = combos
+        self.action = action
+        self.current_keys = set()
+
+    @staticmethod
+    def key_to_str(key):
+        if isinstance(key, FakeKey):
+            return str(key)
+        elif isinstance(key, FakeKeyCode):
+            return key.char if key.char else str(key)
+
+    def keys_pressed(self, required_keys):
+        for k in required_keys:
+            found = False
+            for ck in self.current_keys:
+                if self.key_to_str(k) == self.key_to_str(ck):
+                    found = True
+                    break
+            if not found:
+                return False
+        return True
+
+    def press(self, key):
+        self.current_keys.add(key)
+        for combo in self.combos:
+            if self.keys_pressed(combo):
+                self.action()
+
+    def release(self, key):
+        self.current_keys.discard(key)
+
+
+def keystrokes(text, held=()):
+    """按住 held 的同时打出 text，返回 (press/release, 按键) 序列"""
+    keys = {c: FakeKey.space if c == ' ' else FakeKeyCode(c) for c in set(text)}
+    events = [("press", k) for k in held]
+    for c in text:
+        events += [("press", keys[c]), ("release", keys[c])]
+    events += [("release", k) for k in held]
+    return events
+
+
+def bench_hotkeys(rounds=2000):
+    sys.path.insert(0, SCRIPT_DIR)
+    import music
+
+    fired = [0]
+
+    def action():
+        fired[0] += 1
+
+    legacy_combos = [
+        {FakeKey.ctrl_r, FakeKey.shift_r},
+        {FakeKey.ctrl_r, FakeKey.right},
+        {FakeKey.ctrl_r, FakeKey.left},
+        {FakeKey.ctrl_r, FakeKey.up},
+        {FakeKey.ctrl_r, FakeKey.down},
+    ]
+    scenarios = {
+        "普通打字": keystrokes("the quick brown fox jumps over the lazy dog "),
+        "按住Shift打字": keystrokes("HELLO WORLD ", held=(FakeKey.shift_r,)),
+        "快捷键": [("press", FakeKey.ctrl_r)]
+                 + [(kind, key) for key in (FakeKey.right, FakeKey.up, FakeKey.down, FakeKey.left)
+                    for kind in ("press", "release")]
+                 + [("release", FakeKey.ctrl_r)],
+    }
+
+    print(f"  {'场景':<12}{'原实现(ns/事件)':>16}{'位掩码(ns/事件)':>16}{'加速':>8}")
+    for label, sequence in scenarios.items():
+        results = []
+        counts = []
+        for matcher in (LegacyHotkeys(legacy_combos, action),
+                        music.HotkeyMatcher(music.DEFAULT_HOTKEYS, {a: action for a in music.DEFAULT_HOTKEYS})):
+            fired[0] = 0
+            calls = [(matcher.press if kind == "press" else matcher.release, key) for kind, key in sequence]
+            t0 = time.perf_counter()
+            for _ in range(rounds):
+                for call, key in calls:
+                    call(key)
+            results.append((time.perf_counter() - t0) / (rounds * len(calls)) * 1e9)
+            counts.append(fired[0])
+        check = "" if counts[0] == counts[1] else f"  触发次数不一致 {counts}"
+        print(f"  {label:<12}{results[0]:>16.0f}{results[1]:>16.0f}{results[0] / results[1]:>7.1f}x{check}")
+
+
+# ============ 批量下载 ============
+
+FAKE_YOU_GET = r'''
+import os, sys, time, json
+args = sys.argv[1:]
+url = args[-1]
+with open(os.environ["FAKE_TOOL_LOG"], "a") as f:
+    f.write(json.dumps({"tool": "you-get", "args": args}) + "\n")
+delay = float(os.environ.get("FAKE_NET_DELAY", "0.3"))
+index = int(url.rsplit("BV", 1)[-1]) if "BV" in url else 0
+# 10 MiB 下载 delay 秒；每 3 个视频有一个提供纯音频流；音频编码 aac/mp3/opus 轮换
+formats = [("dash-flv1080", "mp4", "高清 1080P", 40), ("dash-flv720", "mp4", "高清 720P", 20),
+           ("dash-flv480", "mp4", "清晰 480P", 10)]
+if index % 3 == 0:
+    formats.append(("dash-audio", "m4a", "音频 192K", 4))
+codec = ("aac", "mp3", "opus")[index % 3]
+if "-i" in args:
+    time.sleep(delay / 5)
+    print("site: fake\ntitle: video\nstreams:")
+    for name, container, quality, mib in formats:
+        print(f"    - format:        {name}\n      container:     {container}\n      quality:       {quality}\n"
+              f"      size:          {mib:.1f} MiB ({mib * 1048576} bytes)\n      # download-with: you-get --format={name} [URL]\n")
+    sys.exit(0)
+if "fail" in url:
+    print("you-get: [Failed] network error", file=sys.stderr)
+    sys.exit(1)
+name = args[args.index("--format") + 1] if "--format" in args else formats[0][0]
+mib = next(f[3] for f in formats if f[0] == name)
+out = args[args.index("-o") + 1]
+for step in range(1, 5):
+    time.sleep(delay * mib / 40)
+    # 和 you-get 的进度条一样用 \r 刷新
+    sys.stdout.write(f"\r {step * 25:5.1f}% ({mib * step / 4:5.1f}/{mib:5.1f}MB) ├{'█' * step}{'─' * (4 - step)}┤[1/1]")
+    sys.stdout.flush()
+print()
+ext = "m4a" if name == "dash-audio" else "mp4"
+with open(os.path.join(out, "Video " + url.rsplit("/", 1)[-1] + "." + ext), "wb") as f:
+    f.write(f"codec={codec}\n".encode() + os.urandom(mib * 4096))
+'''
+
+FAKE_FFMPEG = r'''
+import os, sys, time, json
+args = sys.argv[1:]
+with open(os.environ["FAKE_TOOL_LOG"], "a") as f:
+    f.write(json.dumps({"tool": "ffmpeg", "args": args}) + "\n")
+source = args[args.index("-i") + 1]
+if args[-1] == source:
+    # 只有输入文件：打印流信息后以非零退出码结束（和真的 ffmpeg 一样）
+    with open(source, "rb") as f:
+        codec = f.readline().decode().strip().split("=")[1]
+    print("  Duration: 00:00:02.00, start: 0.000000, bitrate: 128 kb/s", file=sys.stderr)
+    print(f"  Stream #0:1[0x2](und): Audio: {codec} (mp4a / 0x6134706D), 48000 Hz, stereo, fltp", file=sys.stderr)
+    print("At least one output file must be specified", file=sys.stderr)
+    sys.exit(1)
+copy = "copy" in args
+seconds = 0.01 if copy else float(os.environ.get("FAKE_CPU_DELAY", "0.2"))
+for step in range(1, 5):
+    time.sleep(seconds / 4)
+    if "-progress" in args:
+        print(f"out_time_us={step * 500000}\nprogress={'end' if step == 4 else 'continue'}", flush=True)
+# 写一段 2 秒的正弦波，播放器 ingest 后能正常解码
+muxer = args[args.index("-f") + 1]
+try:
+    import numpy as np, soundfile as sf
+    fmt, subtype = {"mp3": ("MP3", "MPEG_LAYER_III"), "ogg": ("OGG", "VORBIS"), "flac": ("FLAC", "PCM_16")}[muxer]
+    tone = 0.2 * np.sin(2 * np.pi * 440 * np.arange(88200) / 44100)
+    sf.write(args[-1], np.column_stack([tone, tone]), 44100, format=fmt, subtype=subtype)
+except ImportError:
+    with open(args[-1], "wb") as f:
+        f.write(os.urandom(16 * 1024))
+'''
+
+
+def write_fake_tools(folder):
+    """假的 you-get / ffmpeg：按环境变量模拟网络/CPU 耗时，调用参数记录到 FAKE_TOOL_LOG"""
+    for name, source in (("you-get", FAKE_YOU_GET), ("ffmpeg", FAKE_FFMPEG)):
+        path = os.path.join(folder, name)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(f"#!{sys.executable}\n{source}")
+        os.chmod(path, 0o755)
+
+
+class DownloaderRun:
+    """在临时目录里运行一次 youget_download.py --batch"""
+    def __init__(self, tmp, urls_file, download_jobs, convert_jobs, quality="small"):
+        self.tmp = tmp
+        self.cmd = [
+            sys.executable, os.path.join(SCRIPT_DIR, 'youget_download.py'), '--batch', urls_file,
+            '--output', os.path.join(tmp, 'music'), '--work-dir', os.path.join(tmp, 'work'),
+            '--download-jobs', str(download_jobs), '--convert-jobs', str(convert_jobs), '--quality', quality,
+        ]
+        self.env = dict(os.environ, PATH=os.path.join(tmp, 'bin') + os.pathsep + os.environ.get('PATH', ''),
+                        FAKE_TOOL_LOG=os.path.join(tmp, 'tools.log'))
+
+    def start(self):
+        return subprocess.Popen(self.cmd, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def run(self):
+        t0 = time.perf_counter()
+        returncode = self.start().wait()
+        return time.perf_counter() - t0, returncode
+
+
+def tool_calls(tmp, tool, flag=None):
+    """日志里某个工具被调用的参数列表"""
+    calls = []
+    try:
+        with open(os.path.join(tmp, 'tools.log'), encoding='utf-8') as f:
+            for line in f:
+                entry = json.loads(line)
+                if entry["tool"] == tool and (flag is None or flag in entry["args"]):
+                    calls.append(entry["args"])
+    except OSError:
+        pass
+    return calls
+
+
+def audio_outputs(tmp):
+    return [f for f in os.listdir(os.path.join(tmp, 'music')) if f.endswith(('.mp3', '.ogg'))]
+
+
+def manifest_totals(urls_file):
+    with open(urls_file + ".manifest.json", encoding='utf-8') as f:
+        jobs = [job for job in json.load(f)["jobs"].values() if job["status"] == "done"]
+    return (sum(job.get("downloaded_bytes") or 0 for job in jobs), sum(job.get("bytes_saved") or 0 for job in jobs),
+            sum(job.get("copied", 0) for job in jobs), sum(job.get("convert_seconds", 0) for job in jobs))
+
+
+def bench_downloader(count):
+    if sys.platform == 'win32':
+        print("downloader 测试用 #! 脚本冒充 you-get/ffmpeg，只支持类 Unix 系统", file=sys.stderr)
+        return
+
+    def prepare(tmp):
+        for sub in ('bin', 'music', 'work'):
+            os.makedirs(os.path.join(tmp, sub), exist_ok=True)
+        write_fake_tools(os.path.join(tmp, 'bin'))
+        urls = [f"https://fake.example/video/BV{i:04d}" for i in range(count)] + ["https://fake.example/video/fail"]
+        path = os.path.join(tmp, 'urls.txt')
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write("# 测试列表\n" + "\n".join(urls) + "\n")
+        return path
+
+    print(f"批量下载 {count} 个网址 + 1 个必然失败的网址"
+          f"（假工具：每 10 MiB 下载 0.3 秒，转码 0.2 秒，复制音频流 0.01 秒）")
+    print(f"  {'并发(下载/转换)':<16}{'格式':>6}{'耗时(秒)':>10}{'少下载(MiB)':>12}{'复制/输出':>10}"
+          f"{'转换(秒)':>10}{'退出码':>8}")
+    for download_jobs, convert_jobs, quality in ((1, 1, "best"), (1, 1, "small"), (3, 2, "best"),
+                                                 (3, 2, "small"), (6, 4, "small")):
+        with tempfile.TemporaryDirectory() as tmp:
+            urls_file = prepare(tmp)
+            elapsed, returncode = DownloaderRun(tmp, urls_file, download_jobs, convert_jobs, quality).run()
+            _, saved, copied, convert_seconds = manifest_totals(urls_file)
+            print(f"  {f'{download_jobs}/{convert_jobs}':<16}{quality:>6}{elapsed:>10.2f}{saved / 1048576:>12.0f}"
+                  f"{f'{copied}/{len(audio_outputs(tmp))}':>10}{convert_seconds:>10.2f}{returncode:>8}")
+
+    # 来源去重：换一个网址列表、网址换种写法再下一遍，不应再调用 you-get 下载
+    with tempfile.TemporaryDirectory() as tmp:
+        urls_file = prepare(tmp)
+        DownloaderRun(tmp, urls_file, 3, 2).run()
+        first = len(tool_calls(tmp, 'you-get', '-o'))
+        variants = os.path.join(tmp, 'variants.txt')
+        with open(variants, 'w', encoding='utf-8') as f:
+            for i in range(count):
+                f.write(f"http://m.fake.example/video/BV{i:04d}/?spm_id_from=333.1007&p=1\n")
+        elapsed, _ = DownloaderRun(tmp, variants, 3, 2).run()
+        again = len(tool_calls(tmp, 'you-get', '-o')) - first
+        print(f"\n来源去重：第一遍下载 {first} 次；换写法的 {count} 个网址再下一遍 {elapsed:.2f} 秒，"
+              f"下载 {again} 次，音频文件 {len(audio_outputs(tmp))} 个")
+
+    # 中断续传：完成一部分后杀掉进程，再运行一次
+    with tempfile.TemporaryDirectory() as tmp:
+        urls_file = prepare(tmp)
+        run = DownloaderRun(tmp, urls_file, 3, 2)
+        proc = run.start()
+        manifest = urls_file + ".manifest.json"
+        while proc.poll() is None:
+            try:
+                with open(manifest, encoding='utf-8') as f:
+                    done = sum(job["status"] == "done" for job in json.load(f)["jobs"].values())
+            except (OSError, ValueError):
+                done = 0
+            if done >= count // 3:
+                proc.kill()
+                break
+            time.sleep(0.05)
+        proc.wait()
+        first = len(tool_calls(tmp, 'you-get', '-o'))
+        run.run()
+        downloads = [args[-1] for args in tool_calls(tmp, 'you-get', '-o')]
+        repeated = len(downloads) - len(set(downloads))
+        produced = len(audio_outputs(tmp))
+        print(f"\n中断续传：中断前 {first} 次下载，续传后共 {len(downloads)} 次，"
+              f"重复下载 {repeated} 次（失败任务每次重试 + 中断时正在下载的），音频文件 {produced} 个")
+
+    # 服务模式：播放器从空曲库启动，下载完成后转发 ingest，新歌不用重启就加入播放列表
+    with tempfile.TemporaryDirectory() as tmp:
+        prepare(tmp)
+        music_dir = os.path.join(tmp, 'music')
+        run = DownloaderRun(tmp, None, 3, 2)
+        service = SidecarProcess([
+            sys.executable, os.path.join(SCRIPT_DIR, 'youget_download.py'), '--service',
+            '--output', music_dir, '--work-dir', os.path.join(tmp, 'work'),
+            '--download-jobs', '3', '--convert-jobs', '2',
+        ], run.env)
+        player = PlayerProcess(music_dir)
+        try:
+            player.wait('no_music', 0)
+            service.wait('ready', 0)
+            urls = [f"https://fake.example/video/BV{i:04d}" for i in range(3)]
+            sent = {url: service.send('download', url=url) for url in urls}
+            service.send('download', url=urls[0])  # 前端重试：同一网址在下载中再提交一次
+            print("\n服务模式（3 个网址，播放器从空曲库启动）：")
+            print(f"  {'网址':<12}{'下载到完成(秒)':>14}{'ingest(ms)':>12}")
+            for url in urls:
+                t, data = service.wait('download_done', 0, lambda d, url=url: d['url'] == url, timeout=30)
+                name = data['outputs'][0]
+                latency = player.latency('ingest', 'track_added', lambda d, name=name: d['name'] == name, name=name)
+                print(f"  {url.rsplit('/', 1)[-1]:<12}{t - sent[url]:>14.2f}{latency:>12.1f}")
+            _, track = player.wait('track_change', 0)
+            stages = {}
+            for _, event, data in service.events:
+                if event == 'download_progress':
+                    stages[data['stage']] = stages.get(data['stage'], 0) + 1
+            print(f"  进度事件: {stages}")
+            downloads = [args[-1] for args in tool_calls(tmp, 'you-get', '-o')]
+            print(f"  第一个网址下载中重复提交：you-get 下载 {len(downloads)} 次（{len(set(downloads))} 个网址），"
+                  f"音频文件 {len(audio_outputs(tmp))} 个")
+            print(f"  播放器离开 no_music 状态，第一首: {track['name']}（时长 {track['duration']} 秒）")
+        finally:
+            service.send('exit')
+            player.send('exit')
+            service.proc.wait(5)
+            player.proc.wait(5)
+
+
+# ============ 端到端（stdin 协议）============
+
+# ============ 内容去重 ============
+
+def synthetic_song(seed, seconds, samplerate=44100):
+    """随机和弦加衰减包络的立体声"歌曲"，用来测试内容指纹"""
+    rng = np.random.default_rng(seed)
+    out = np.zeros(seconds * samplerate)
+    pos = 0
+    while pos < len(out):
+        n = int(rng.uniform(0.2, 0.8) * samplerate)
+        t = np.arange(n) / samplerate
+        envelope = np.exp(-t * rng.uniform(1, 6))
+        notes = rng.choice([220, 262, 294, 330, 349, 392, 440, 494, 523, 587, 659, 784, 880], 3)
+        segment = sum(np.sin(2 * np.pi * f * t) + 0.3 * np.sin(4 * np.pi * f * t) for f in notes) * envelope
+        segment += 0.05 * rng.standard_normal(n) * envelope
+        out[pos:pos + n] += segment[:len(out) - pos]
+        pos += n
+    out /= np.abs(out).max() * 1.5
+    return np.column_stack([out, 0.9 * out]).astype(np.float32)
+
+
+def bench_dedup(tracks):
+    sys.path.insert(0, SCRIPT_DIR)
+    import music
+    import soundfile as sf
+
+    # 指纹区分度：同一首歌转码、音量减半、片头多 0.3 秒静音 vs 不同的歌
+    with tempfile.TemporaryDirectory() as tmp:
+        samplerate = 44100
+        variants = {}
+        for seed in (1, 2):
+            x = synthetic_song(seed, 40, samplerate)
+            for name, data, kwargs in (
+                    (f"s{seed}.wav", x, {}),
+                    (f"s{seed}.mp3", x, {"format": "MP3"}),
+                    (f"s{seed}_quiet.ogg", 0.5 * x, {"format": "OGG", "subtype": "VORBIS"}),
+                    (f"s{seed}_pad.flac", np.concatenate([np.zeros((int(0.3 * samplerate), 2), np.float32), x]), {})):
+                # 分块写，libsndfile 一次写太长的 mp3 可能崩溃
+                with sf.SoundFile(os.path.join(tmp, name), 'w', samplerate, 2, **kwargs) as f:
+                    for i in range(0, len(data), samplerate):
+                        f.write(data[i:i + samplerate])
+                _, _, waveform, fingerprint = music.analyze_track(os.path.join(tmp, name))
+                variants[name] = {"signature": None, "waveform": len(waveform), "fingerprint": fingerprint}
+        names = list(variants)
+        index = music.DuplicateIndex()
+        codes = [index.entry_codes(variants[name]) for name in names]
+        others = np.stack([c[1] for c in codes])
+        lengths = np.array([c[2] for c in codes])
+        print(f"指纹位差异率（错位 ±1 秒内取最小；低于 {index.MAX_BIT_ERROR} 视为同一首）")
+        print("  " + " " * 14 + "".join(f"{name:>14}" for name in names))
+        for name, (_, code, length) in zip(names, codes):
+            row = index.bit_error(code, length, others, lengths)
+            print(f"  {name:<14}" + "".join(f"{v:>14.2f}" for v in row))
+
+    # 索引规模：按时长分桶后加入一首只和相近时长的比较
+    rng = np.random.default_rng(0)
+    music.library.directory_path = tempfile.gettempdir()
+    entries = {}
+    originals = tracks - tracks // 20
+    for i in range(originals):
+        seconds = float(rng.uniform(120, 360))
+        packed = np.packbits(rng.random((295, 16)) < 0.5, axis=1)
+        entries[f"t{i:05d}.mp3"] = {"signature": None, "waveform": int(seconds * 10), "fingerprint": packed.tobytes().hex()}
+    # 5% 是重复曲目：时长差 0.5 秒以内，指纹有 5% 的位不同，错开 3 帧
+    for i in range(tracks - originals):
+        original = entries[f"t{int(rng.integers(originals)):05d}.mp3"]
+        unpacked = np.unpackbits(np.frombuffer(bytes.fromhex(original["fingerprint"]), np.uint8)).reshape(-1, 16)
+        unpacked = np.concatenate([rng.random((3, 16)) < 0.5, unpacked[:-3]]) ^ (rng.random(unpacked.shape) < 0.05)
+        entries[f"dup{i:05d}.mp3"] = {"signature": None, "waveform": original["waveform"] + int(rng.integers(-5, 6)),
+                                      "fingerprint": np.packbits(unpacked.astype(bool), axis=1).tobytes().hex()}
+    music.library.tracks = entries
+    names = list(entries)
+    t0 = time.perf_counter()
+    kept = music.duplicates.collapse(names)
+    elapsed = time.perf_counter() - t0
+    removed = set(names) - set(kept)
+    wrong = [name for name in removed if not name.startswith("dup")]
+    t0 = time.perf_counter()
+    for i in range(100):
+        music.library.tracks[f"new{i}.mp3"] = dict(entries[f"t{i:05d}.mp3"])
+        music.duplicates.add(f"new{i}.mp3")
+    incremental = (time.perf_counter() - t0) / 100
+    print(f"\n{tracks} 首（{tracks - originals} 首重复）建索引并去重: {elapsed * 1000:.0f} ms，"
+          f"去掉 {len(removed)} 首（误删 {len(wrong)} 首）；增量加入一首 {incremental * 1000:.2f} ms")
+
+
+class SidecarProcess:
+    """启动说 JSON 行协议的子进程，发送命令并记录带时间戳的事件"""
+    def __init__(self, cmd, env=None):
+        self.proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8', env=env
+        )
+        self.events = []    # (时间戳, 事件名, 数据)
+        self.cond = threading.Condition()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            with self.cond:
+                self.events.append((time.perf_counter(), message["event"], message.get("data")))
+                self.cond.notify_all()
+
+    def send(self, command, **fields):
+        """发送命令，返回发送时刻"""
+        fields["command"] = command
+        t = time.perf_counter()
+        self.proc.stdin.write(json.dumps(fields) + "\n")
+        self.proc.stdin.flush()
+        return t
+
+    def wait(self, event, since, predicate=None, timeout=10.0):
+        """等待 since 之后第一个满足条件的事件，返回 (时间戳, 数据)"""
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                for t, name, data in self.events:
+                    if t >= since and name == event and (predicate is None or predicate(data)):
+                        return t, data
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.proc.poll() is not None:
+                    raise TimeoutError(f"等待 {event} 超时")
+                self.cond.wait(remaining)
+
+    def latency(self, command, event, predicate=None, **fields):
+        """命令发出到对应事件到达的耗时（ms）"""
+        sent = self.send(command, **fields)
+        t, _ = self.wait(event, sent, predicate)
+        return (t - sent) * 1000
+
+    def count(self, since, until):
+        return sum(1 for t, _, _ in self.events if since <= t < until)
+
+    def cpu_seconds(self):
+        """子进程累计 CPU 时间（用户态 + 内核态）"""
+        with open(f'/proc/{self.proc.pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+class PlayerProcess(SidecarProcess):
+    """以 null 后端启动 music.py"""
+    def __init__(self, music_dir, unthrottled=False):
+        cmd = [sys.executable, os.path.join(SCRIPT_DIR, 'music.py'),
+               '--backend', 'null', '--no-hotkeys', '--music-dir', music_dir]
+        if unthrottled:
+            cmd.append('--unthrottled')
+        super().__init__(cmd)
+
+    def rss(self):
+        return process_rss(self.proc.pid)
+
+    def close(self):
+        try:
+            self.send("exit")
+            self.proc.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.proc.kill()
+
+
+def write_test_tracks(folder, tracks, seconds):
+    """不同格式/采样率的测试曲目（带包络的和弦，响度分析有意义）"""
+    import soundfile as sf
+    formats = [('wav', 44100, 2), ('flac', 48000, 2), ('ogg', 44100, 2), ('flac', 32000, 1)]
+    rng = np.random.default_rng(1)
+    for i in range(tracks):
+        ext, rate, channels = formats[i % len(formats)]
+        t = np.arange(int(rate * seconds)) / rate
+        freqs = rng.uniform(110, 880, size=3)
+        y = sum(np.sin(2 * np.pi * f * t) for f in freqs) / 6 * (0.6 + 0.4 * np.sin(2 * np.pi * 0.25 * t))
+        y = np.repeat(y[:, None], channels, axis=1).astype(np.float32)
+        # 分块写入：libsndfile 一次写入很长的 ogg 会崩溃
+        with sf.SoundFile(os.path.join(folder, f"track{i:02d}.{ext}"), 'w', rate, channels) as f:
+            for start in range(0, len(y), rate):
+                f.write(y[start:start + rate])
+
+
+def measure_startup(folder, cold, runs=5):
+    """启动到收到 ready 的耗时（ms）和最后一次 ready 里的分阶段耗时；cold 时先删掉会话缓存"""
+    times = []
+    phases = None
+    for _ in range(runs):
+        if cold:
+            try:
+                os.remove(os.path.join(folder, '.session.json'))
+            except OSError:
+                pass
+        start = time.perf_counter()
+        player = PlayerProcess(folder)
+        try:
+            t, ready = player.wait("ready", 0, timeout=30)
+            times.append((t - start) * 1000)
+            phases = ready.get("startup")
+            # 等第一首进入准备状态，会话缓存才会写入
+            time.sleep(0.3)
+        finally:
+            player.close()
+    return times, phases
+
+
+def summarize(values):
+    return f"中位数 {statistics.median(values):7.1f}  最大 {max(values):7.1f}"
+
+
+def bench_player(tracks, track_seconds, repeats):
+    if not os.path.exists('/proc/self/stat'):
+        print("player 测试需要 /proc（Linux）", file=sys.stderr)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"生成 {tracks} 首 {track_seconds:.0f} 秒测试曲目...", file=sys.stderr)
+        write_test_tracks(tmp, tracks, track_seconds)
+
+        print("\n启动到 ready（ms，含解释器启动）")
+        for label, cold in (("无会话缓存", True), ("有会话缓存", False)):
+            times, phases = measure_startup(tmp, cold)
+            print(f"  {label}  {summarize(times)}  分阶段 {phases}")
+
+        # 1. 不限速：整条播放链路（解码 + 增益 + 重采样 + 交叉淡化）的吞吐量和每首歌的内存
+        player = PlayerProcess(tmp, unthrottled=True)
+        try:
+            player.wait("ready", 0, timeout=30)
+            player.send("set_crossfade", seconds=0)
+            start = player.send("toggle")
+            changes = []
+            rss = [player.rss()]
+            since = start
+            for _ in range(tracks * 2):
+                t, _ = player.wait("track_change", since, timeout=60)
+                changes.append(t)
+                rss.append(player.rss())
+                since = t + 1e-9
+            elapsed = changes[-1] - start
+            audio_seconds = len(changes) * track_seconds
+        finally:
+            player.close()
+
+        print(f"\n解码吞吐量（不限速，{len(changes)} 首，交叉淡化关闭）")
+        print(f"  {audio_seconds / elapsed:.0f} 倍实时")
+        print("每首歌的内存（RSS）")
+        print(f"  起始 {rss[0]:.1f} MB  最高 {max(rss):.1f} MB  "
+              f"平均每首增长 {(rss[-1] - rss[1]) / (len(rss) - 2):+.2f} MB")
+
+        # 2. 实时：CPU、事件速率、控制延迟、空闲 CPU
+        player = PlayerProcess(tmp)
+        try:
+            player.wait("ready", 0, timeout=30)
+            toggle_ms = [player.latency("toggle", "play_state", lambda d: d["playing"])]
+
+            time.sleep(1.0)
+            cpu0, t0 = player.cpu_seconds(), time.perf_counter()
+            time.sleep(5.0)
+            cpu1, t1 = player.cpu_seconds(), time.perf_counter()
+            play_cpu = (cpu1 - cpu0) / (t1 - t0) * 1000
+            event_rate = player.count(t0, t1) / (t1 - t0)
+
+            toggle_ms.append(player.latency("toggle", "play_state", lambda d: not d["playing"]))
+            time.sleep(0.5)
+            cpu0, t0 = player.cpu_seconds(), time.perf_counter()
+            time.sleep(3.0)
+            cpu1, t1 = player.cpu_seconds(), time.perf_counter()
+            idle_cpu = (cpu1 - cpu0) / (t1 - t0) * 1000
+            toggle_ms.append(player.latency("toggle", "play_state", lambda d: d["playing"]))
+
+            next_ms = []
+            seek_ms = []
+            for i in range(repeats):
+                time.sleep(0.5)
+                next_ms.append(player.latency("next", "track_change"))
+                time.sleep(0.5)
+                position = int(track_seconds * (i + 1) / (repeats + 2))
+                seek_ms.append(player.latency(
+                    "seek", "progress", lambda d, p=position: p <= d["current"] <= p + 2, position=position
+                ))
+
+            status_time = player.send("get_status")
+            _, status = player.wait("status", status_time)
+            metrics_time = player.send("get_metrics")
+            _, metrics = player.wait("metrics", metrics_time)
+        finally:
+            player.close()
+
+        print("\n播放循环 CPU（实时，含后台线程）")
+        print(f"  {play_cpu:.1f} ms/秒")
+        print("暂停时空闲 CPU")
+        print(f"  {idle_cpu:.2f} ms/秒")
+        print("事件速率（播放中）")
+        print(f"  {event_rate:.1f} 条/秒  累计 {status['events']}")
+        print("控制延迟（ms）")
+        print(f"  toggle {summarize(toggle_ms)}")
+        print(f"  next   {summarize(next_ms)}")
+        print(f"  seek   {summarize(seek_ms)}")
+
+        print("get_metrics（实时播放这一轮）")
+        for name, family in metrics["metrics"].items():
+            for series in family["series"]:
+                labels = ",".join(f"{k}={v}" for k, v in series["labels"].items())
+                if family["type"] == "histogram":
+                    mean = series["sum"] / series["count"] * 1000 if series["count"] else 0
+                    print(f"  {name}{{{labels}}}: {series['count']} 次  平均 {mean:.2f} ms  最大 {series['max'] * 1000:.2f} ms")
+                else:
+                    print(f"  {name}{{{labels}}}: {series['value']}")
+        histogram = Histogram()
+        t0 = time.perf_counter()
+        for _ in range(100000):
+            histogram.observe(0.05)
+        print(f"  每次记录耗时 {(time.perf_counter() - t0) * 10:.2f} µs（每块音频记录一次，一块约 85-93 ms）")
+
+
+def bench_profile(seconds, interval_ms):
+    """播放中开/关采样：CPU、写入耗时和欠载的变化，采到的栈"""
+    if not os.path.exists('/proc/self/stat'):
+        print("profile 测试需要 /proc（Linux）", file=sys.stderr)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        write_test_tracks(tmp, 2, max(60.0, seconds * 3))
+        player = PlayerProcess(tmp)
+        try:
+            player.wait("ready", 0, timeout=30)
+            player.latency("toggle", "play_state", lambda d: d["playing"])
+            time.sleep(3.0)  # 等后台的曲库分析做完
+
+            def window():
+                """seconds 秒内的播放 CPU（ms/秒）和这段时间的写入耗时直方图"""
+                before = player.send("get_metrics")
+                _, m0 = player.wait("metrics", before)
+                cpu0, t0 = player.cpu_seconds(), time.perf_counter()
+                time.sleep(seconds)
+                cpu1, t1 = player.cpu_seconds(), time.perf_counter()
+                after = player.send("get_metrics")
+                _, m1 = player.wait("metrics", after)
+                w0 = m0["metrics"]["music_chunk_write_seconds"]["series"][0]
+                w1 = m1["metrics"]["music_chunk_write_seconds"]["series"][0]
+                count = w1["count"] - w0["count"]
+                underruns = (m1["metrics"]["music_underrun_suspects"]["series"][0]["value"]
+                             - m0["metrics"]["music_underrun_suspects"]["series"][0]["value"])
+                return (cpu1 - cpu0) / (t1 - t0) * 1000, count, (w1["sum"] - w0["sum"]) / count * 1000, underruns
+
+            baseline = window()
+            sent = player.send("start_profile", interval_ms=interval_ms, path=os.path.join(tmp, "music.folded"))
+            _, started = player.wait("profile_started", sent)
+            profiled = window()
+            sent = player.send("stop_profile")
+            t, saved = player.wait("profile_saved", sent)
+            stop_ms = (t - sent) * 1000
+        finally:
+            player.close()
+
+        print(f"播放中采样 {seconds:.0f} 秒（间隔 {started['interval_ms']} ms）")
+        for label, (cpu, count, write_ms, underruns) in (("不采样", baseline), ("采样中", profiled)):
+            print(f"  {label}  CPU {cpu:5.1f} ms/秒  写入 {count} 块，平均 {write_ms:.1f} ms  疑似欠载 {underruns}")
+        print(f"  {saved['samples']} 次采样，{saved['stacks']} 个不同的栈，采样线程占用 {saved['overhead_pct']}%，"
+              f"单次最长 {saved['max_sample_ms']} ms，拉长间隔 {saved['stretched']} 次；stop_profile 到写完 {stop_ms:.1f} ms")
+        with open(saved["path"], encoding="utf-8") as f:
+            lines = f.readlines()
+        print("  样本最多的栈（只显示线程和最内层 2 帧）:")
+        for line in lines[:5]:
+            stack, count = line.rsplit(" ", 1)
+            frames = stack.split(";")
+            print(f"    {int(count):5d}  {frames[0]} ... {' ; '.join(frames[-2:])}")
+
+
+def bench_stall(block_seconds, threshold):
+    """写入阻塞时的 stall_detected，以及暂停时不误报"""
+    import music
+
+    class Capture:
+        """代替 stdout 接收事件"""
+        def __init__(self):
+            self.events = []
+            self.cond = threading.Condition()
+
+        def write(self, text):
+            with self.cond:
+                for line in text.splitlines():
+                    message = json.loads(line)
+                    self.events.append((time.perf_counter(), message["event"], message["data"]))
+                self.cond.notify_all()
+
+        def flush(self):
+            pass
+
+        def wait(self, event, since=0.0, timeout=30.0):
+            deadline = time.perf_counter() + timeout
+            with self.cond:
+                while True:
+                    for t, name, data in self.events:
+                        if t >= since and name == event:
+                            return t, data
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        raise TimeoutError(f"等待 {event} 超时")
+                    self.cond.wait(remaining)
+
+    n = 200000
+    t0 = time.perf_counter()
+    for _ in range(n):
+        music.playback_heartbeat.beat()
+    beat_us = (time.perf_counter() - t0) / n * 1e6
+    music.playback_heartbeat.idle()
+
+    # 模拟声卡驱动卡住：block_at 之后的第一次写入阻塞 block_seconds 秒
+    block_at = [None]
+    original_write = music.NullStream.write
+
+    def write(stream, frames):
+        if block_at[0] is not None and time.perf_counter() >= block_at[0]:
+            block_at[0] = None
+            time.sleep(block_seconds)
+        original_write(stream, frames)
+
+    music.NullStream.write = write
+    capture = Capture()
+    music.events.stream = capture
+    with tempfile.TemporaryDirectory() as tmp:
+        write_test_tracks(tmp, 1, 60.0)
+        args = music.parse_args(['--backend', 'null', '--no-hotkeys', '--music-dir', tmp,
+                                 '--stall-threshold', str(threshold)])
+        threading.Thread(target=music.main, args=(args,), kwargs={"read_stdin": False}, daemon=True).start()
+        try:
+            capture.wait("ready")
+            music.process_command({"command": "toggle"})
+            capture.wait("play_state")
+            time.sleep(2.0)
+
+            # 暂停超过阈值：播放循环转为空闲，不应报告卡顿
+            since = time.perf_counter()
+            music.process_command({"command": "toggle"})
+            time.sleep(threshold * 3)
+            music.process_command({"command": "toggle"})
+            time.sleep(1.0)
+            paused_stalls = [e for e in capture.events if e[0] >= since and e[1] == "stall_detected"]
+
+            since = block_at[0] = time.perf_counter()
+            t, stall = capture.wait("stall_detected", since, timeout=block_seconds + 10)
+            time.sleep(block_seconds)
+            music.process_command({"command": "get_status"})
+            _, status = capture.wait("status", since)
+        finally:
+            music.process_command({"command": "exit"})
+            music.NullStream.write = original_write
+
+    print(f"一次心跳 beat(): {beat_us:.3f} µs（一块音频约 {CHUNK_SIZE / 44100 * 1000:.0f} ms）")
+    print(f"暂停 {threshold * 3:.0f} 秒（阈值 {threshold} 秒）期间的 stall_detected: {len(paused_stalls)} 次")
+    print(f"写入阻塞 {block_seconds:.0f} 秒：{t - since:.2f} 秒后收到 stall_detected（报告已卡 {stall['stalled']} 秒）")
+    print(f"  循环 {stall['loop']}（线程 {stall['thread']}），卡在 {stall['location']}，最内层 {stall['innermost']}")
+    print(f"  抓到 {len(stall['threads'])} 个线程的栈: {sorted(stall['threads'])}")
+    print(f"恢复后 get_status 中的 stalls: {status['stalls']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="音乐播放器性能测试")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p_wav = sub.add_parser("wav", help="WAV 内存映射 vs 整段解码")
+    p_wav.add_argument("--minutes", type=float, nargs="+", default=[10, 120])
+
+    sub.add_parser("resample", help="重采样质量与吞吐量")
+
+    p_xf = sub.add_parser("crossfade", help="交叉淡化的连续性和 CPU 开销")
+    p_xf.add_argument("--seconds", type=float, default=3.0)
+
+    sub.add_parser("hotkeys", help="键盘钩子回调耗时")
+
+    p_dl = sub.add_parser("downloader", help="youget_download.py 批量模式（假 you-get/ffmpeg）")
+    p_dl.add_argument("--urls", type=int, default=12)
+
+    p_dedup = sub.add_parser("dedup", help="内容指纹的区分度和去重索引的规模")
+    p_dedup.add_argument("--tracks", type=int, default=2000)
+
+    p_player = sub.add_parser("player", help="通过 stdin 协议端到端测试 music.py（null 后端）")
+    p_player.add_argument("--tracks", type=int, default=6)
+    p_player.add_argument("--track-seconds", type=float, default=60.0)
+    p_player.add_argument("--repeats", type=int, default=5)
+
+    p_profile = sub.add_parser("profile", help="播放中 start_profile / stop_profile 的开销和输出")
+    p_profile.add_argument("--seconds", type=float, default=5.0)
+    p_profile.add_argument("--interval-ms", type=float, default=5.0)
+
+    p_stall = sub.add_parser("stall", help="写入阻塞时的 stall_detected 和暂停时不误报")
+    p_stall.add_argument("--block", type=float, default=3.0)
+    p_stall.add_argument("--threshold", type=float, default=1.0)
+
+    p_probe = sub.add_parser("_probe_wav")
+    p_probe.add_argument("mode")
+    p_probe.add_argument("path")
+
+    args = parser.parse_args()
+    if args.bench == "wav":
+        bench_wav(args.minutes)
+    elif args.bench == "resample":
+        bench_resample()
+    elif args.bench == "crossfade":
+        bench_crossfade(args.seconds)
+    elif args.bench == "hotkeys":
+        bench_hotkeys()
+    elif args.bench == "downloader":
+        bench_downloader(args.urls)
+    elif args.bench == "dedup":
+        bench_dedup(args.tracks)
+    elif args.bench == "player":
+        bench_player(args.tracks, args.track_seconds, args.repeats)
+    elif args.bench == "profile":
+        bench_profile(args.seconds, args.interval_ms)
+    elif args.bench == "stall":
+        bench_stall(args.block, args.threshold)
+    elif args.bench == "_probe_wav":
+        probe_wav(args.mode, args.path)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,8 @@
 - playing: 用户是否在播放会话中（True = 正在播放或暂停，False = 未开始）
 - pause_program: 是否暂停（True = 暂停，False = 播放中）
 - 准备阶段 = playing=True + pause_program=True（在歌曲开头暂停）
+- 切歌/跳转/切换设备通过 state.commands 命令队列传给播放线程，
+  播放线程在暂停或空闲时阻塞在 state.cond 上，不轮询
 
 通信协议:
 - Electron -> Python: JSON格式字符串，以换行符结束
@@ -14,60 +16,246 @@
   - {"command": "prev"} - 上一首
   - {"command": "seek", "position": 30} - 跳转到指定位置(秒)
   - {"command": "set_volume", "volume": 0.8} - 设置音量(0-1)
+  - {"command": "set_normalize", "enabled": true} - 响度归一化开关（下一首生效）
+  - {"command": "set_crossfade", "seconds": 3} - 交叉淡化时长（0 关闭，下一首生效）
   - {"command": "get_status"} - 获取当前状态
   - {"command": "get_devices"} - 获取输出设备列表
+  - {"command": "get_waveform", "name": "song.mp3"} - 获取波形概览（省略 name 为当前曲目）
   - {"command": "set_device", "device_id": 5} - 设置输出设备
+  - {"command": "refresh_devices"} - 设备插拔后重新枚举（结果通过 devices 事件返回）
+  - {"command": "ingest", "name": "song.mp3"} - 把刚下载到音乐文件夹的曲目加入播放列表（不用重启）
+  - {"command": "get_metrics", "format": "json"} - 获取指标（format 为 "prometheus" 时返回文本格式）
+  - {"command": "start_profile", "interval_ms": 5, "duration": 60, "path": "..."} - 开始对所有线程栈采样
+    （省略 path 时写到音乐文件夹旁边的 profiles/music-时间.folded）
+  - {"command": "stop_profile"} - 结束采样并写出 collapsed stack 文件（可以直接画火焰图）
+  - {"command": "exit"} - 退出程序（stdin 关闭时同样退出）
   
 - Python -> Electron: JSON格式字符串，以换行符结束
-  - {"event": "status", "data": {"playing": true, "name": "song.mp3", "current": 30, "duration": 180}}
+  - {"event": "ready", "data": {"name": "song.mp3", "duration": 180, "has_prev": false,
+                                 "startup": {"session": 0.4, "ready": 25.1}}}
+    有上次会话记录（music/.session.json）时直接用其中的曲目发 ready，
+    设备枚举（devices）、快捷键（hotkeys）、曲库扫描（library）在 ready 之后完成
+  - {"event": "status", "data": {"playing": true, "name": "song.mp3", "current": 30, "duration": 180,
+                                  "events": {"sent": 120, "dropped": 3, "queued": 0},
+                                  "startup": {"session": 0.4, "ready": 25.1, "devices": 80.2, ...}}}
   - {"event": "track_change", "data": {"name": "song.mp3", "duration": 180}}
   - {"event": "play_state", "data": {"playing": true}}
   - {"event": "progress", "data": {"current": 30, "duration": 180}}
-  - {"event": "devices", "data": {"devices": [...], "current": 5}}
+  - {"event": "waveform", "data": {"name": "song.mp3", "resolution": 0.1, "total": 1800, "offset": 0,
+                                   "peak": [0-255, ...], "rms": [0-255, ...], "done": true}}
+    每个 bin 对应 resolution 秒，超过 2000 个 bin 时分多条发送，done 标记最后一条
+  - {"event": "devices", "data": {"devices": [{"id": 5, "name": "...", "hostapi": "...", "key": "hostapi/name"}, ...],
+                                   "current": 5}}
+  - {"event": "track_added", "data": {"name": "song.mp3", "count": 120}}
+    ingest 成功后发送，count 为曲库曲目数；文件不存在或格式不支持时发送 play_error
+  - {"event": "metrics", "data": {"format": "json", "uptime": 120.5, "metrics": {"music_chunk_write_seconds": {...}}}}
+    指标见 sidecar/metrics.py；启动参数 --metrics-file 时每 --metrics-interval 秒写一次 Prometheus 文本文件
+  - {"event": "profile_started", "data": {"running": true, "path": "...", "interval_ms": 5, "duration": 60}}
+  - {"event": "profile_saved", "data": {"running": false, "path": "...", "samples": 1200, "stacks": 35,
+                                         "overhead_pct": 0.4, ...}}
+    stop_profile 或到达 duration 时发送；采样出错（已在采样、没有在采样、写文件失败）时发送 profile_error
+  - {"event": "stall_detected", "data": {"loop": "playback", "thread": "MainThread", "stalled": 2.1, "threshold": 2.0,
+                                          "location": "write (music.py:1553)", "innermost": "...",
+                                          "stack": [...], "threads": {"线程名": [...]}}}
+    播放循环超过 --stall-threshold 秒（默认 2，0 关闭）没有推进时发送，同一次卡顿只发一次；
+    卡顿次数和最长一次见 get_status 的 stalls，以及指标 music_stalls / music_stall_seconds
 
-快捷键:
+快捷键（默认，可在 hotkeys.json 中修改，见 DEFAULT_HOTKEYS）:
 - 右Ctrl + 右Shift: 暂停/继续
-- 右Ctrl + Q: 退出程序
 - 右Ctrl + 左/右方向键: 上一首/下一首
 - 右Ctrl + 上/下方向键: 音量增/减
+  hotkeys.json 示例: {"toggle": "ctrl_r+space", "next": ["ctrl_r", "n"], "volume_down": ""}
 """
 
 import os
-import sounddevice as sd
-import soundfile as sf
+import math
+import struct
 import random
 import threading
 import time
 import json
-from pynput import keyboard
+import argparse
+import importlib
+import collections
 import sys
 
+STARTED_AT = time.perf_counter()
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "sidecar"))
+from metrics import Registry
+from profiler import Profiler
+from stall_watchdog import Watchdog
+
+class LazyModule:
+    """第一次访问属性时才导入的模块：ready 之前用不到的重型库都这样导入"""
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = importlib.import_module(self._name)
+        return getattr(module, attr)
+
+np = LazyModule("numpy")
+sf = LazyModule("soundfile")
+sd = LazyModule("sounddevice")
+
 # 设置UTF-8编码（用于与Electron通信）
 sys.stdin.reconfigure(encoding='utf-8')
 sys.stdout.reconfigure(encoding='utf-8')
 sys.stderr.reconfigure(encoding='utf-8')
 
+# ============ 事件输出 ============
+class EventBus:
+    """
+    事件输出线程（Python -> Electron）
+    - 发送方只把事件放进队列，json 序列化、write、flush 都在专门的写线程里做，
+      不占用音频循环，也不在 state.lock 里做 IO
+    - COALESCE 里的状态类事件只保留最新一条（latest-wins），被覆盖的计入 dropped
+    - 其它事件（track_change、play_state 等）按顺序逐条发送，并作为屏障：
+      屏障之前还没发出的状态事件不会被屏障之后的新值覆盖，保证先后顺序
+    - 状态类事件同类两次发送至少间隔给定秒数；队列里有顺序事件在等时不限速
+    """
+    COALESCE = {
+        "progress": 0.25,
+        "volume_change": 0.05,
+    }
+
+    def __init__(self, stream=None, service=None):
+        self.stream = stream
+        self.service = service   # 合并宿主进程里给每条事件加上 "service" 字段
+        self.cond = threading.Condition()
+        self.queue = collections.deque()
+        self.pending = {}        # 状态类事件 -> 队列中还没发出的那一条
+        self.ordered = 0         # 队列中顺序事件的数量
+        self.last_sent = {}
+        self.sent = 0
+        self.dropped = 0
+        self.writing = False
+        self.thread = None
+
+    def emit(self, event_type, data):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="events", daemon=True)
+                self.thread.start()
+            if event_type in self.COALESCE:
+                entry = self.pending.get(event_type)
+                if entry is not None:
+                    entry[1] = data
+                    self.dropped += 1
+                    return
+                entry = [event_type, data]
+                self.pending[event_type] = entry
+            else:
+                entry = [event_type, data]
+                self.pending.clear()
+                self.ordered += 1
+            self.queue.append(entry)
+            self.cond.notify_all()
+
+    def _next(self):
+        """取出下一条可以发送的事件（持有 cond 时调用）"""
+        while True:
+            if not self.queue:
+                self.cond.wait()
+                continue
+            entry = self.queue[0]
+            interval = self.COALESCE.get(entry[0])
+            if interval and not self.ordered:
+                wait = self.last_sent.get(entry[0], 0) + interval - time.monotonic()
+                if wait > 0:
+                    self.cond.wait(wait)
+                    continue
+            self.queue.popleft()
+            if interval is None:
+                self.ordered -= 1
+            elif self.pending.get(entry[0]) is entry:
+                del self.pending[entry[0]]
+            return entry
+
+    def _run(self):
+        while True:
+            with self.cond:
+                event_type, data = self._next()
+                self.writing = True
+            message = {"event": event_type, "data": data}
+            if self.service:
+                message["service"] = self.service
+            output = json.dumps(message, ensure_ascii=False)
+            stream = self.stream or sys.stdout
+            stream.write(output + "\n")
+            stream.flush()
+            with self.cond:
+                self.last_sent[event_type] = time.monotonic()
+                self.sent += 1
+                self.writing = False
+                self.cond.notify_all()
+
+    def flush(self, timeout=1.0):
+        """等待队列中的事件全部写出（退出前调用）"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while self.queue or self.writing:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+
+    def stats(self):
+        with self.cond:
+            return {"sent": self.sent, "dropped": self.dropped, "queued": len(self.queue)}
+
+events = EventBus()
+
+# ============ 指标 ============
+metrics = Registry("music")
+chunk_write_seconds = metrics.histogram(
+    "chunk_write_seconds", "一块音频写入输出流的耗时（实时后端会阻塞到设备缓冲区有空位）",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0))
+underrun_suspects = metrics.counter(
+    "underrun_suspects", "播放进度推进得比实时快（写入没有阻塞，疑似设备异常）的次数，连续 3 次判定为设备异常")
+device_errors = metrics.counter("device_errors", "判定为设备异常而停止播放的次数")
+decode_seconds = metrics.histogram("decode_seconds", "每首歌加载/解码的耗时（WAV 只是内存映射）")
+tracks_started = metrics.counter("tracks_started", "开始播放的曲目数")
+metrics.gauge("event_queue_depth", "事件队列里还没写出的事件数", fn=lambda: len(events.queue))
+metrics.gauge("playlist_size", "随机播放列表里的曲目数", fn=lambda: len(state.shuffled_playlist))
+output_stream_open = metrics.gauge("output_stream_open", "输出流是否打开（1 打开，0 关闭）")
+
+# 按需采样（start_profile / stop_profile），到时间自动结束时也发送 profile_saved
+profiler = Profiler("music", on_saved=lambda result: state.send_event("profile_saved", result))
+
+# 卡顿看门狗：播放循环每写一块发一次心跳，暂停、切歌时转为空闲
+watchdog = Watchdog("music", metrics, on_stall=lambda data: state.send_event("stall_detected", data))
+playback_heartbeat = watchdog.heartbeat("playback")
+
 # ============ 全局状态 ============
 class PlayerState:
     def __init__(self):
         self.playing = False          # 是否在播放会话中
         self.pause_program = True     # 是否暂停（初始为暂停状态）
-        self.next_one = False
-        self.prev_one = False
         self.exit_program = False
         self.volume = 1.0
         self.current_time = 0
         self.duration = 0
         self.track_name = ""
-        self.seek_position = None
         self.play_history = []
         self.shuffled_playlist = []
         self.playlist_index = -1
+        self.next_round = None        # 到列表末尾时提前洗好的下一轮顺序（peek_next_song 生成，get_next_song 采用）
+        self.peeked_song = None       # peek_next_song 返回过的下一首（交叉淡化可能已在准备，位置不能再变）
         self.file_list = []
         self.directory_path = "music/"
         self.current_device_id = None
-        self.device_changed = False
+        self.normalize = True         # 是否按曲库响度自动归一化音量
+        self.crossfade = 3.0          # 交叉淡化时长（秒），0 表示关闭
         self.lock = threading.Lock()
+        # 控制命令队列：("next"|"prev"|"seek"|"device_change", 参数)
+        # 播放线程阻塞在 cond 上，投递命令或改变暂停/退出状态时唤醒
+        self.commands = collections.deque()
+        self.cond = threading.Condition(self.lock)
         
         # 预加载的音频数据
         self.preloaded_data = None
@@ -77,22 +265,45 @@ class PlayerState:
         # 初始化完成标志（用于避免在 ready 后发送初始化事件）
         self.initialized = False
         
+        # 各启动阶段耗时（毫秒），ready 之前的阶段随 ready 发出，全部阶段见 get_status
+        self.startup = {}
+        
+    def post(self, command, value=None):
+        """投递控制命令并唤醒播放线程"""
+        with self.cond:
+            self.commands.append((command, value))
+            self.cond.notify_all()
+    
+    def toggle_pause(self):
+        """切换暂停状态并唤醒播放线程，返回切换后是否暂停"""
+        with self.cond:
+            self.pause_program = not self.pause_program
+            self.cond.notify_all()
+            return self.pause_program
+    
+    def request_exit(self):
+        with self.cond:
+            self.exit_program = True
+            self.cond.notify_all()
+        
     def send_event(self, event_type, data):
-        """向stdout发送事件（给Electron）"""
-        output = json.dumps({"event": event_type, "data": data}, ensure_ascii=False)
-        sys.stdout.write(output + "\n")
-        sys.stdout.flush()
+        """向stdout发送事件（给Electron），由事件线程异步写出"""
+        events.emit(event_type, data)
         
     def send_status(self):
         """发送当前状态"""
         with self.lock:
-            self.send_event("status", {
+            status = {
                 "playing": self.playing and not self.pause_program,
                 "name": self.track_name,
                 "current": self.current_time,
                 "duration": self.duration,
                 "has_prev": len(self.play_history) > 1
-            })
+            }
+        status["events"] = events.stats()
+        status["stalls"] = watchdog.snapshot()
+        status["startup"] = dict(self.startup)
+        self.send_event("status", status)
             
     def send_devices(self):
         """发送设备列表"""
@@ -104,151 +315,423 @@ class PlayerState:
 
 state = PlayerState()
 
-# ============ 输出设备管理 ============
+# ============ 输出后端 ============
 EXCLUDED_HOST_APIS = [
     'WDM-KS',
     'DirectSound',
 ]
 
+class SoundDeviceBackend:
+    """声卡输出（PortAudio），sounddevice 在第一次用到时才导入"""
+    name = "sounddevice"
+    realtime = True
+
+    def list_devices(self):
+        """所有可用输出设备（排除 EXCLUDED_HOST_APIS）"""
+        devices = sd.query_devices()
+        hostapis = sd.query_hostapis()
+        output_devices = []
+        
+        for i, device in enumerate(devices):
+            if device['max_output_channels'] > 0:
+                hostapi_name = hostapis[device['hostapi']]['name']
+                is_excluded = any(excluded in hostapi_name for excluded in EXCLUDED_HOST_APIS)
+                if not is_excluded:
+                    output_devices.append({
+                        "id": i,
+                        "name": device['name'][:50],
+                        "hostapi": hostapi_name,
+                        "is_default": device.get('is_default', False)
+                    })
+        
+        return output_devices
+
+    def use_device(self, device_id):
+        """设为默认输出设备，成功返回设备名，无效返回 None"""
+        devices = sd.query_devices()
+        if 0 <= device_id < len(devices) and devices[device_id]['max_output_channels'] > 0:
+            sd.default.device = device_id
+            return devices[device_id]['name']
+        return None
+
+    def use_default(self):
+        """恢复使用系统默认输出设备"""
+        sd.default.reset()
+
+    def default_device(self):
+        """(设备ID, 设备名)"""
+        info = sd.query_devices(kind='output')
+        return info.get('index'), info['name']
+
+    def rescan(self):
+        """PortAudio 只在初始化时枚举设备，插拔后要重新初始化才能看到（输出流必须已关闭）"""
+        sd._terminate()
+        sd._initialize()
+
+    def native_format(self):
+        """(采样率, 声道数)，声道最多用 2 个"""
+        info = sd.query_devices(kind='output')
+        return int(info['default_samplerate']), max(1, min(2, info['max_output_channels']))
+
+    def open_stream(self, samplerate, channels):
+        return sd.OutputStream(samplerate=samplerate, channels=channels, dtype='float32')
+
+    def close(self):
+        pass
+
+
+class NullStream:
+    """
+    不出声的输出流，接口与 sd.OutputStream 一致
+    - realtime=True 时 write 按采样率节奏阻塞（模拟声卡缓冲写满），False 时立即返回
+    - sink 不为空时把写入的帧转交给它（文件后端）
+    """
+    LATENCY = 0.1   # 模拟的声卡缓冲时长（秒）
+
+    def __init__(self, samplerate, realtime, sink=None):
+        self.samplerate = samplerate
+        self.realtime = realtime
+        self.sink = sink
+        self.active = False
+        self.deadline = 0.0
+
+    def start(self):
+        self.active = True
+        self.deadline = time.perf_counter()
+
+    def stop(self):
+        self.active = False
+
+    def close(self):
+        self.active = False
+
+    def write(self, frames):
+        if self.sink is not None:
+            self.sink.write(frames)
+        if not self.realtime:
+            return
+        now = time.perf_counter()
+        self.deadline = max(self.deadline, now) + len(frames) / self.samplerate
+        wait = self.deadline - now - self.LATENCY
+        if wait > 0:
+            time.sleep(wait)
+
+
+class NullBackend:
+    """无声卡输出：只有一个虚拟设备，用于测试和性能测试"""
+    name = "null"
+    DEVICE_NAME = "Null Output"
+
+    def __init__(self, realtime=True, samplerate=48000, channels=2):
+        self.realtime = realtime
+        self.samplerate = samplerate
+        self.channels = channels
+
+    def list_devices(self):
+        return [{"id": 0, "name": self.DEVICE_NAME, "hostapi": self.name, "is_default": True}]
+
+    def use_device(self, device_id):
+        return self.DEVICE_NAME if device_id == 0 else None
+
+    def use_default(self):
+        pass
+
+    def default_device(self):
+        return 0, self.DEVICE_NAME
+
+    def rescan(self):
+        pass
+
+    def native_format(self):
+        return self.samplerate, self.channels
+
+    def open_stream(self, samplerate, channels):
+        return NullStream(samplerate, self.realtime)
+
+    def close(self):
+        pass
+
+
+class FileBackend(NullBackend):
+    """把输出写进 WAV 文件（32 位浮点），切换设备/重开输出流时接着写同一个文件"""
+    name = "file"
+    DEVICE_NAME = "File Output"
+
+    def __init__(self, path, realtime=True, samplerate=48000, channels=2):
+        super().__init__(realtime, samplerate, channels)
+        self.path = path
+        self.file = None
+
+    def open_stream(self, samplerate, channels):
+        if self.file is None:
+            self.file = sf.SoundFile(self.path, 'w', samplerate=samplerate, channels=channels, subtype='FLOAT')
+        return NullStream(samplerate, self.realtime, sink=self.file)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# ============ 输出设备管理 ============
+class DeviceRegistry:
+    """
+    输出设备注册表
+    - 枚举结果缓存起来，get_devices 不再每次查询 PortAudio；
+      只有 refresh_devices（设备插拔）或播放出错时才重新枚举
+    - 设备以 "hostapi/名称" 作为稳定 key，重新枚举后序号变化也能找回同一个设备
+    - 选中的设备消失时回落到系统默认设备
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.devices = None          # 缓存的设备列表
+        self.selected = None         # 选中设备的 key，None 表示系统默认
+        self.rescan_pending = False  # 等播放线程关掉输出流后重新枚举
+
+    def _enumerate(self):
+        devices = output.backend.list_devices()
+        seen = collections.Counter()
+        for device in devices:
+            key = f"{device['hostapi']}/{device['name']}"
+            seen[key] += 1
+            # 同名设备按出现顺序区分
+            device["key"] = key if seen[key] == 1 else f"{key}#{seen[key]}"
+        return devices
+
+    def list(self):
+        with self.lock:
+            if self.devices is None:
+                self.devices = self._enumerate()
+            return self.devices
+
+    def find(self, device_id=None, key=None):
+        """有 key 时只按 key 找（序号可能已经指向别的设备），否则按序号找"""
+        for device in self.list():
+            if device["key"] == key if key is not None else device["id"] == device_id:
+                return device
+        return None
+
+    def select(self, device_id=None, key=None):
+        """设为输出设备，成功返回设备条目，找不到返回 None"""
+        device = self.find(device_id, key)
+        if device is None or output.backend.use_device(device["id"]) is None:
+            return None
+        self.selected = device["key"]
+        state.current_device_id = device["id"]
+        return device
+
+    def use_default(self):
+        """回落到系统默认设备，返回设备名"""
+        output.backend.use_default()
+        self.selected = None
+        state.current_device_id, name = output.backend.default_device()
+        return name
+
+    def rescan(self):
+        """重新枚举并按 key 找回选中的设备（输出流必须已关闭）；选中的设备不见了返回 False"""
+        output.backend.rescan()
+        with self.lock:
+            self.devices = self._enumerate()
+            self.rescan_pending = False
+        if self.selected is None:
+            self.use_default()
+            return True
+        key = self.selected
+        if self.select(key=key) is None:
+            name = self.use_default()
+            print(f"设备已断开: {key}，改用默认输出设备: {name}", file=sys.stderr)
+            return False
+        return True
+
+    def request_rescan(self):
+        """设备插拔后调用：输出流没打开时立即重新枚举，否则交给播放线程关流后再做"""
+        if output.stream is None:
+            self.rescan()
+            state.send_devices()
+        else:
+            self.rescan_pending = True
+            state.post("device_change")
+
+devices = DeviceRegistry()
+
 def get_output_devices():
-    """获取所有输出设备列表"""
-    devices = sd.query_devices()
-    hostapis = sd.query_hostapis()
-    output_devices = []
-    
-    for i, device in enumerate(devices):
-        if device['max_output_channels'] > 0:
-            hostapi_name = hostapis[device['hostapi']]['name']
-            is_excluded = any(excluded in hostapi_name for excluded in EXCLUDED_HOST_APIS)
-            if not is_excluded:
-                output_devices.append({
-                    "id": i,
-                    "name": device['name'][:50],
-                    "hostapi": hostapi_name,
-                    "is_default": device.get('is_default', False)
-                })
-    
-    return output_devices
+    """获取所有输出设备列表（缓存）"""
+    return devices.list()
 
 def set_output_device(device_id):
     """设置输出设备"""
     try:
-        devices = sd.query_devices()
-        if 0 <= device_id < len(devices):
-            if devices[device_id]['max_output_channels'] > 0:
-                sd.default.device = device_id
-                state.current_device_id = device_id
-                print(f"已切换到设备: {devices[device_id]['name']}", file=sys.stderr)
-                with state.lock:
-                    state.device_changed = True
-                return True
+        device = devices.select(device_id)
+        if device is not None:
+            print(f"已切换到设备: {device['name']}", file=sys.stderr)
+            session.save(device={"id": device_id, "key": device["key"]})
+            state.post("device_change")
+            return True
         return False
     except Exception as e:
         print(f"设置设备失败: {e}", file=sys.stderr)
         return False
 
-def select_output_device(initial_device_id=None):
-    """选择输出设备"""
-    devices = sd.query_devices()
-    
-    if initial_device_id is not None:
+def select_output_device(initial_device_id=None, key=None):
+    """选择输出设备：优先按上次保存的 key 找回，找不到（设备已拔掉）时用系统默认设备"""
+    if initial_device_id is not None or key is not None:
         try:
-            if 0 <= initial_device_id < len(devices):
-                if devices[initial_device_id]['max_output_channels'] > 0:
-                    sd.default.device = initial_device_id
-                    state.current_device_id = initial_device_id
-                    print(f"使用指定设备: {devices[initial_device_id]['name']}", file=sys.stderr)
-                    return initial_device_id
+            device = devices.select(initial_device_id, key)
+            if device is not None:
+                print(f"使用指定设备: {device['name']}", file=sys.stderr)
+                return device["id"]
         except Exception as e:
             print(f"指定设备失败: {e}", file=sys.stderr)
     
-    default_device = sd.query_devices(kind='output')
-    state.current_device_id = default_device['index'] if 'index' in default_device else None
-    print(f"使用默认输出设备: {default_device['name']}", file=sys.stderr)
+    name = devices.use_default()
+    print(f"使用默认输出设备: {name}", file=sys.stderr)
     return None
 
-select_output_device()
-
 # ============ 快捷键定义 ============
-pause_key = {keyboard.Key.ctrl_r, keyboard.Key.shift_r}
-next_key = {keyboard.Key.ctrl_r, keyboard.Key.right}
-prev_key = {keyboard.Key.ctrl_r, keyboard.Key.left}
-voice_up = {keyboard.Key.ctrl_r, keyboard.Key.up}
-voice_down = {keyboard.Key.ctrl_r, keyboard.Key.down}
+# 动作 -> 组合键（"+" 连接的按键名：pynput 的 Key 名称或单个字符），可在 hotkeys.json 中覆盖
+DEFAULT_HOTKEYS = {
+    "toggle": "ctrl_r+shift_r",
+    "next": "ctrl_r+right",
+    "prev": "ctrl_r+left",
+    "volume_up": "ctrl_r+up",
+    "volume_down": "ctrl_r+down",
+}
 
-current_keys = set()
 listener = None
+hotkeys = None
 
-def key_to_str(key):
-    if isinstance(key, keyboard.Key):
-        return str(key)
-    elif isinstance(key, keyboard.KeyCode):
-        return key.char if key.char else str(key)
-
-def keys_pressed(required_keys):
-    for k in required_keys:
-        found = False
-        for ck in current_keys:
-            if key_to_str(k) == key_to_str(ck):
-                found = True
-                break
-        if not found:
-            return False
-    return True
+def key_token(key):
+    """把 pynput 的按键归一化成 token：Key 成员用名称，字母数字按虚拟键码（按住 Ctrl 时 char 不可靠）"""
+    name = getattr(key, "name", None)
+    if name:
+        return name
+    vk = getattr(key, "vk", None)
+    if vk is not None and (0x30 <= vk <= 0x39 or 0x41 <= vk <= 0x5A):
+        return chr(vk).lower()
+    char = getattr(key, "char", None)
+    if char:
+        return char.lower()
+    return f"vk{vk}"
+
+class HotkeyMatcher:
+    """
+    全局快捷键匹配，运行在系统键盘钩子的回调里：每次按键（包括其它程序里的打字）都会调用，
+    回调越慢，所有程序的输入延迟越大
+    - 快捷键里用到的每个 token 占一位，按下/松开只更新一个整数位掩码
+    - 按键对象到位的映射缓存起来，按下的键不属于任何快捷键时查一次字典就返回
+    - 按下的键属于快捷键时，只检查包含这个键的组合是否已经全部按下
+    """
+    def __init__(self, bindings, actions, known_keys=None):
+        self.bits = {}         # token -> 位
+        self.combos = {}       # 位 -> [(组合掩码, 动作)]
+        self.key_bits = {}     # 按键对象 -> 位（0 表示与快捷键无关）
+        self.pressed = 0
+        for action, combo in bindings.items():
+            if not combo or action not in actions:
+                continue
+            tokens = [t.strip().lower() for t in combo.split("+") if t.strip()]
+            unknown = [t for t in tokens if len(t) > 1 and known_keys is not None and t not in known_keys]
+            if unknown:
+                print(f"快捷键 {action} 中有无法识别的按键: {unknown}", file=sys.stderr)
+                continue
+            mask = 0
+            for token in tokens:
+                mask |= self.bits.setdefault(token, 1 << len(self.bits))
+            for token in set(tokens):
+                self.combos.setdefault(self.bits[token], []).append((mask, actions[action]))
+
+    def _bit(self, key):
+        bit = self.key_bits.get(key)
+        if bit is None:
+            bit = self.key_bits[key] = self.bits.get(key_token(key), 0)
+        return bit
+
+    def press(self, key):
+        bit = self._bit(key)
+        if not bit:
+            return
+        self.pressed |= bit
+        for mask, action in self.combos.get(bit, ()):
+            if self.pressed & mask == mask:
+                action()
+
+    def release(self, key):
+        self.pressed &= ~self._bit(key)
+
+def load_hotkeys(path):
+    """读取快捷键配置，未配置的动作使用默认组合；值为空表示禁用该快捷键"""
+    bindings = dict(DEFAULT_HOTKEYS)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except FileNotFoundError:
+        return bindings
+    except (OSError, ValueError) as e:
+        print(f"读取快捷键配置失败: {e}", file=sys.stderr)
+        return bindings
+    for action, combo in config.items():
+        if action not in DEFAULT_HOTKEYS:
+            print(f"未知的快捷键动作: {action}", file=sys.stderr)
+            continue
+        bindings[action] = "+".join(combo) if isinstance(combo, list) else combo
+    return bindings
+
+def change_volume(delta):
+    with state.lock:
+        state.volume = max(0, min(1.0, round(state.volume + delta, 2)))
+        volume = state.volume
+    print(f"音量: {volume:.2f}", file=sys.stderr)
+    state.send_event("volume_change", {"volume": volume})
+
+def hotkey_toggle():
+    paused = state.toggle_pause()
+    print("暂停" if paused else "继续", file=sys.stderr)
+
+def hotkey_next():
+    print("下一曲（快捷键）", file=sys.stderr)
+    state.post("next")
+
+def hotkey_prev():
+    print("上一曲（快捷键）", file=sys.stderr)
+    state.post("prev")
+
+HOTKEY_ACTIONS = {
+    "toggle": hotkey_toggle,
+    "next": hotkey_next,
+    "prev": hotkey_prev,
+    "volume_up": lambda: change_volume(0.1),
+    "volume_down": lambda: change_volume(-0.1),
+}
 
 def on_key_press(key):
-    current_keys.add(key)
-    
-    if keys_pressed(pause_key):
-        with state.lock:
-            state.pause_program = not state.pause_program
-            print("暂停" if state.pause_program else "继续", file=sys.stderr)
-    
-    if keys_pressed(next_key):
-        print("下一曲（快捷键）", file=sys.stderr)
-        with state.lock:
-            state.next_one = True
-    
-    if keys_pressed(prev_key):
-        print("上一曲（快捷键）", file=sys.stderr)
-        with state.lock:
-            state.prev_one = True
-    
-    if keys_pressed(voice_up):
-        with state.lock:
-            state.volume = min(1.0, round(state.volume + 0.1, 2))
-            print(f"音量: {state.volume:.2f}", file=sys.stderr)
-            state.send_event("volume_change", {"volume": state.volume})
-    
-    if keys_pressed(voice_down):
-        with state.lock:
-            state.volume = max(0, round(state.volume - 0.1, 2))
-            print(f"音量: {state.volume:.2f}", file=sys.stderr)
-            state.send_event("volume_change", {"volume": state.volume})
+    hotkeys.press(key)
 
 def on_key_release(key):
-    current_keys.discard(key)
+    hotkeys.release(key)
 
-def start_keyboard_listener():
-    global listener
+def start_keyboard_listener(config_path="hotkeys.json"):
+    """pynput 在这里才导入（无桌面环境时 import 会失败）"""
+    global listener, hotkeys
+    from pynput import keyboard
+    hotkeys = HotkeyMatcher(load_hotkeys(config_path), HOTKEY_ACTIONS, set(keyboard.Key.__members__))
     listener = keyboard.Listener(on_press=on_key_press, on_release=on_key_release)
     listener.start()
 
-start_keyboard_listener()
-
 # ============ 文件列表管理 ============
+AUDIO_EXTENSIONS = ('.wav', '.mp3', '.flac', '.ogg', '.m4a')
+
 def list_files_in_directory(directory_path):
     file_names = []
     if os.path.exists(directory_path) and os.path.isdir(directory_path):
         for filename in os.listdir(directory_path):
             if os.path.isfile(os.path.join(directory_path, filename)):
-                if filename.lower().endswith(('.wav', '.mp3', '.flac', '.ogg', '.m4a')):
+                if filename.lower().endswith(AUDIO_EXTENSIONS):
                     file_names.append(filename)
     return file_names
 
 def init_shuffled_playlist():
-    """初始化随机播放列表"""
-    state.file_list = list_files_in_directory(state.directory_path)
+    """初始化随机播放列表；内容指纹相同的曲目只保留最早的一个"""
+    state.file_list = duplicates.collapse(list_files_in_directory(state.directory_path))
     if not state.file_list:
         state.shuffled_playlist = []
         return False
@@ -256,6 +739,8 @@ def init_shuffled_playlist():
     random.shuffle(state.shuffled_playlist)
     state.playlist_index = -1
     state.play_history = []
+    state.next_round = None
+    state.peeked_song = None
     return True
 
 def get_next_song():
@@ -263,42 +748,1039 @@ def get_next_song():
     if not state.shuffled_playlist:
         if not init_shuffled_playlist():
             return None
-    state.playlist_index += 1
-    if state.playlist_index >= len(state.shuffled_playlist):
-        random.shuffle(state.shuffled_playlist)
-        state.playlist_index = 0
-    state.play_history.append(state.playlist_index)
-    return state.shuffled_playlist[state.playlist_index]
+    with state.lock:
+        state.playlist_index += 1
+        if state.playlist_index >= len(state.shuffled_playlist):
+            # 新的一轮：沿用 peek_next_song 提前洗好的顺序（交叉淡化已经在播它的第一首）
+            playlist = state.shuffled_playlist
+            state.shuffled_playlist = state.next_round or random.sample(playlist, len(playlist))
+            state.next_round = None
+            state.playlist_index = 0
+            # 播放历史记录的是上一轮列表的下标，换列表后作废
+            state.play_history = []
+        state.peeked_song = None
+        state.play_history.append(state.playlist_index)
+        return state.shuffled_playlist[state.playlist_index]
+
+def peek_next_song():
+    """
+    查看下一首但不前进（播放线程在交叉淡化前调用）
+    到列表末尾时把下一轮的顺序洗好放在 state.next_round，不动当前列表，get_next_song 返回同一首
+    """
+    with state.lock:
+        playlist = state.shuffled_playlist
+        if not playlist:
+            return None
+        if state.playlist_index + 1 < len(playlist):
+            name = playlist[state.playlist_index + 1]
+        else:
+            if state.next_round is None:
+                state.next_round = random.sample(playlist, len(playlist))
+            name = state.next_round[0]
+        state.peeked_song = name
+        return name
 
 def get_prev_song():
     """获取上一首歌"""
     if not state.shuffled_playlist:
         if not init_shuffled_playlist():
             return None
-    if len(state.play_history) > 1:
-        state.play_history.pop()
-        state.playlist_index = state.play_history[-1]
-    return state.shuffled_playlist[state.playlist_index]
+    with state.lock:
+        if len(state.play_history) > 1:
+            state.play_history.pop()
+            state.playlist_index = state.play_history[-1]
+        state.peeked_song = None
+        return state.shuffled_playlist[state.playlist_index]
+
+def ingest_track(name):
+    """
+    把新加入音乐文件夹的曲目插到随机播放列表里当前曲目之后的随机位置（本轮就会播到），
+    返回是否加入；已在列表里的不重复加入
+    """
+    name = os.path.basename(name)
+    if not name.lower().endswith(AUDIO_EXTENSIONS) or not os.path.isfile(state.directory_path + name):
+        return False
+    with state.cond:
+        if name in state.file_list:
+            return False
+        state.file_list.append(name)
+        if state.next_round is not None:
+            # 下一轮已经洗好（第一首可能已在淡入）：插到下一轮第一首之后
+            state.next_round.insert(random.randint(1, len(state.next_round)), name)
+        else:
+            # 已经 peek 过的下一首留在原位，新曲目插到它之后
+            playlist = state.shuffled_playlist
+            first = state.playlist_index + (2 if state.peeked_song is not None else 1)
+            position = random.randint(min(first, len(playlist)), len(playlist))
+            playlist.insert(position, name)
+            # 播放历史记录的是列表下标，插入点之后的要后移
+            state.play_history = [i + 1 if i >= position else i for i in state.play_history]
+        count = len(state.file_list)
+        # 没有音乐时主线程在等第一首
+        state.cond.notify_all()
+    state.send_event("track_added", {"name": name, "count": count})
+    # 新曲目的响度和波形在后台分析
+    start_analysis()
+    return True
+
+def remove_track(name):
+    """从随机播放列表里去掉一首（后台分析发现它是重复曲目时）；正在播放的和已 peek 的下一首不动，下次建列表时再去掉"""
+    with state.lock:
+        if name in (state.track_name, state.peeked_song) or name not in state.shuffled_playlist:
+            return False
+        if state.next_round is not None and name in state.next_round:
+            state.next_round.remove(name)
+        position = state.shuffled_playlist.index(name)
+        del state.shuffled_playlist[position]
+        if name in state.file_list:
+            state.file_list.remove(name)
+        if position < state.playlist_index:
+            state.playlist_index -= 1
+        state.play_history = [i - 1 if i > position else i for i in state.play_history if i != position]
+        return True
+
+# ============ 音频加载 ============
+# WAV 格式标签
+WAV_FORMAT_PCM = 0x0001
+WAV_FORMAT_FLOAT = 0x0003
+WAV_FORMAT_EXTENSIBLE = 0xFFFE
+
+class WavMap:
+    """
+    WAV 文件 PCM 数据区的内存映射视图
+    - 不复制整个文件，切片时才把对应帧转换为 float32
+    - 跳转只是切片下标运算，常驻内存只与实际播放过的页有关
+    - 接口与 float32 的二维 ndarray 兼容：len()、shape、data[a:b]
+    """
+    def __init__(self, file_path, offset, frames, channels, samplerate, fmt_tag, bits):
+        self.samplerate = samplerate
+        self.shape = (frames, channels)
+        self.bits = bits
+        self.is_float = fmt_tag == WAV_FORMAT_FLOAT
+        if self.is_float:
+            dtype = np.float32 if bits == 32 else np.float64
+            self._map = np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+        elif bits == 24:
+            self._map = np.memmap(file_path, dtype=np.uint8, mode='r', offset=offset, shape=(frames, channels, 3))
+        else:
+            dtype = {8: np.uint8, 16: '<i2', 32: '<i4'}[bits]
+            self._map = np.memmap(file_path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+
+    @classmethod
+    def open(cls, file_path):
+        """解析 RIFF 头，返回 WavMap；不是可映射的 PCM/float WAV 时返回 None"""
+        if not file_path.lower().endswith('.wav'):
+            return None
+        try:
+            file_size = os.path.getsize(file_path)
+            with open(file_path, 'rb') as f:
+                riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+                if riff != b'RIFF' or wave != b'WAVE':
+                    return None
+                fmt = None
+                while True:
+                    header = f.read(8)
+                    if len(header) < 8:
+                        return None
+                    chunk_id, chunk_size = struct.unpack('<4sI', header)
+                    if chunk_id == b'fmt ':
+                        fmt = f.read(chunk_size)
+                        if chunk_size % 2:
+                            f.seek(1, os.SEEK_CUR)
+                    elif chunk_id == b'data':
+                        offset = f.tell()
+                        break
+                    else:
+                        f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+        except (OSError, struct.error):
+            return None
+
+        if fmt is None or len(fmt) < 16:
+            return None
+        fmt_tag, channels, samplerate, _, block_align, bits = struct.unpack('<HHIIHH', fmt[:16])
+        if fmt_tag == WAV_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+            fmt_tag = struct.unpack('<H', fmt[24:26])[0]
+        if fmt_tag == WAV_FORMAT_PCM:
+            if bits not in (8, 16, 24, 32):
+                return None
+        elif fmt_tag == WAV_FORMAT_FLOAT:
+            if bits not in (32, 64):
+                return None
+        else:
+            return None
+        if channels == 0 or block_align != channels * bits // 8:
+            return None
+
+        # 数据块长度可能大于实际文件（录音中断等），以实际文件为准
+        data_size = min(chunk_size, file_size - offset)
+        frames = data_size // block_align
+        if frames <= 0:
+            return None
+        return cls(file_path, offset, frames, channels, samplerate, fmt_tag, bits)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        """按帧切片，返回 float32 二维数组"""
+        raw = self._map[index]
+        if self.is_float:
+            return np.asarray(raw, dtype=np.float32)
+        if self.bits == 8:
+            return (raw.astype(np.float32) - 128.0) * (1.0 / 128)
+        if self.bits == 16:
+            return raw.astype(np.float32) * (1.0 / 32768)
+        if self.bits == 24:
+            # 3 字节小端样本放到 int32 的高 3 字节，符号位自然扩展
+            padded = np.zeros(raw.shape[:-1] + (4,), dtype=np.uint8)
+            padded[..., 1:] = raw
+            return padded.view('<i4')[..., 0].astype(np.float32) * (1.0 / 2147483648)
+        return raw.astype(np.float32) * (1.0 / 2147483648)
+
+def load_audio(file_path):
+    """加载音频，返回 (data, samplerate)；WAV 走内存映射，其他格式整段解码为 float32"""
+    with decode_seconds.time():
+        wav = WavMap.open(file_path)
+        if wav is not None:
+            return wav, wav.samplerate
+        with sf.SoundFile(file_path) as f:
+            return f.read(always_2d=True).astype('float32'), f.samplerate
+
+def iter_audio_blocks(file_path, block_frames=262144):
+    """流式读取音频，逐块产出 (float32 二维数组, samplerate)，不整段解码"""
+    wav = WavMap.open(file_path)
+    if wav is not None:
+        for start in range(0, len(wav), block_frames):
+            yield wav[start:start + block_frames], wav.samplerate
+        return
+    with sf.SoundFile(file_path) as f:
+        for block in f.blocks(blocksize=block_frames, always_2d=True, dtype='float32'):
+            yield block, f.samplerate
+
+# ============ 曲库缓存 ============
+def write_json_atomic(path, obj):
+    """先写临时文件再替换，避免中途退出留下半个文件"""
+    t0 = time.perf_counter()
+    content = json.dumps(obj, ensure_ascii=False)
+    try:
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(path + ".tmp", path)
+        metrics.histogram("config_save_seconds", "会话/曲库缓存保存耗时",
+                          file=os.path.basename(path)).observe(time.perf_counter() - t0)
+    except OSError as e:
+        print(f"保存 {os.path.basename(path)} 失败: {e}", file=sys.stderr)
+
+class LibraryCache:
+    """
+    曲库缓存（music/.library.json）
+    按文件名记录后台分析结果（响度、峰值、波形 bin 数、内容指纹），文件大小或修改时间变化后自动失效
+    波形概览是数组，单独存成 music/.waveforms/<文件名>.npy（uint8），索引里只记 bin 数
+    """
+    FILE_NAME = ".library.json"
+    WAVEFORM_DIR = ".waveforms"
+
+    def __init__(self):
+        self.directory_path = None
+        self.tracks = {}
+        self.lock = threading.Lock()
+
+    def load(self, directory_path):
+        self.directory_path = directory_path
+        path = os.path.join(directory_path, self.FILE_NAME)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.tracks = json.load(f).get("tracks", {})
+        except (OSError, ValueError):
+            self.tracks = {}
+
+    def save(self):
+        if self.directory_path is None or not os.path.isdir(self.directory_path):
+            return
+        with self.lock:
+            content = {"version": 1, "tracks": dict(self.tracks)}
+        write_json_atomic(os.path.join(self.directory_path, self.FILE_NAME), content)
+
+    def _signature(self, name):
+        try:
+            st = os.stat(os.path.join(self.directory_path, name))
+            return [st.st_size, int(st.st_mtime)]
+        except OSError:
+            return None
+
+    def get(self, name):
+        """返回该曲目的缓存条目；文件已变化或没有记录时返回 None"""
+        if self.directory_path is None:
+            return None
+        with self.lock:
+            entry = self.tracks.get(name)
+        if entry is None or entry.get("signature") != self._signature(name):
+            return None
+        return entry
+
+    def update(self, name, **fields):
+        signature = self._signature(name)
+        with self.lock:
+            entry = self.tracks.get(name)
+            if entry is None or entry.get("signature") != signature:
+                entry = {"signature": signature}
+                self.tracks[name] = entry
+            entry.update(fields)
+
+    def _waveform_path(self, name):
+        return os.path.join(self.directory_path, self.WAVEFORM_DIR, name + ".npy")
+
+    def save_waveform(self, name, waveform):
+        path = self._waveform_path(name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", 'wb') as f:
+                np.save(f, waveform)
+            os.replace(path + ".tmp", path)
+        except OSError as e:
+            print(f"保存波形失败 {name}: {e}", file=sys.stderr)
+
+    def load_waveform(self, name):
+        """缓存的波形概览 (bins, 2) uint8；没有或已失效时返回 None"""
+        entry = self.get(name)
+        if not entry or not entry.get("waveform"):
+            return None
+        try:
+            waveform = np.load(self._waveform_path(name))
+        except (OSError, ValueError):
+            return None
+        return waveform if len(waveform) == entry["waveform"] else None
+
+library = LibraryCache()
+
+class DuplicateIndex:
+    """
+    按内容指纹找重复曲目（同一个视频换了标题重新下载，或者转成了不同格式）
+    指纹随响度分析算出并存在曲库缓存里。和 chromaprint 的查找一样，每个 16 位指纹帧建倒排表：
+    倒排表只收每首歌的部分指纹帧，加入一首时用它的全部指纹帧去查（错位多少帧都能查到），
+    只有共享帧足够多、时长相近的曲目才做完整的位差异比较，
+    所以新分析完一首时可以增量加入，不用两两重比
+    """
+    MAX_BIT_ERROR = 0.25      # 指纹位差异率低于此值视为同一首（无关曲目约 0.5）
+    MAX_OFFSET = 10           # 允许的指纹帧错位（每帧 100ms，容忍片头长短差 1 秒以内）
+    MIN_OVERLAP = 100         # 至少比较 100 帧（10 秒）
+    INDEX_STEP = 5            # 倒排表每 5 帧收一帧
+    MIN_SHARED = 5            # 至少有 5 帧完全相同才算候选
+    MAX_DURATION_DIFF = 2.0   # 候选的时长差（秒）
+
+    def __init__(self):
+        self.postings = {}    # 16 位指纹帧 -> 含有它的曲目名列表
+        self.tracks = {}      # 保留的曲目名 -> (时长秒数, 指纹, 有效帧数)
+        self.known = {}       # 曲目名 -> 重复时指向保留的曲目，否则为自己
+        self.lock = threading.Lock()
+        self._popcount = None
+
+    def entry_codes(self, entry):
+        """曲库条目 -> (时长秒数, 指纹 (最大帧数, 2) uint8, 有效帧数)；没有指纹时返回 None，短的指纹补零"""
+        if not entry or not entry.get("fingerprint") or not entry.get("waveform"):
+            return None
+        max_frames = FINGERPRINT_SECONDS * 10 - FINGERPRINT_FRAMES
+        packed = np.frombuffer(bytes.fromhex(entry["fingerprint"]), dtype=np.uint8).reshape(-1, 2)[:max_frames]
+        codes = np.zeros((max_frames, 2), dtype=np.uint8)
+        codes[:len(packed)] = packed
+        return entry["waveform"] * WAVEFORM_RESOLUTION, codes, len(packed)
+
+    def bit_error(self, codes, length, others, lengths):
+        """
+        一个指纹和一组指纹的位差异率（错位 ±MAX_OFFSET 帧内取最小），返回 (k,)；
+        重叠不足 MIN_OVERLAP 帧的为 1.0
+        """
+        if self._popcount is None:
+            self._popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+        best = np.ones(len(others))
+        rows = np.arange(len(others))
+        for offset in range(-self.MAX_OFFSET, self.MAX_OFFSET + 1):
+            x = codes[max(offset, 0):]
+            y = others[:, max(-offset, 0):]
+            n = min(len(x), y.shape[1])
+            # 逐帧差异位数的累加和，按每对的重叠长度取值
+            errors = np.cumsum(self._popcount[x[None, :n] ^ y[:, :n]].sum(axis=2), axis=1)
+            overlap = np.minimum(length - max(offset, 0), lengths - max(-offset, 0))
+            valid = overlap >= self.MIN_OVERLAP
+            if valid.any():
+                rate = errors[rows[valid], overlap[valid] - 1] / (overlap[valid] * 16)
+                best[valid] = np.minimum(best[valid], rate)
+        return best
+
+    def add(self, name):
+        """按曲库里的指纹加入索引，返回与之重复的已有曲目名（没有重复或没有指纹时返回 None）"""
+        found = self.entry_codes(library.get(name))
+        if found is None:
+            return None
+        seconds, codes, length = found
+        # 全静音帧的指纹是 0，不参与查找
+        frames = codes[:length, 0].astype(np.uint16) << 8 | codes[:length, 1]
+        with self.lock:
+            if name in self.known:
+                original = self.known[name]
+                return original if original != name else None
+            hits = []
+            for value in set(frames.tolist()):
+                posting = self.postings.get(value)
+                if posting and value:
+                    hits.extend(posting)
+            shared = collections.Counter(hits)
+            candidates = [other for other, count in shared.items()
+                          if count >= self.MIN_SHARED and abs(self.tracks[other][0] - seconds) <= self.MAX_DURATION_DIFF]
+            if candidates:
+                others = np.stack([self.tracks[other][1] for other in candidates])
+                lengths = np.array([self.tracks[other][2] for other in candidates])
+                errors = self.bit_error(codes, length, others, lengths)
+                match = int(np.argmin(errors))
+                if errors[match] < self.MAX_BIT_ERROR:
+                    self.known[name] = candidates[match]
+                    return candidates[match]
+            for value in set(frames[::self.INDEX_STEP].tolist()) - {0}:
+                self.postings.setdefault(value, []).append(name)
+            self.tracks[name] = found
+            self.known[name] = name
+        return None
+
+    def collapse(self, names):
+        """去掉重复曲目：按文件修改时间从早到晚加入索引，重复的保留最早下载的那个"""
+        def age(name):
+            try:
+                return os.path.getmtime(os.path.join(library.directory_path or state.directory_path, name))
+            except OSError:
+                return 0
+        with self.lock:
+            self.postings = {}
+            self.tracks = {}
+            self.known = {}
+        kept = [name for name in sorted(names, key=age) if self.add(name) is None]
+        if len(kept) < len(names):
+            print(f"播放列表去掉 {len(names) - len(kept)} 首重复曲目", file=sys.stderr)
+        kept_set = set(kept)
+        return [name for name in names if name in kept_set]
+
+duplicates = DuplicateIndex()
+
+
+class SessionCache:
+    """
+    上次会话状态（music/.session.json）：最近开始播放的曲目和选中的输出设备
+    下次启动时直接用它发送 ready，扫描曲库、枚举设备都放到 ready 之后
+    """
+    FILE_NAME = ".session.json"
+
+    def __init__(self):
+        self.path = None
+        self.data = {}
+        self.lock = threading.Lock()
+
+    def load(self, directory_path):
+        self.path = os.path.join(directory_path, self.FILE_NAME)
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (OSError, ValueError):
+            self.data = {}
+
+    def save(self, **fields):
+        if self.path is None or not os.path.isdir(os.path.dirname(self.path) or "."):
+            return
+        with self.lock:
+            self.data.update(fields)
+            content = dict(self.data)
+        write_json_atomic(self.path, content)
+
+    def last_track(self):
+        """上次的曲目 (文件名, 时长)；文件已删除或被替换时返回 None"""
+        track = self.data.get("track")
+        if not track:
+            return None
+        try:
+            st = os.stat(os.path.join(os.path.dirname(self.path), track["name"]))
+        except (OSError, KeyError, TypeError):
+            return None
+        if track.get("signature") != [st.st_size, int(st.st_mtime)]:
+            return None
+        return track["name"], track.get("duration", 0)
+
+    def remember_track(self, name, duration):
+        try:
+            st = os.stat(os.path.join(os.path.dirname(self.path), name))
+        except (OSError, TypeError):
+            return
+        self.save(track={"name": name, "duration": duration, "signature": [st.st_size, int(st.st_mtime)]})
+
+session = SessionCache()
+
+# ============ 响度分析（ReplayGain 风格归一化）============
+REFERENCE_LOUDNESS = -18.0   # 目标响度 (LUFS)，与 ReplayGain 2.0 相同
+
+def k_weighting_power(samplerate, n_fft):
+    """ITU-R BS.1770 K 加权滤波器在 rfft 各频点上的功率响应"""
+    z = np.exp(-1j * 2 * np.pi * np.fft.rfftfreq(n_fft, 1.0 / samplerate) / samplerate)
+
+    def response(b, a):
+        return np.abs((b[0] + b[1] * z + b[2] * z * z) / (a[0] + a[1] * z + a[2] * z * z)) ** 2
+
+    # 第一级：高频搁架
+    k = math.tan(math.pi * 1681.974450955533 / samplerate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = response(
+        [(vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0],
+        [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0]
+    )
+    # 第二级：高通
+    k = math.tan(math.pi * 38.13547087602444 / samplerate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = response([1, -2, 1], [1, 2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0])
+    return shelf * highpass
+
+WAVEFORM_RESOLUTION = 0.1    # 波形概览每个 bin 的时长（秒），与响度分析的帧长相同
+FINGERPRINT_SECONDS = 30      # 内容指纹只看开头 30 秒
+FINGERPRINT_FRAMES = 5        # 每个指纹帧是 5 个 100ms 帧（0.5 秒）的滑动窗口，步长仍为 100ms
+
+def fingerprint_band_edges(fs, frame_len):
+    """300-3000Hz 按对数分 17 个频带，返回 rfft 下标边界（18 个）"""
+    edges = np.rint(np.geomspace(300.0, 3000.0, 18) * frame_len / fs).astype(int)
+    # 采样率很低时低频带不足一个 bin，保证每个频带至少一个 bin
+    for i in range(1, len(edges)):
+        edges[i] = max(edges[i], edges[i - 1] + 1)
+    return edges
+
+def fingerprint_bits(band_energy):
+    """
+    (100ms 帧数, 17) 频带能量 -> 十六进制指纹串
+    类似 chromaprint / Philips 指纹：相邻频带能量差随时间的变化方向，每 100ms 16 位；
+    只看能量的相对变化，和音量、码率、编码格式无关；步长 100ms，片头差几百毫秒也能对齐
+    """
+    if len(band_energy) < FINGERPRINT_FRAMES + 1:
+        return None
+    total = np.cumsum(band_energy, axis=0)
+    energy = total[FINGERPRINT_FRAMES - 1:].copy()
+    energy[1:] -= total[:-FINGERPRINT_FRAMES]
+    log_energy = np.log(energy + 1e-12)
+    slope = log_energy[:, :-1] - log_energy[:, 1:]
+    bits = (slope[1:] - slope[:-1]) > 0
+    return np.packbits(bits, axis=1).tobytes().hex()
+
+def frame_levels(frames):
+    """(帧数, 帧长, 声道) -> (帧数, 2) uint8：每帧所有声道的峰值和 RMS，量化到 0-255"""
+    levels = np.empty((len(frames), 2), dtype=np.float32)
+    np.abs(frames).max(axis=(1, 2), out=levels[:, 0])
+    levels[:, 1] = np.sqrt(np.square(frames).mean(axis=(1, 2)))
+    return np.rint(np.clip(levels, 0.0, 1.0) * 255).astype(np.uint8)
+
+def analyze_track(file_path, throttle=None):
+    """
+    一次流式解码同时完成响度分析和波形概览
+    - 每 100ms 一帧，rfft 后按 K 加权功率响应求均方（Parseval），整块向量化
+    - 4 帧组成 400ms 门限块（75% 重叠），按 BS.1770 做绝对/相对门限
+    - 同样的帧顺便求峰值/RMS，得到每 100ms 一个 bin 的波形概览
+    - 开头 FINGERPRINT_SECONDS 秒的频谱再按频带求和，得到内容指纹（见 fingerprint_bits）
+    返回 (loudness, peak, waveform, fingerprint)，全静音时 loudness 为 None；被节流函数中止时全为 None
+    """
+    energies = []
+    levels = []
+    bands = []
+    band_frames = 0
+    peak = 0.0
+    rest = None
+    weight = None
+    # 计时从取下一块之前开始，解码耗时也算进节流
+    started = time.perf_counter()
+    for block, fs in iter_audio_blocks(file_path):
+        frame_len = int(fs * 0.1)
+        if weight is None:
+            edges = fingerprint_band_edges(fs, frame_len)
+            # rfft 的 Parseval 权重：直流和奈奎斯特点计一次，其余计两次
+            weight = np.full(frame_len // 2 + 1, 2.0)
+            weight[0] = 1.0
+            if frame_len % 2 == 0:
+                weight[-1] = 1.0
+            weight *= k_weighting_power(fs, frame_len) / (frame_len * frame_len)
+
+        peak = max(peak, float(np.abs(block).max(initial=0.0)))
+        pending = block if rest is None else np.concatenate((rest, block))
+        usable = len(pending) // frame_len * frame_len
+        rest = pending[usable:]
+        if usable:
+            frames = pending[:usable].reshape(-1, frame_len, pending.shape[1])
+            spectrum = np.fft.rfft(frames, axis=1)
+            power = (spectrum.real ** 2 + spectrum.imag ** 2) * weight[None, :, None]
+            energies.append(power.sum(axis=(1, 2)))
+            levels.append(frame_levels(frames))
+            if band_frames < FINGERPRINT_SECONDS * 10:
+                # K 加权对每个频带是固定比例，不影响指纹（只看能量变化方向）
+                band_power = power[:FINGERPRINT_SECONDS * 10 - band_frames, edges[0]:edges[-1]].sum(axis=2)
+                bands.append(np.add.reduceat(band_power, edges[:-1] - edges[0], axis=1))
+                band_frames += len(band_power)
+
+        if throttle:
+            if not throttle(time.perf_counter() - started):
+                return None, None, None, None
+        started = time.perf_counter()
+
+    # 不足一帧的结尾只进波形，不参与响度计算
+    if rest is not None and len(rest):
+        levels.append(frame_levels(rest[None]))
+    waveform = np.concatenate(levels) if levels else np.zeros((0, 2), dtype=np.uint8)
+    fingerprint = fingerprint_bits(np.concatenate(bands)) if bands else None
+    if not energies:
+        return None, peak, waveform, fingerprint
+    energies = np.concatenate(energies)
+    if len(energies) < 4:
+        return None, peak, waveform, fingerprint
+    blocks = np.convolve(energies, np.full(4, 0.25), mode='valid')
+    with np.errstate(divide='ignore'):
+        loudness = -0.691 + 10 * np.log10(blocks)
+    gated = blocks[loudness > -70.0]
+    if not len(gated):
+        return None, peak, waveform, fingerprint
+    relative_gate = -0.691 + 10 * np.log10(gated.mean()) - 10.0
+    gated = blocks[loudness > max(-70.0, relative_gate)]
+    return float(-0.691 + 10 * np.log10(gated.mean())), peak, waveform, fingerprint
+
+def track_gain(name):
+    """归一化增益（线性），根据缓存的响度计算并受峰值限制不削波；未分析时为 1.0"""
+    if not state.normalize:
+        return 1.0
+    entry = library.get(name)
+    if not entry or entry.get("loudness") is None:
+        return 1.0
+    gain = 10 ** ((REFERENCE_LOUDNESS - entry["loudness"]) / 20)
+    if entry.get("peak"):
+        gain = min(gain, 1.0 / entry["peak"])
+    return gain
+
+def analysis_throttle(elapsed):
+    """
+    后台分析节流：每处理一块就让出时间片
+    播放中只占约 10% 的时间，空闲时约 50%；返回 False 表示应当退出
+    """
+    with state.lock:
+        if state.exit_program:
+            return False
+        busy = state.playing and not state.pause_program
+    time.sleep(elapsed * (9 if busy else 1) + 0.001)
+    return True
+
+def needs_analysis(name):
+    entry = library.get(name) or {}
+    return "loudness" not in entry or "waveform" not in entry or "fingerprint" not in entry
+
+def analysis_worker():
+    """后台线程：先分析 get_waveform 在等的曲目，再按播放顺序逐首分析，结果写入曲库缓存"""
+    while True:
+        with state.lock:
+            if state.exit_program:
+                return
+            playlist = state.shuffled_playlist
+            index = max(state.playlist_index, 0)
+            order = list(waveform_requests) + playlist[index:] + playlist[:index]
+        pending = [name for name in order if needs_analysis(name)]
+        if not pending:
+            # 剩下的请求是已经分析过（或者不在曲库里）的曲目，直接回复
+            for name in list(waveform_requests):
+                waveform_requests.pop(name, None)
+                send_waveform(name)
+            return
+        name = pending[0]
+        try:
+            loudness, peak, waveform, fingerprint = analyze_track(state.directory_path + name,
+                                                                  throttle=analysis_throttle)
+        except Exception as e:
+            print(f"曲目分析失败 {name}: {e}", file=sys.stderr)
+            loudness, peak, waveform, fingerprint = None, None, None, None
+        with state.lock:
+            if state.exit_program:
+                return
+        if waveform is not None and len(waveform):
+            library.save_waveform(name, waveform)
+        library.update(
+            name,
+            loudness=round(loudness, 2) if loudness is not None else None,
+            peak=round(peak, 4) if peak is not None else None,
+            waveform=len(waveform) if waveform is not None else 0,
+            fingerprint=fingerprint
+        )
+        library.save()
+        if loudness is not None:
+            print(f"响度分析: {name} {loudness:.1f} LUFS, 峰值 {peak:.3f}", file=sys.stderr)
+        # 新指纹增量加入去重索引，和已有曲目重复时从播放列表里去掉
+        original = duplicates.add(name)
+        if original is not None and remove_track(name):
+            print(f"重复曲目: {name} 与 {original} 相同，已从播放列表去掉", file=sys.stderr)
+        if waveform_requests.pop(name, None):
+            send_waveform(name)
+
+# ============ 波形概览 ============
+WAVEFORM_CHUNK = 2000        # 每条 waveform 事件最多带多少个 bin
+
+waveform_requests = collections.OrderedDict()   # 等分析完再回复的 get_waveform（曲目名 -> True）
+analysis_thread = None
+
+def start_analysis():
+    """启动后台分析线程（已在运行时什么也不做）"""
+    global analysis_thread
+    with state.lock:
+        if analysis_thread is not None and analysis_thread.is_alive():
+            return
+        analysis_thread = threading.Thread(target=analysis_worker, daemon=True)
+        analysis_thread.start()
+
+def send_waveform(name):
+    """分块发送波形概览；曲目无法分析时发送 total=0 的一条"""
+    waveform = library.load_waveform(name)
+    if waveform is None:
+        waveform = np.zeros((0, 2), dtype=np.uint8)
+    total = len(waveform)
+    offset = 0
+    while True:
+        part = waveform[offset:offset + WAVEFORM_CHUNK]
+        state.send_event("waveform", {
+            "name": name,
+            "resolution": WAVEFORM_RESOLUTION,
+            "total": total,
+            "offset": offset,
+            "peak": part[:, 0].tolist(),
+            "rms": part[:, 1].tolist(),
+            "done": offset + len(part) >= total
+        })
+        offset += len(part)
+        if offset >= total:
+            return
+
+def request_waveform(name):
+    """get_waveform：已分析的直接发送，否则排到后台分析队列最前，分析完再发送"""
+    # 只接受音乐文件夹里存在的文件名，其它情况回复空波形
+    if os.path.basename(name) != name or not os.path.isfile(state.directory_path + name) or not needs_analysis(name):
+        send_waveform(name)
+        return
+    with state.lock:
+        waveform_requests[name] = True
+    # 分析线程由主程序在启动步骤完成后第一次启动，之前的请求先排队
+    if analysis_thread is not None:
+        start_analysis()
+
+# ============ 重采样与固定格式输出 ============
+class Resampler:
+    """
+    流式多相重采样 + 声道重混（纯 NumPy 向量化）
+    - 把任意采样率/声道数的曲目转换成输出设备的固定格式
+    - 有理数比例 L/M 的多相加窗 sinc 滤波，每个 chunk 一次批量矩阵乘
+    - 采样率相同时只做声道重混，不经过滤波
+    - 默认 48 抽头：48k->44.1k 混叠、44.1k->48k 镜像都压到约 -85 dB；
+      32 抽头在 48k->44.1k 只有约 -34 dB，64 抽头再多花约 20% CPU 也只好一两个 dB（benchmark.py resample）
+    """
+    def __init__(self, src_rate, dst_rate, src_channels, dst_channels, taps=48):
+        self.src_rate = int(src_rate)
+        self.dst_rate = int(dst_rate)
+        self.src_channels = src_channels
+        self.dst_channels = dst_channels
+        self.mix = self._remix_matrix(src_channels, dst_channels)
+
+        g = math.gcd(self.src_rate, self.dst_rate)
+        self.up = self.dst_rate // g      # L
+        self.down = self.src_rate // g    # M
+        self.passthrough = self.up == self.down
+        if self.passthrough:
+            return
+
+        # 降采样时截止频率按比例降低，滤波器相应加长
+        cutoff = min(1.0, self.up / self.down) * 0.95
+        self.half = int(math.ceil(taps / 2 / min(1.0, cutoff)))
+        self.taps = self.half * 2
+        phases = np.arange(self.up)[:, None] / self.up
+        tau = phases + self.half - 1 - np.arange(self.taps)[None, :]
+        # Kaiser 窗 (beta=8)，按抽头到输出时刻的距离取值
+        window = np.i0(8.0 * np.sqrt(np.clip(1 - (tau / self.half) ** 2, 0, None))) / np.i0(8.0)
+        bank = cutoff * np.sinc(cutoff * tau) * window
+        # 每个相位归一化，保证直流增益为 1
+        self.bank = (bank / bank.sum(axis=1, keepdims=True)).astype(np.float32)
+        self.reset()
+
+    @staticmethod
+    def _remix_matrix(src, dst):
+        """声道重混矩阵 (src, dst)；相同声道数时返回 None"""
+        if src == dst:
+            return None
+        if src == 1:
+            return np.ones((1, dst), dtype=np.float32)
+        if dst == 1:
+            return np.full((src, 1), 1.0 / src, dtype=np.float32)
+        mix = np.zeros((src, dst), dtype=np.float32)
+        for c in range(src):
+            mix[c, c % dst] = 1.0
+        return mix / mix.sum(axis=0, keepdims=True).clip(min=1)
+
+    def reset(self):
+        """清空滤波器历史（跳转后调用）"""
+        if self.passthrough:
+            return
+        self._buf = np.zeros((self.half - 1, self.dst_channels), dtype=np.float32)
+        self._base = -(self.half - 1)   # _buf[0] 对应的输入帧号
+        self._t = 0                     # 下一个输出样本的位置（单位：1/L 输入帧）
+
+    def process(self, chunk):
+        """输入 (n, src_channels) float32，返回设备格式 (m, dst_channels) float32"""
+        if self.mix is not None:
+            chunk = chunk @ self.mix
+        if self.passthrough:
+            return chunk
+        buf = np.concatenate((self._buf, chunk)) if len(self._buf) else chunk
+        L, M = self.up, self.down
+        # 最后一个抽头不能越过缓冲区末尾
+        last_index = self._base + len(buf) - 1 - self.taps + self.half
+        n = ((last_index + 1) * L - 1 - self._t) // M + 1
+        if n <= 0:
+            self._buf = buf
+            return np.empty((0, self.dst_channels), dtype=np.float32)
+
+        t = self._t + M * np.arange(n, dtype=np.int64)
+        start = t // L - self._base - self.half + 1
+        # 滑动窗口视图不复制数据，只按起点取出需要的 (n, channels, taps) 窗口
+        windows = np.lib.stride_tricks.sliding_window_view(buf, self.taps, axis=0)[start]
+        out = (windows @ self.bank[t % L][:, :, None])[..., 0]
+
+        self._t += n * M
+        keep_from = self._t // L - self._base - self.half + 1
+        self._buf = buf[keep_from:]
+        self._base += keep_from
+        return out
+
+    def flush(self):
+        """曲目结束时补零，输出滤波器中剩余的样本"""
+        if self.passthrough:
+            return np.empty((0, self.dst_channels), dtype=np.float32)
+        return self.process(np.zeros((self.half, self.src_channels), dtype=np.float32))
+
+
+class OutputError(Exception):
+    """输出流出错（设备被拔掉、驱动异常），和曲目解码/读取失败区分开：只有它需要重新枚举设备"""
+
+
+class OutputPipeline:
+    """
+    固定格式的音频输出
+    - 按输出设备的原生采样率/声道数打开一次输出流，整个会话复用
+    - 暂停只 stop 不 close，切歌不重建；只有切换设备或设备异常时才重新打开
+    - 具体输出到哪里由 backend 决定（声卡 / null / 文件）
+    """
+    def __init__(self, backend=None):
+        self.backend = backend or SoundDeviceBackend()
+        self.stream = None
+        self.samplerate = None
+        self.channels = None
+
+    @property
+    def realtime(self):
+        """write 是否按实时速度阻塞（不限速的 null/文件后端为 False）"""
+        return self.backend.realtime
+
+    def open(self):
+        """按当前默认输出设备的原生格式打开（已打开则直接返回）"""
+        if self.stream is not None:
+            return
+        try:
+            self.samplerate, self.channels = self.backend.native_format()
+            self.stream = self.backend.open_stream(self.samplerate, self.channels)
+        except Exception as e:
+            raise OutputError(f"打开输出流失败: {e}") from e
+        output_stream_open.set(1)
+        print(f"输出格式: {self.samplerate}Hz / {self.channels}声道", file=sys.stderr)
+
+    def start(self):
+        self.open()
+        if not self.stream.active:
+            try:
+                self.stream.start()
+            except Exception as e:
+                raise OutputError(f"启动输出流失败: {e}") from e
+
+    def stop(self):
+        if self.stream is not None and self.stream.active:
+            self.stream.stop()
+
+    def write(self, frames):
+        if len(frames):
+            t0 = time.perf_counter()
+            try:
+                self.stream.write(frames)
+            except Exception as e:
+                raise OutputError(f"写入输出流失败: {e}") from e
+            chunk_write_seconds.observe(time.perf_counter() - t0)
+
+    def close(self):
+        if self.stream is not None:
+            try:
+                self.stream.stop()
+                self.stream.close()
+            except Exception as e:
+                print(f"关闭输出流失败: {e}", file=sys.stderr)
+            self.stream = None
+            output_stream_open.set(0)
+
+output = OutputPipeline()
+
+# ============ 交叉淡化 ============
+class Crossfader:
+    """
+    相邻曲目的交叉淡化（等功率曲线）
+    - 增益曲线和混音缓冲区按淡化时长/输出格式预分配，切歌时不再分配
+    - 下一首的开头提前在后台解码并转换成设备格式，放进 head 缓冲区
+    - 淡化时只做向量乘加；结束后下一首沿用同一个 Resampler 接着播放，样本连续
+    """
+    MARGIN = 32768       # 缓冲区比淡化长度多留的帧数，吸收重采样的取整误差
+    PREPARE_STEP = 1024  # 准备 head 时每次转换的源帧数（保证单次输出不超过 MARGIN）
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.frames = 0
+        self.samplerate = None
+        self.channels = None
+        self.generation = 0
+        self.ready = None
+        self.pos = 0         # head 中已经输出的帧数
+
+    def configure(self, seconds, samplerate, channels):
+        """按淡化时长和输出格式（重新）分配缓冲区，参数不变时不做任何事"""
+        frames = int(seconds * samplerate)
+        if (frames, samplerate, channels) == (self.frames, self.samplerate, self.channels):
+            return
+        self.frames, self.samplerate, self.channels = frames, samplerate, channels
+        size = frames + self.MARGIN
+        self.ramp = np.arange(size, dtype=np.float32) + 0.5
+        self.fade_out = np.empty(size, dtype=np.float32)
+        self.fade_in = np.empty(size, dtype=np.float32)
+        self.head = np.zeros((size, channels), dtype=np.float32)
+        self.mix_buffer = np.empty((size, channels), dtype=np.float32)
+        self.scratch = np.empty((size, channels), dtype=np.float32)
+
+    def request(self, name, seconds):
+        """（播放线程调用）在后台准备下一首的开头"""
+        with self.lock:
+            self.generation += 1
+            self.ready = None
+            generation = self.generation
+        threading.Thread(target=self._prepare, args=(name, seconds, generation), daemon=True).start()
+
+    def _prepare(self, name, seconds, generation):
+        try:
+            data, fs = load_audio(state.directory_path + name)
+            gain = track_gain(name)
+            with self.lock:
+                # 期间又请求了别的曲目，放弃本次结果
+                if generation != self.generation:
+                    return
+                self.configure(seconds, output.samplerate, output.channels)
+                resampler = Resampler(fs, self.samplerate, data.shape[1], self.channels)
+                filled = 0
+                frame = 0
+                while filled < self.frames + 256 and frame < len(data):
+                    part = resampler.process((data[frame:frame + self.PREPARE_STEP] * gain).astype('float32'))
+                    self.head[filled:filled + len(part)] = part
+                    filled += len(part)
+                    frame += self.PREPARE_STEP
+                self.ready = {
+                    "name": name,
+                    "data": data,
+                    "fs": fs,
+                    "gain": gain,
+                    "resampler": resampler,
+                    "frame": min(frame, len(data)),
+                    "filled": filled,
+                }
+            # 手动切到下一首时也能直接用已解码的数据；三个字段一起换，播放线程不会拿到半新半旧的组合
+            with state.lock:
+                state.preloaded_data = data
+                state.preloaded_fs = fs
+                state.preloaded_song = name
+        except Exception as e:
+            print(f"准备交叉淡化失败 {name}: {e}", file=sys.stderr)
+
+    def take(self, name, remaining):
+        """
+        淡化开始时取出准备好的下一首；还没准备好返回 None（退化为直接切歌）
+        remaining: 当前曲目剩余的设备帧数；淡化起点落在 chunk 边界上，
+                   曲线按实际剩余长度原地重算，保证淡出正好在当前曲目结束时完成
+        """
+        with self.lock:
+            ready = self.ready
+            if ready is None or ready["name"] != name or self.frames == 0:
+                return None
+            self.ready = None
+            self.pos = 0
+        length = max(1, min(remaining, self.frames))
+        # 等功率曲线；超过淡化长度的部分：淡出为 0，淡入为 1
+        np.multiply(self.ramp[:length], np.float32(np.pi / 2 / length), out=self.fade_in[:length])
+        np.cos(self.fade_in[:length], out=self.fade_out[:length])
+        np.sin(self.fade_in[:length], out=self.fade_in[:length])
+        self.fade_out[length:] = 0
+        self.fade_in[length:] = 1
+        return ready
+
+    def cancel(self, ready):
+        """淡化中途被跳转打断，放回去等下次再用"""
+        with self.lock:
+            self.ready = ready
+            self.pos = 0
+
+    def mix(self, frames, volume, ready):
+        """当前曲目（已是设备格式、已乘音量）与下一首开头混合，返回预分配缓冲区上的视图"""
+        n = len(frames)
+        j = self.pos
+        size = len(self.fade_out)
+        m = max(0, min(n, size - j))
+        out = self.mix_buffer[:n] if n <= size else np.empty((n, self.channels), dtype=np.float32)
+        np.multiply(frames[:m], self.fade_out[j:j + m, None], out=out[:m])
+        out[m:] = 0
+        h = max(0, min(n, ready["filled"] - j))
+        if h:
+            incoming = self.scratch[:h]
+            np.multiply(self.head[j:j + h], self.fade_in[j:j + h, None], out=incoming)
+            incoming *= volume
+            out[:h] += incoming
+        self.pos += n
+        return out
+
+    def remainder(self, ready, volume):
+        """当前曲目结束后，head 中还没输出的部分"""
+        j = min(self.pos, ready["filled"])
+        rest = self.head[j:ready["filled"]] * (self.fade_in[j:ready["filled"], None] * volume)
+        self.pos = ready["filled"]
+        return rest
+
+crossfader = Crossfader()
 
 # ============ 播放函数 ============
-def play_a_song(name, start_position=0):
-    """播放一首歌，处理所有状态（暂停、切歌等）"""
+def play_a_song(name, start_position=0, resume=None):
+    """
+    播放一首歌，处理所有状态（暂停、切歌等）
+    resume: 交叉淡化交接过来的下一首（已解码的数据、Resampler 和播放位置）
+    """
     if name is None:
         return "error"
     
     try:
-        # 检查是否有预加载的数据可以使用
-        if state.preloaded_song == name and state.preloaded_data is not None:
-            data = state.preloaded_data
-            fs = state.preloaded_fs
-            state.preloaded_data = None
-            state.preloaded_song = None
-            state.preloaded_fs = None
+        # 检查是否有预加载的数据可以使用；检查和取走在同一把锁里，和 Crossfader._prepare 的写入互斥
+        preloaded = None
+        with state.lock:
+            if state.preloaded_song == name:
+                if state.preloaded_data is not None:
+                    preloaded = (state.preloaded_data, state.preloaded_fs)
+                state.preloaded_data = None
+                state.preloaded_song = None
+                state.preloaded_fs = None
+        if resume is not None:
+            data = resume["data"]
+            fs = resume["fs"]
+        elif preloaded is not None:
+            data, fs = preloaded
         else:
-            file_path = state.directory_path + name
-            with sf.SoundFile(file_path) as f:
-                fs = f.samplerate
-                data = f.read(always_2d=True).astype('float32')
+            data, fs = load_audio(state.directory_path + name)
         
         if len(data.shape) == 1:
             data = data.reshape(-1, 1)
@@ -307,135 +1789,138 @@ def play_a_song(name, start_position=0):
         total_frames = len(data)
         duration = total_frames / fs
         
+        track_change = None
         with state.lock:
             state.track_name = name
             state.duration = int(duration)
-            if start_position == 0:
-                state.current_time = 0
+            if start_position == 0 or resume is not None:
+                state.current_time = int(resume["frame"] / fs) if resume is not None else 0
                 # 只有在已初始化后才发送 track_change（避免在 ready 后发送初始化事件）
                 if state.initialized:
-                    state.send_event("track_change", {
+                    track_change = {
                         "name": name,
                         "duration": state.duration,
                         "has_prev": len(state.play_history) > 1
-                    })
+                    }
+        if track_change is not None:
+            state.send_event("track_change", track_change)
+        if start_position == 0 or resume is not None:
+            session.remember_track(name, int(duration))
+            tracks_started.inc()
+        
+        # 响度归一化增益在切歌时算好，播放循环里和音量合并成一次乘法
+        gain = resume["gain"] if resume is not None else track_gain(name)
         
         current_frame = int(start_position * fs) if start_position > 0 else 0
         chunk_size = 4096
+        
+        # ========== 主播放循环（包含暂停处理）==========
+        # 输出流整个会话只打开一次，这里只负责把曲目转换成设备格式
+        output.open()
+        if resume is not None:
+            current_frame = resume["frame"]
+            resampler = resume["resampler"]
+            streaming = output.stream.active
+        else:
+            resampler = Resampler(fs, output.samplerate, channels, output.channels)
+            streaming = False
         last_progress_time = int(current_frame / fs)
         last_progress_timestamp = time.time()
         progress_error_count = 0
         
-        # ========== 主播放循环（包含暂停处理）==========
-        # 注意：stream 在需要时才创建，暂停状态下不创建
-        stream = None
+        # 交叉淡化：提前 30 秒在后台准备下一首，最后 fade_frames 帧与下一首混合
+        crossfade_seconds = state.crossfade
+        fade_frames = int(crossfade_seconds * fs)
+        fade_start = total_frames - fade_frames
+        crossfade_enabled = fade_frames > 0 and fade_start > fade_frames
+        prepare_frame = max(0, fade_start - 30 * fs)
+        next_song = None
+        fading = None
+        
+        paused = False
         
         while current_frame < total_frames:
-            # 检查控制命令
-            with state.lock:
-                if state.exit_program:
-                    if stream:
-                        stream.stop()
-                        stream.close()
-                    return "exit"
-                
-                if state.device_changed:
-                    state.device_changed = False
-                    if stream:
-                        stream.stop()
-                        stream.close()
-                    return ("device_change", current_frame / fs)
-                
-                if state.next_one:
-                    state.next_one = False
-                    if stream:
-                        stream.stop()
-                        stream.close()
-                    return "next"
-                
-                if state.prev_one:
-                    state.prev_one = False
-                    if stream:
-                        stream.stop()
-                        stream.close()
-                    return "prev"
-                
-                # 检查seek
-                if state.seek_position is not None:
-                    seek_frame = int(state.seek_position * fs)
+            playback_heartbeat.beat()
+            if state.exit_program:
+                return "exit"
+            
+            # 检查控制命令（队列为空时不加锁）
+            while state.commands:
+                with state.lock:
+                    command, value = state.commands.popleft()
+                if command == "seek":
+                    seek_frame = int(value * fs)
                     current_frame = max(0, min(seek_frame, total_frames - chunk_size))
-                    state.seek_position = None
-                    state.current_time = int(current_frame / fs)
+                    with state.lock:
+                        state.current_time = int(current_frame / fs)
+                    resampler.reset()
+                    if fading is not None:
+                        crossfader.cancel(fading)
+                        fading = None
+                elif command == "device_change":
+                    return ("device_change", current_frame / fs)
+                elif command in ("next", "prev"):
+                    return command
             
             # ========== 检查暂停 ==========
-            pause_local = False
-            with state.lock:
-                pause_local = state.pause_program
-            
-            if pause_local:
-                # 暂停状态：关闭stream，进入暂停循环
-                if stream:
-                    stream.stop()
-                    stream.close()
-                    stream = None
-                
-                # 第一次进入暂停时，标记初始化完成
-                # 这样后续的用户操作会正常发送事件
-                if not state.initialized:
-                    state.initialized = True
-                
-                # 只有在非初始化暂停时才发送 play_state
-                # 初始化暂停（current_frame == 0）不发送事件，前端通过 musicGetStatus 获取初始状态
-                is_initial_pause = (current_frame == 0)
-                if state.initialized and not is_initial_pause:
-                    with state.lock:
+            if state.pause_program:
+                if not paused:
+                    # 暂停状态：停止输出流（不关闭）
+                    paused = True
+                    output.stop()
+                    streaming = False
+                    
+                    # 第一次进入暂停时，标记初始化完成
+                    # 这样后续的用户操作会正常发送事件
+                    if not state.initialized:
+                        state.initialized = True
+                    
+                    # 只有在非初始化暂停时才发送 play_state
+                    # 初始化暂停（current_frame == 0）不发送事件，前端通过 musicGetStatus 获取初始状态
+                    is_initial_pause = (current_frame == 0)
+                    if state.initialized and not is_initial_pause:
                         state.send_event("play_state", {"playing": False})
-                print("已暂停", file=sys.stderr, flush=True)
-                
-                # 暂停循环：等待恢复或其他命令
-                while True:
-                    with state.lock:
-                        if state.exit_program:
-                            return "exit"
-                        if state.device_changed:
-                            state.device_changed = False
-                            return ("device_change", current_frame / fs)
-                        if state.next_one:
-                            state.next_one = False
-                            return "next"
-                        if state.prev_one:
-                            state.prev_one = False
-                            return "prev"
-                        if not state.pause_program:
-                            # 恢复播放
-                            if state.initialized:
-                                state.send_event("play_state", {"playing": True})
-                            break
-                    time.sleep(0.05)
+                    print("已暂停", file=sys.stderr, flush=True)
                 
+                # 阻塞等待恢复或新命令，暂停期间不占用 CPU；跳转命令在暂停中也会生效
+                playback_heartbeat.idle()
+                with state.cond:
+                    state.cond.wait_for(lambda: state.exit_program or state.commands or not state.pause_program)
+                continue
+            
+            if paused:
+                paused = False
                 print("继续播放", file=sys.stderr)
-                # 恢复播放后，会在下面的写入数据部分重新创建stream
-            else:
-                # 播放状态：发送play_state（如果是刚从暂停恢复）
-                with state.lock:
-                    if stream is None:
-                        # 刚进入播放状态，发送事件
-                        state.send_event("play_state", {"playing": True})
+            elif not state.initialized:
+                # ready 之后还没进入初始暂停就收到了 toggle，同样算初始化完成
+                state.initialized = True
+            
+            # 刚开始播放或刚从暂停恢复，发送play_state
+            if not streaming:
+                state.send_event("play_state", {"playing": True})
             
             # ========== 写入音频数据 ==========
-            # 如果stream不存在，创建它
-            if stream is None:
-                stream = sd.OutputStream(
-                    samplerate=fs,
-                    channels=channels,
-                    dtype='float32'
-                )
-                stream.start()
+            if not streaming:
+                output.start()
+                streaming = True
+            
+            if crossfade_enabled:
+                if next_song is None and current_frame >= prepare_frame:
+                    next_song = peek_next_song()
+                    if next_song is not None:
+                        crossfader.request(next_song, crossfade_seconds)
+                if fading is None and next_song is not None and current_frame >= fade_start:
+                    remaining = int((total_frames - current_frame) * output.samplerate / fs)
+                    fading = crossfader.take(next_song, remaining)
             
-            # 写入数据
+            # 写入数据（转换为设备格式）
             end_frame = min(current_frame + chunk_size, total_frames)
-            chunk = (data[current_frame:end_frame] * state.volume).astype('float32')
-            stream.write(chunk)
+            volume = state.volume
+            chunk = (data[current_frame:end_frame] * (volume * gain)).astype('float32')
+            if fading is None:
+                output.write(resampler.process(chunk))
+            else:
+                output.write(crossfader.mix(resampler.process(chunk), volume, fading))
             current_frame = end_frame
             
             # 更新进度（每秒发送一次）
@@ -444,12 +1929,13 @@ def play_a_song(name, start_position=0):
             
             if current_time != last_progress_time:
                 time_diff = current_timestamp - last_progress_timestamp
-                if time_diff < 0.3:
+                # 不限速的后端本来就比实时快，不能据此判断设备异常
+                if time_diff < 0.3 and output.realtime:
                     progress_error_count += 1
+                    underrun_suspects.inc()
                     if progress_error_count >= 3:
-                        if stream:
-                            stream.stop()
-                            stream.close()
+                        device_errors.inc()
+                        output.close()
                         return "device_error"
                 else:
                     progress_error_count = 0
@@ -458,18 +1944,28 @@ def play_a_song(name, start_position=0):
                 last_progress_timestamp = current_timestamp
                 with state.lock:
                     state.current_time = current_time
-                    state.send_event("progress", {
-                        "current": current_time,
-                        "duration": int(duration)
-                    })
+                state.send_event("progress", {
+                    "current": current_time,
+                    "duration": int(duration)
+                })
         
-        # 播放完毕
-        if stream:
-            stream.close()
+        # 淡化完成：补上下一首已准备好的部分，交给主循环接着播放
+        if fading is not None:
+            output.write(crossfader.remainder(fading, state.volume))
+            return ("crossfade", fading)
+        
+        # 播放完毕：输出滤波器尾部，输出流保持打开给下一首使用
+        if streaming:
+            output.write(resampler.flush())
         return "done"
             
+    except OutputError as e:
+        print(f"输出设备错误: {e}", file=sys.stderr)
+        output.close()
+        return "device_error"
     except Exception as e:
         print(f"播放错误: {e}", file=sys.stderr)
+        output.close()
         return "error"
 
 # ============ 命令处理 ============
@@ -478,31 +1974,21 @@ def process_command(command_obj):
     command = command_obj.get("command")
     
     if command == "toggle":
-        with state.lock:
-            if state.pause_program:
-                # 当前暂停，恢复播放
-                state.pause_program = False
-                print("toggle: 恢复播放", file=sys.stderr)
-            else:
-                # 当前播放中，暂停
-                state.pause_program = True
-                print("toggle: 暂停", file=sys.stderr)
+        paused = state.toggle_pause()
+        print("toggle: 暂停" if paused else "toggle: 恢复播放", file=sys.stderr)
     
     elif command == "next":
         print("next命令", file=sys.stderr)
-        with state.lock:
-            state.next_one = True
+        state.post("next")
     
     elif command == "prev":
         print("prev命令", file=sys.stderr)
-        with state.lock:
-            state.prev_one = True
+        state.post("prev")
     
     elif command == "seek":
         position = command_obj.get("position", 0)
         print(f"seek命令: {position}秒", file=sys.stderr)
-        with state.lock:
-            state.seek_position = position
+        state.post("seek", position)
     
     elif command == "set_volume":
         volume = command_obj.get("volume", 0.8)
@@ -510,17 +1996,70 @@ def process_command(command_obj):
         with state.lock:
             state.volume = max(0, min(volume, 1))
     
+    elif command == "set_normalize":
+        enabled = bool(command_obj.get("enabled", True))
+        print(f"set_normalize命令: {enabled}", file=sys.stderr)
+        with state.lock:
+            state.normalize = enabled
+    
+    elif command == "set_crossfade":
+        seconds = command_obj.get("seconds", 3.0)
+        print(f"set_crossfade命令: {seconds}秒", file=sys.stderr)
+        with state.lock:
+            state.crossfade = max(0.0, min(float(seconds), 12.0))
+    
     elif command == "get_status":
         state.send_status()
     
+    elif command == "get_metrics":
+        state.send_event("metrics", metrics.payload(command_obj.get("format", "json")))
+    
+    elif command == "start_profile":
+        path = command_obj.get("path") or os.path.join(
+            state.directory_path, os.pardir, "profiles", time.strftime("music-%Y%m%d-%H%M%S.folded"))
+        try:
+            state.send_event("profile_started", profiler.start(
+                os.path.abspath(path), command_obj.get("interval_ms", 5), command_obj.get("duration", 60)))
+        except (RuntimeError, OSError, ValueError, TypeError) as e:
+            state.send_event("profile_error", {"message": str(e)})
+    
+    elif command == "stop_profile":
+        try:
+            state.send_event("profile_saved", profiler.stop())
+        except (RuntimeError, OSError) as e:
+            state.send_event("profile_error", {"message": str(e)})
+    
     elif command == "get_devices":
         state.send_devices()
     
+    elif command == "get_waveform":
+        with state.lock:
+            name = command_obj.get("name") or state.track_name
+        if name:
+            request_waveform(name)
+    
+    elif command == "refresh_devices":
+        print("refresh_devices命令", file=sys.stderr)
+        devices.request_rescan()
+    
+    elif command == "ingest":
+        name = command_obj.get("name", "")
+        print(f"ingest命令: {name}", file=sys.stderr)
+        if not ingest_track(name):
+            with state.lock:
+                known = os.path.basename(name) in state.file_list
+            if not known:
+                state.send_event("play_error", {"message": f"无法加入曲目: {name}"})
+    
     elif command == "set_device":
         device_id = command_obj.get("device_id")
         if device_id is not None:
             if set_output_device(device_id):
                 state.send_devices()
+    
+    elif command == "exit":
+        print("exit命令", file=sys.stderr)
+        state.request_exit()
 
 def stdin_reader():
     """读取来自Electron的命令"""
@@ -533,6 +2072,8 @@ def stdin_reader():
             process_command(command)
         except json.JSONDecodeError as e:
             print(f"JSON解析错误: {e}", file=sys.stderr)
+    # stdin 关闭说明父进程已经不在了
+    state.request_exit()
 
 def get_song_duration(name):
     """获取歌曲时长"""
@@ -559,96 +2100,207 @@ def preload_audio_data(song):
     """预加载音频数据"""
     if song:
         try:
-            file_path = state.directory_path + song
-            with sf.SoundFile(file_path) as f:
-                data = f.read(always_2d=True)
-                state.preloaded_data = data.astype('float32')
-                state.preloaded_fs = f.samplerate
+            data, fs = load_audio(state.directory_path + song)
+            with state.lock:
+                state.preloaded_data = data
+                state.preloaded_fs = fs
                 state.preloaded_song = song
         except Exception as e:
             print(f"预加载音频数据失败: {e}", file=sys.stderr)
 
-# ============ 主程序 ============
-if __name__ == "__main__":
-    # 读取命令行参数（设备ID）
-    initial_device_id = None
-    if len(sys.argv) > 1:
+def parse_args(argv=None):
+    """命令行参数；Electron 只传一个设备ID，其余参数用于测试和性能测试"""
+    parser = argparse.ArgumentParser(description="番茄钟音乐播放器")
+    parser.add_argument("device_id", nargs="?", help="输出设备ID")
+    parser.add_argument("--backend", choices=("sounddevice", "null", "file"), default="sounddevice",
+                        help="输出后端：声卡 / 不出声 / 写入 WAV 文件")
+    parser.add_argument("--output-file", default="output.wav", help="file 后端写入的文件")
+    parser.add_argument("--unthrottled", action="store_true", help="null/file 后端不按实时速度，尽快写完")
+    parser.add_argument("--music-dir", default="music/", help="音乐文件夹")
+    parser.add_argument("--no-hotkeys", action="store_true", help="不启动全局快捷键监听")
+    parser.add_argument("--hotkeys", default="hotkeys.json", help="快捷键配置文件")
+    parser.add_argument("--metrics-file", help="定期把指标写成 Prometheus 文本文件")
+    parser.add_argument("--metrics-interval", type=float, default=10.0, help="写指标文件的间隔（秒）")
+    parser.add_argument("--stall-threshold", type=float, default=2.0,
+                        help="播放循环超过多少秒没有推进算卡顿（发送 stall_detected），0 关闭")
+    args, _ = parser.parse_known_args(argv)
+    try:
+        args.device_id = int(args.device_id) if args.device_id is not None else None
+    except ValueError:
+        args.device_id = None
+    return args
+
+def create_backend(args):
+    if args.backend == "null":
+        return NullBackend(realtime=not args.unthrottled)
+    if args.backend == "file":
+        return FileBackend(args.output_file, realtime=not args.unthrottled)
+    return SoundDeviceBackend()
+
+def run_deferred(name, target, *args):
+    """ready 之后在后台线程里完成的启动步骤，耗时记入 state.startup"""
+    def run():
+        t0 = time.perf_counter()
         try:
-            initial_device_id = int(sys.argv[1])
-        except ValueError:
-            pass
+            target(*args)
+        except Exception as e:
+            print(f"启动步骤 {name} 失败: {e}", file=sys.stderr)
+        state.startup[name] = round((time.perf_counter() - t0) * 1000, 1)
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def scan_library(first_song):
+    """扫描音乐文件夹建立随机播放列表；first_song 是已经随 ready 发出的曲目，放在列表最前"""
+    # 先读曲库缓存，建列表时按其中的指纹去重
+    library.load(state.directory_path)
+    init_shuffled_playlist()
+    if first_song in state.shuffled_playlist:
+        playlist = state.shuffled_playlist
+        i = playlist.index(first_song)
+        playlist[0], playlist[i] = playlist[i], playlist[0]
+        state.playlist_index = 0
+        state.play_history = [0]
+
+# ============ 主程序 ============
+def main(args, read_stdin=True):
+    """
+    播放器主流程：加载会话、发 ready、运行播放循环直到收到 exit
+    单独运行时由 __main__ 调用；合并宿主进程（sidecar/sidecar_host.py）在线程里调用，read_stdin=False
+    """
+    output.backend = create_backend(args)
+    metrics.start_export(args.metrics_file, args.metrics_interval)
+    watchdog.start(args.stall_threshold)
+    state.directory_path = os.path.join(args.music_dir, "")
     
-    select_output_device(initial_device_id)
+    # 快速启动：先用上次会话记录的曲目发 ready，枚举设备、快捷键、扫描曲库都放到 ready 之后
+    t0 = time.perf_counter()
+    session.load(state.directory_path)
+    last = session.last_track()
+    # Electron 保存的是设备序号，序号和上次会话一致时按会话里的 key 找回（重新枚举后序号可能变了）
+    device_id = args.device_id
+    saved_device = session.data.get("device") or {}
+    device_key = saved_device.get("key") if device_id is None or saved_device.get("id") == device_id else None
+    if device_id is None:
+        device_id = saved_device.get("id")
+    state.current_device_id = device_id
+    state.startup["session"] = round((time.perf_counter() - t0) * 1000, 1)
     
-    # 启动stdin读取线程
-    stdin_thread = threading.Thread(target=stdin_reader, daemon=True)
-    stdin_thread.start()
+    # 启动stdin读取线程（合并宿主进程里由宿主读 stdin 并转发命令）
+    if read_stdin:
+        stdin_thread = threading.Thread(target=stdin_reader, daemon=True)
+        stdin_thread.start()
     
-    # 初始化播放列表
-    has_music = init_shuffled_playlist()
+    deferred = [run_deferred("devices", select_output_device, device_id, device_key)]
+    if not args.no_hotkeys:
+        deferred.append(run_deferred("hotkeys", start_keyboard_listener, args.hotkeys))
+    
+    if last is not None:
+        # 准备状态 = 暂停状态，和 init_first_song 一致
+        current_song, state.duration = last
+        state.track_name = current_song
+        state.current_time = 0
+        state.playing = True
+        state.pause_program = True
+        deferred.append(run_deferred("library", scan_library, current_song))
+    else:
+        # 没有会话记录（第一次启动或曲目已删除）：同步扫描
+        t0 = time.perf_counter()
+        library.load(state.directory_path)
+        has_music = init_shuffled_playlist()
+        state.startup["library"] = round((time.perf_counter() - t0) * 1000, 1)
+        
+        if not has_music:
+            print("没有找到音乐文件", file=sys.stderr)
+            # 先发送 ready 事件，让加载页面能正常结束
+            state.startup["ready"] = round((time.perf_counter() - STARTED_AT) * 1000, 1)
+            state.send_event("ready", {
+                "name": "", 
+                "duration": 0,
+                "has_prev": False,
+                "startup": dict(state.startup)
+            })
+            # 再发送 no_music 事件
+            state.send_event("no_music", {"message": "music文件夹中没有音乐文件"})
+            # 等下载器 ingest 第一首歌（或退出）
+            with state.cond:
+                state.cond.wait_for(lambda: state.exit_program or state.file_list)
+            if state.exit_program:
+                if listener:
+                    listener.stop()
+                print("程序已退出", file=sys.stderr)
+                events.flush()
+                return
+        
+        # 初始化第一首歌（准备状态 = 暂停状态）
+        t0 = time.perf_counter()
+        current_song = init_first_song()
+        state.startup["first_song"] = round((time.perf_counter() - t0) * 1000, 1)
     
-    if not has_music:
-        print("没有找到音乐文件", file=sys.stderr)
-        # 先发送 ready 事件，让加载页面能正常结束
-        state.send_event("ready", {
-            "name": "", 
-            "duration": 0,
-            "has_prev": False
-        })
-        # 再发送 no_music 事件
-        state.send_event("no_music", {"message": "music文件夹中没有音乐文件"})
-        while True:
-            with state.lock:
-                if state.exit_program:
-                    break
-            time.sleep(0.1)
-        if listener:
-            listener.stop()
-        print("程序已退出", file=sys.stderr)
-        sys.exit(0)
-    
-    # 初始化第一首歌（准备状态 = 暂停状态）
-    current_song = init_first_song()
     current_position = 0
+    resume = None
     
-    # 发送 ready 事件（触发 Electron 加载主页面）
-    state.send_event("ready", {
-        "name": state.track_name, 
-        "duration": state.duration,
-        "has_prev": len(state.play_history) > 1
-    })
+    if "ready" in state.startup:
+        # 没有音乐时已经发过 ready，第一首歌由 ingest 加入
+        state.send_event("track_change", {
+            "name": state.track_name,
+            "duration": state.duration,
+            "has_prev": False
+        })
+    else:
+        # 发送 ready 事件（触发 Electron 加载主页面）
+        state.startup["ready"] = round((time.perf_counter() - STARTED_AT) * 1000, 1)
+        state.send_event("ready", {
+            "name": state.track_name, 
+            "duration": state.duration,
+            "has_prev": len(state.play_history) > 1,
+            "startup": dict(state.startup)
+        })
     
     # 预加载音频数据
     if current_song:
         preload_thread = threading.Thread(target=preload_audio_data, args=(current_song,), daemon=True)
         preload_thread.start()
     
+    # 播放需要设备和播放列表，等后台启动步骤完成（此时 ready 早已发出）
+    for thread in deferred:
+        thread.join()
+    
+    # 后台分析曲库响度和波形（节流，不与播放争抢 CPU）
+    start_analysis()
+    
     # ========== 主循环（简化）==========
     while True:
-        with state.lock:
+        # 主循环只需要等 playing 状态，play_a_song 内部会处理暂停
+        # 不在播放会话中时阻塞等待，不轮询
+        with state.cond:
+            state.cond.wait_for(lambda: state.exit_program or state.playing)
             if state.exit_program:
                 break
         
-        # 主循环只需要检查 playing 状态
-        # play_a_song 内部会处理暂停
-        playing_local = False
-        with state.lock:
-            playing_local = state.playing
-        
-        if not playing_local:
-            time.sleep(0.05)
-            continue
-        
         if current_song is None:
+            # 等下一条命令（或退出）再重新取歌
             print("没有找到音乐文件", file=sys.stderr)
-            time.sleep(1)
+            with state.cond:
+                state.cond.wait_for(lambda: state.exit_program or state.commands or state.shuffled_playlist)
+                if state.commands:
+                    state.commands.popleft()
+            current_song = get_next_song()
             continue
         
         # 播放当前歌曲
-        result = play_a_song(current_song, current_position)
+        result = play_a_song(current_song, current_position, resume)
+        playback_heartbeat.idle()  # 切歌、解码下一首不算播放循环卡顿
+        resume = None
         
         if result == "exit":
             break
+        elif isinstance(result, tuple) and result[0] == "crossfade":
+            # 下一首已经在淡化中开始播放，接着它的位置继续
+            current_song = get_next_song()
+            current_position = 0
+            if current_song == result[1]["name"]:
+                resume = result[1]
         elif result == "next":
             current_song = get_next_song()
             current_position = 0
@@ -656,6 +2308,11 @@ if __name__ == "__main__":
             current_song = get_prev_song()
             current_position = 0
         elif isinstance(result, tuple) and result[0] == "device_change":
+            # 设备变了，按新设备的原生格式重新打开输出流
+            output.close()
+            if devices.rescan_pending:
+                devices.rescan()
+                state.send_devices()
             current_position = result[1]
             state.send_event("track_change", {
                 "name": current_song,
@@ -666,16 +2323,29 @@ if __name__ == "__main__":
             current_song = get_next_song()
             current_position = 0
         elif result == "error":
-            with state.lock:
+            # 曲目解码/读取失败，和设备无关
+            with state.cond:
                 state.playing = False
             state.send_event("play_error", {"message": "播放失败，请切换输出设备后重启番茄钟"})
             print("播放失败，已停止", file=sys.stderr)
         elif result == "device_error":
-            with state.lock:
+            # 选中的设备被拔掉时已回落到默认设备，从原位置继续；否则停止播放
+            if not devices.rescan():
+                state.send_devices()
+                current_position = state.current_time
+                continue
+            with state.cond:
                 state.playing = False
             state.send_event("play_error", {"message": "输出设备异常，请切换输出设备后重试"})
             print("设备异常，已停止", file=sys.stderr)
     
+    output.close()
+    output.backend.close()
     if listener:
         listener.stop()
-    print("程序已退出", file=sys.stderr)
\ No newline at end of file
+    print("程序已退出", file=sys.stderr)
+    events.flush()
+
+
+if __name__ == "__main__":
+    main(parse_args())
@@ -1,8 +1,50 @@
+"""
+B 站等视频网站音乐下载工具（you-get 下载 + ffmpeg 转 mp3，保存到 music/）
+
+用法:
+  python youget_download.py
+    交互模式：输入一个网址，下载并转换
+  python youget_download.py --batch urls.txt [--download-jobs 3] [--convert-jobs 2]
+    批量模式：urls.txt 每行一个网址（# 开头为注释），不需要任何输入
+    获取信息 -> 下载 -> 转换 三个阶段流水线并行：下载受网络限制，转换受 CPU 限制，分别设置并发数
+    进度记录在清单文件（默认 urls.txt.manifest.json）里，中断后重新运行会跳过已完成的任务，
+    已下载未转换的直接转换
+  python youget_download.py --batch urls.txt --playlist
+    每个网址按播放列表下载（you-get --playlist），一个任务可以产出多首歌
+  python youget_download.py --service --output music/
+    服务模式（由 Electron 启动），和 music.py 一样通过 stdin/stdout 的 JSON 行通信：
+    - {"command": "download", "url": "..."} - 加入下载队列（流水线同批量模式）
+    - {"command": "get_status"} - 各状态的任务数
+    - {"command": "exit"} - 退出（stdin 关闭时同样退出，未完成的任务下次启动继续）
+    - {"event": "ready", "data": {"missing": [], "resumed": 0}}  missing 为找不到的工具
+    - {"event": "download_progress", "data": {"id": "...", "url": "...", "stage": "download", "percent": 45}}
+      stage: queued / probe / download（you-get 进度条）/ convert（ffmpeg -progress）
+    - {"event": "download_done", "data": {"id": "...", "url": "...", "outputs": ["song.mp3"], "directory": "..."}}
+      Electron 收到后给播放器发 ingest，新歌不用重启就能播到
+    - {"event": "download_error", "data": {"id": "...", "url": "...", "stage": "download", "message": "..."}}
+
+格式选择（--quality）:
+  small（默认）优先下载纯音频流，没有时选体积最小的格式，只需要音频，不必下载高清视频
+  best 和以前一样选 you-get 列出的第一个（画质最高）格式
+音频提取: 音频流本身就是播放器能直接解码的编码（mp3/vorbis/opus/flac）时直接复制，不重新编码，
+  其它编码（如 B 站的 AAC，播放器用的 libsndfile 不能解码）才转成 mp3
+去重: 下载过的视频按规范化网址记在音乐文件夹的 .sources.json 里，换了网址列表或网址写法也会跳过
+"""
+
 import os
+import sys
 import subprocess
 import glob
 import re
 import shutil
+import json
+import time
+import hashlib
+import argparse
+import threading
+import queue
+import codecs
+import urllib.parse
 
 def check_dependency(cmd, name):
     """检查依赖工具是否可用"""
@@ -17,7 +59,71 @@ def check_dependency(cmd, name):
         return False
     return True
 
-def main():
+MEDIA_EXTENSIONS = ('.mp4', '.flv', '.webm', '.mkv', '.m4a', '.mp3', '.aac', '.ogg', '.opus')
+
+# 纯音频流的容器（you-get 的 container 字段）
+AUDIO_CONTAINERS = ('m4a', 'mp3', 'aac', 'ogg', 'opus', 'flac', 'wav')
+
+# 播放器（libsndfile）能直接解码的音频编码 -> (扩展名, ffmpeg 封装格式)，这些直接复制音频流
+STREAM_COPY_CODECS = {
+    'mp3': ('.mp3', 'mp3'),
+    'vorbis': ('.ogg', 'ogg'),
+    'opus': ('.ogg', 'ogg'),
+    'flac': ('.flac', 'flac'),
+}
+
+def parse_formats(info_text):
+    """
+    从 you-get -i 的输出中解析可用格式（按 you-get 列出的顺序，第一个画质最高）
+    大多数网站是 "- format:"（下载时用 --format），YouTube 是 "- itag:"（下载时用 --itag）
+    """
+    formats = []
+    pattern = r'- (format|itag):\s*(\S+)(.*?)quality:\s*([^\n]+).*?size:\s*([^\n]+)'
+    matches = re.findall(pattern, info_text, re.DOTALL)
+    
+    for match in matches:
+        container = re.search(r'container:\s*(\S+)', match[2])
+        size = match[4].strip()
+        size_bytes = re.search(r'\((\d+) bytes\)', size)
+        formats.append({
+            'format': match[1].strip(),
+            'option': '--' + match[0],
+            'container': container.group(1).lower() if container else '',
+            'quality': match[3].strip(),
+            'size': size,
+            'bytes': int(size_bytes.group(1)) if size_bytes else None
+        })
+    return formats
+
+def is_audio_only(fmt):
+    quality = fmt['quality'].lower()
+    return fmt['container'] in AUDIO_CONTAINERS or 'audio' in quality or '音频' in quality
+
+def choose_format(formats, quality="small"):
+    """
+    选择下载格式：best 选第一个（画质最高）；small 优先纯音频流（其中选第一个，音质最好），
+    没有纯音频时选体积最小的（大小未知时选列表最后一个，画质最低）
+    """
+    if quality == "best":
+        return formats[0]
+    audio = [fmt for fmt in formats if is_audio_only(fmt)]
+    if audio:
+        return audio[0]
+    sized = [fmt for fmt in formats if fmt['bytes']]
+    if sized:
+        return min(sized, key=lambda fmt: fmt['bytes'])
+    return formats[-1]
+
+def bytes_saved(formats, chosen):
+    """和默认下载第一个格式相比少下载的字节数（大小未知时为 None）"""
+    if formats[0]['bytes'] is None or chosen['bytes'] is None:
+        return None
+    return formats[0]['bytes'] - chosen['bytes']
+
+def format_mib(size):
+    return f"{size / (1024 * 1024):.1f} MiB"
+
+def main(quality="small"):
     # 检查必要的依赖工具
     print("正在检查依赖工具...\n")
     
@@ -46,6 +152,13 @@ def main():
     
     os.chdir(script_dir)
     
+    sources = SourceIndex(output_dir)
+    known = sources.lookup(url)
+    if known:
+        print(f"\n这个视频已经下载过: {', '.join(known)}")
+        input("按回车键退出...")
+        return
+    
     # 先获取视频信息
     print(f"\n正在获取视频信息: {url}\n")
     
@@ -66,51 +179,31 @@ def main():
     #       size:          123.4 MiB (129398765 bytes)
     #       # download-with: you-get --format=mp4 [URL]
     
-    formats = []
-    pattern = r'- format:\s*(\S+).*?quality:\s*([^\n]+).*?size:\s*([^\n]+)'
-    matches = re.findall(pattern, info_text, re.DOTALL)
-    
-    for match in matches:
-        format_id = match[0].strip()
-        quality = match[1].strip()
-        size = match[2].strip()
-        formats.append({
-            'format': format_id,
-            'quality': quality,
-            'size': size
-        })
+    formats = parse_formats(info_text)
     
     if not formats:
         print("\n未找到可用的视频格式，将尝试默认下载...")
         format_choice = None
     else:
-        # 显示可用格式，默认选择第一个
+        # 显示可用格式，按 --quality 自动选择
         print("\n可用的视频格式:")
         print("-" * 50)
         for i, fmt in enumerate(formats, 1):
             print(f"  [{i}] {fmt['format']} - {fmt['quality']} (大小: {fmt['size']})")
         print("-" * 50)
         
-        #choice = input(f"\n请选择格式编号 [默认:1]: ").strip()
-        choice = ""
-        if choice == "":
-            idx = 0
-        else:
-            try:
-                idx = int(choice) - 1
-                if idx < 0 or idx >= len(formats):
-                    idx = 0
-            except ValueError:
-                idx = 0
-        
-        format_choice = formats[idx]['format']
-        print(f"已选择: {format_choice} ({formats[idx]['quality']})")
+        chosen = choose_format(formats, quality)
+        format_choice = chosen['format']
+        print(f"已选择: {format_choice} ({chosen['quality']})")
+        saved = bytes_saved(formats, chosen)
+        if saved:
+            print(f"比下载 {formats[0]['format']} 少下载 {format_mib(saved)}")
     
     # 下载视频
     print(f"\n正在下载...\n")
     
     if format_choice:
-        result = subprocess.run(["you-get", "--format", format_choice, url])
+        result = subprocess.run(["you-get", chosen['option'], format_choice, url])
     else:
         result = subprocess.run(["you-get", url])
     
@@ -121,11 +214,11 @@ def main():
     
     print("\n下载完成，正在处理文件...\n")
     
-    # 查找下载的mp4文件
-    mp4_files = glob.glob("*.mp4")
+    # 查找下载的媒体文件（选了纯音频格式时不是 mp4）
+    mp4_files = [f for f in glob.glob("*.*") if f.lower().endswith(MEDIA_EXTENSIONS)]
     
     if not mp4_files:
-        print("未找到下载的mp4文件!")
+        print("未找到下载的媒体文件!")
         input("按回车键退出...")
         return
     
@@ -151,23 +244,19 @@ def main():
     
     # 获取文件名（不含扩展名）
     name = os.path.splitext(os.path.basename(target_mp4))[0]
-    output_mp3 = os.path.join(output_dir, name + ".mp3")
-    
-    print(f"\n正在转换为MP3: {output_mp3}\n")
     
-    # 使用ffmpeg转换为mp3
-    convert_result = subprocess.run([
-        "ffmpeg", "-y", "-i", target_mp4,
-        "-vn", "-acodec", "libmp3lame", "-q:a", "2",
-        output_mp3
-    ])
+    print(f"\n正在提取音频: {target_mp4}\n")
     
-    if convert_result.returncode != 0:
-        print("\n转换失败!")
+    # 能直接播放的音频流直接复制，否则用ffmpeg转换为mp3
+    try:
+        output_mp3, copied, seconds = extract_audio(target_mp4, output_dir)
+    except RuntimeError as e:
+        print(f"\n转换失败! {e}")
         input("按回车键退出...")
         return
     
-    print(f"\n转换成功! 文件保存在: {output_mp3}")
+    print(f"\n{'复制音频流' if copied else '转换'}成功（{seconds:.1f} 秒）! 文件保存在: {output_mp3}")
+    sources.add(url, [os.path.basename(output_mp3)])
     
     # 记录本次下载产生的文件（基于视频名）
     # you-get 下载的视频文件名通常与转换后的mp3文件名相同（扩展名不同）
@@ -201,5 +290,541 @@ def main():
     print("\n全部完成!")
     input("按回车键退出...")
 
+# ============ 音频提取 ============
+output_lock = threading.Lock()
+reserved_outputs = set()
+
+def run_tool(cmd, on_line=None):
+    """
+    运行外部工具并收集输出；失败时抛出带最后一行输出的异常
+    on_line 逐行接收输出（进度条用 \r 刷新，也按行切开），用于解析进度
+    """
+    if on_line is None:
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='replace')
+        output = result.stdout + result.stderr
+        returncode = result.returncode
+    else:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        chunks = []
+        pending = ""
+        while True:
+            chunk = proc.stdout.read1(4096)
+            if not chunk:
+                break
+            text = decoder.decode(chunk)
+            chunks.append(text)
+            lines = re.split(r'[\r\n]', pending + text)
+            pending = lines.pop()
+            for line in lines:
+                if line:
+                    on_line(line)
+        if pending:
+            on_line(pending)
+        output = "".join(chunks)
+        returncode = proc.wait()
+    if returncode != 0:
+        lines = output.strip().splitlines()
+        raise RuntimeError(f"{cmd[0]} 退出码 {returncode}: {lines[-1] if lines else ''}")
+    return output
+
+def probe_audio(source):
+    """用 ffmpeg -i 读出第一个音频流的编码名（如 aac、mp3、opus）和时长（秒），读不到的为 None"""
+    # 只给输入文件时 ffmpeg 打印流信息后以非零退出码结束，这里只看输出
+    result = subprocess.run(["ffmpeg", "-hide_banner", "-i", source],
+                            capture_output=True, text=True, encoding='utf-8', errors='replace')
+    codec = re.search(r'Stream #\S+.*?: Audio: (\w+)', result.stderr)
+    duration = re.search(r'Duration:\s*(\d+):(\d+):(\d+(?:\.\d+)?)', result.stderr)
+    seconds = None
+    if duration:
+        hours, minutes, secs = duration.groups()
+        seconds = int(hours) * 3600 + int(minutes) * 60 + float(secs)
+    return (codec.group(1).lower() if codec else None), seconds
+
+def reserve_output(output_dir, name, ext=".mp3"):
+    """分配不与已有文件（和其它线程正在写的文件）重名的输出路径"""
+    with output_lock:
+        path = os.path.join(output_dir, name + ext)
+        n = 2
+        while path in reserved_outputs or os.path.exists(path):
+            path = os.path.join(output_dir, f"{name} ({n}){ext}")
+            n += 1
+        reserved_outputs.add(path)
+    return path
+
+def ffmpeg_progress(duration, on_progress):
+    """把 ffmpeg -progress 的 key=value 输出换算成 0-1 的进度（时长未知时不回调）"""
+    def on_line(line):
+        key, _, value = line.partition("=")
+        # out_time_ms 历史上其实也是微秒
+        if key in ("out_time_us", "out_time_ms") and duration and value.strip().isdigit():
+            on_progress(min(int(value) / 1e6 / duration, 1.0))
+        elif key == "progress" and value.strip() == "end":
+            on_progress(1.0)
+    return on_line
+
+def write_audio(source, output_dir, name, ext, codec_args, muxer, duration=None, on_progress=None):
+    """先写 .part 再改名，播放器扫描时不会看到写了一半的文件"""
+    target = reserve_output(output_dir, name, ext)
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-i", source, "-vn"] + codec_args
+    on_line = None
+    if on_progress:
+        cmd += ["-progress", "pipe:1", "-nostats"]
+        on_line = ffmpeg_progress(duration, on_progress)
+    try:
+        run_tool(cmd + ["-f", muxer, target + ".part"], on_line)
+        os.replace(target + ".part", target)
+    except RuntimeError:
+        if os.path.exists(target + ".part"):
+            os.remove(target + ".part")
+        raise
+    finally:
+        with output_lock:
+            reserved_outputs.discard(target)
+    return target
+
+def extract_audio(source, output_dir, on_progress=None):
+    """
+    提取音频到 output_dir：播放器能直接解码的编码直接复制音频流（快、无损），
+    其它编码转成 mp3；复制失败（封装不兼容等）时退回转码
+    on_progress(0-1) 接收 ffmpeg 的处理进度
+    返回 (输出路径, 是否复制, 耗时秒数)
+    """
+    started = time.perf_counter()
+    name = os.path.splitext(os.path.basename(source))[0]
+    codec, duration = probe_audio(source)
+    copy = STREAM_COPY_CODECS.get(codec)
+    if copy:
+        ext, muxer = copy
+        try:
+            target = write_audio(source, output_dir, name, ext, ["-acodec", "copy"], muxer, duration, on_progress)
+            return target, True, time.perf_counter() - started
+        except RuntimeError:
+            pass
+    target = write_audio(source, output_dir, name, ".mp3", ["-acodec", "libmp3lame", "-q:a", "2"], "mp3",
+                         duration, on_progress)
+    return target, False, time.perf_counter() - started
+
+# ============ 批量模式 ============
+log_lock = threading.Lock()
+# 服务模式下 stdout 是协议通道，日志改写到 stderr
+log_stream = sys.stdout
+
+def log(message):
+    """多个线程同时输出时不交错"""
+    with log_lock:
+        print(message, file=log_stream, flush=True)
+
+class Manifest:
+    """
+    批量任务清单（JSON），每个阶段完成后立即写盘，中断后据此续传
+    任务状态: pending -> probed -> downloaded -> done，出错为 failed（下次运行时重试）
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                self.jobs = json.load(f).get("jobs", {})
+        except (OSError, ValueError):
+            self.jobs = {}
+
+    def add(self, url):
+        """按网址登记任务（已存在则沿用清单里的状态），返回 (任务ID, 任务)"""
+        job_id = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        with self.lock:
+            job = self.jobs.setdefault(job_id, {"url": url, "status": "pending"})
+        return job_id, job
+
+    def update(self, job_id, **fields):
+        with self.lock:
+            self.jobs[job_id].update(fields)
+            content = json.dumps({"version": 1, "jobs": self.jobs}, ensure_ascii=False, indent=1)
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(self.path + ".tmp", self.path)
+
+# 规范化网址时保留的查询参数（分 P、YouTube 视频 ID、播放列表），spm_id_from 等跟踪参数去掉
+SOURCE_QUERY_KEYS = ("p", "v", "list")
+
+def normalize_source(url):
+    """同一个视频的不同写法（http/https、www./m.、跟踪参数、结尾斜杠、youtu.be 短链）规范成同一个键"""
+    parts = urllib.parse.urlsplit(url.strip())
+    host = parts.netloc.lower()
+    for prefix in ("www.", "m."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip("/")
+    query = [(k, v) for k, v in urllib.parse.parse_qsl(parts.query) if k in SOURCE_QUERY_KEYS]
+    if host == "youtu.be":
+        host, path, query = "youtube.com", "/watch", query + [("v", path.strip("/"))]
+    # B 站不带 p 就是第 1 P
+    query = sorted((k, v) for k, v in query if not (k == "p" and v == "1"))
+    return host + path + ("?" + urllib.parse.urlencode(query) if query else "")
+
+class SourceIndex:
+    """
+    已下载来源索引（音乐文件夹下的 .sources.json）：规范化网址 -> 产出的音频文件名
+    跟着音乐文件夹走而不是跟着任务清单，换一个网址列表、网址写法不同也能认出下载过的视频；
+    每完成一个任务增量写盘。内容相同但来源不同的重复曲目由播放器按内容指纹去重
+    """
+    FILE_NAME = ".sources.json"
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.path = os.path.join(output_dir, self.FILE_NAME)
+        self.lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.sources = json.load(f).get("sources", {})
+        except (OSError, ValueError):
+            self.sources = {}
+
+    def lookup(self, url):
+        """下载过且文件还在时返回文件名列表，否则返回 None"""
+        with self.lock:
+            entry = self.sources.get(normalize_source(url))
+        if not entry:
+            return None
+        outputs = [name for name in entry["outputs"] if os.path.exists(os.path.join(self.output_dir, name))]
+        return outputs or None
+
+    def add(self, url, outputs):
+        with self.lock:
+            self.sources[normalize_source(url)] = {"url": url, "outputs": outputs, "time": int(time.time())}
+            content = json.dumps({"version": 1, "sources": self.sources}, ensure_ascii=False, indent=1)
+            with open(self.path + ".tmp", 'w', encoding='utf-8') as f:
+                f.write(content)
+            os.replace(self.path + ".tmp", self.path)
+
+def probe_format(url, playlist, quality):
+    """获取视频信息并选择格式，返回 (格式, 下载参数, 少下载的字节数)；解析不到格式时格式为 None（让 you-get 用默认格式）"""
+    cmd = ["you-get", "-i"] + (["--playlist"] if playlist else []) + [url]
+    formats = parse_formats(run_tool(cmd))
+    if not formats:
+        return None, None, None
+    chosen = choose_format(formats, quality)
+    return chosen['format'], chosen['option'], bytes_saved(formats, chosen)
+
+def download_media(url, format_choice, format_option, work_dir, playlist, on_progress=None):
+    """
+    下载到任务自己的目录（并发任务互不干扰），返回下载到的媒体文件名列表
+    on_progress(0-1) 接收 you-get 进度条上的百分比
+    """
+    os.makedirs(work_dir, exist_ok=True)
+    cmd = ["you-get", "-o", work_dir]
+    if playlist:
+        cmd.append("--playlist")
+    if format_choice:
+        cmd += [format_option or "--format", format_choice]
+    on_line = None
+    if on_progress:
+        def on_line(line):
+            # 进度条形如 " 45.3% ( 12.3/ 27.1MB) ├████───┤[1/1]  2 MB/s"
+            match = re.match(r'\s*(\d+(?:\.\d+)?)%', line)
+            if match:
+                on_progress(min(float(match.group(1)) / 100, 1.0))
+    run_tool(cmd + [url], on_line)
+    files = sorted(f for f in os.listdir(work_dir) if f.lower().endswith(MEDIA_EXTENSIONS))
+    if not files:
+        raise RuntimeError("未找到下载的媒体文件")
+    return files
+
+def wait_threads(threads):
+    # 带超时地 join，Ctrl+C 能及时中断（清单已保存每个阶段的进度）
+    for thread in threads:
+        while thread.is_alive():
+            thread.join(0.5)
+
+class Pipeline:
+    """
+    获取信息 -> 下载 -> 提取音频，三个阶段各自一个队列和一组线程，批量模式和服务模式共用
+    获取信息和下载受网络限制，用 download_jobs 个线程；转换受 CPU 限制，用 convert_jobs 个线程
+    每个任务在清单里记录少下载的字节数（bytes_saved）、实际下载字节数、提取方式和转换耗时
+    on_event(事件名, 数据) 接收 download_progress / download_done / download_error
+    """
+    STAGES = ("probe", "download", "convert")
+
+    def __init__(self, manifest, output_dir, work_root, download_jobs, convert_jobs, playlist=False,
+                 quality="small", on_event=None):
+        self.manifest = manifest
+        self.output_dir = output_dir
+        self.work_root = work_root
+        self.playlist = playlist
+        self.quality = quality
+        self.on_event = on_event
+        self.queues = {stage: queue.Queue() for stage in self.STAGES}
+        self.counts = {"probe": download_jobs, "download": download_jobs, "convert": convert_jobs}
+        self.groups = []
+        self.lock = threading.Lock()
+        self.active = set()  # 已排队、还没完成/失败的任务 ID（同一网址重复提交时不再排队）
+        os.makedirs(output_dir, exist_ok=True)
+        self.sources = SourceIndex(output_dir)
+
+    def work_dir(self, job_id):
+        return os.path.join(self.work_root, job_id)
+
+    def emit(self, event, job_id, **data):
+        if self.on_event:
+            self.on_event(event, dict({"id": job_id, "url": self.manifest.jobs[job_id]["url"]}, **data))
+
+    def progress(self, job_id, stage):
+        """按整数百分比去重的进度回调"""
+        last = [-1]
+        def on_progress(fraction):
+            percent = int(fraction * 100)
+            if percent != last[0]:
+                last[0] = percent
+                self.emit("download_progress", job_id, stage=stage, percent=percent)
+        return on_progress if self.on_event else None
+
+    def start(self):
+        handlers = {"probe": self.probe, "download": self.download, "convert": self.convert}
+        for stage in self.STAGES:
+            threads = [threading.Thread(target=self.stage_worker, args=(stage, handlers[stage]), daemon=True)
+                       for _ in range(self.counts[stage])]
+            for thread in threads:
+                thread.start()
+            self.groups.append((self.queues[stage], threads))
+
+    def submit(self, url):
+        """按清单里的状态决定任务从哪个阶段开始，返回 (任务ID, 是否已完成而跳过)"""
+        job_id, job = self.manifest.add(url)
+        with self.lock:
+            if job_id in self.active:
+                # 同一任务还在流水线里（前端重试、重复点击启动时续传的任务），不再排队
+                return job_id, False
+            status = job["status"]
+            if status == "done":
+                return job_id, True
+            self.active.add(job_id)
+        # 这个视频以前下载到过这个音乐文件夹（可能是别的网址列表、别的网址写法）
+        known = self.sources.lookup(url)
+        if known:
+            self.manifest.update(job_id, status="done", outputs=known, known_source=True, error=None)
+            self.release(job_id)
+            log(f"[跳过] {url} 已下载过: {', '.join(known)}")
+            return job_id, True
+        if status == "downloaded" and all(
+                os.path.exists(os.path.join(self.work_dir(job_id), f)) for f in job.get("files", [])):
+            self.queues["convert"].put(job_id)
+        elif status in ("probed", "downloaded"):
+            self.queues["download"].put(job_id)
+        else:
+            self.queues["probe"].put(job_id)
+        self.emit("download_progress", job_id, stage="queued", percent=0)
+        return job_id, False
+
+    def release(self, job_id):
+        with self.lock:
+            self.active.discard(job_id)
+
+    def close(self):
+        """不再提交新任务，等已提交的全部完成"""
+        # 前一阶段的线程全部结束后，下一阶段不会再有新任务，再给它发结束标记
+        for jobs_in, threads in self.groups:
+            for _ in threads:
+                jobs_in.put(None)
+            wait_threads(threads)
+
+    def stage_worker(self, stage, handler):
+        """流水线的一个阶段：从队列取任务 ID 处理，None 表示结束；出错的任务标记 failed，不影响其它任务"""
+        jobs_in = self.queues[stage]
+        while True:
+            job_id = jobs_in.get()
+            if job_id is None:
+                return
+            url = self.manifest.jobs[job_id]["url"]
+            try:
+                handler(job_id)
+            except Exception as e:
+                self.manifest.update(job_id, status="failed", error=f"{stage}: {e}")
+                log(f"[失败] {stage} {url}: {e}")
+                self.emit("download_error", job_id, stage=stage, message=str(e))
+            # 完成或失败后才允许同一网址再次提交
+            if self.manifest.jobs[job_id]["status"] in ("done", "failed"):
+                self.release(job_id)
+
+    def probe(self, job_id):
+        url = self.manifest.jobs[job_id]["url"]
+        self.emit("download_progress", job_id, stage="probe", percent=0)
+        format_choice, format_option, saved = probe_format(url, self.playlist, self.quality)
+        self.manifest.update(job_id, status="probed", format=format_choice, format_option=format_option,
+                             bytes_saved=saved, error=None)
+        log(f"[信息] {url} 格式: {format_choice or '默认'}"
+            + (f"，少下载 {format_mib(saved)}" if saved else ""))
+        self.queues["download"].put(job_id)
+
+    def download(self, job_id):
+        job = self.manifest.jobs[job_id]
+        work_dir = self.work_dir(job_id)
+        started = time.perf_counter()
+        files = download_media(job["url"], job.get("format"), job.get("format_option"), work_dir, self.playlist,
+                               self.progress(job_id, "download"))
+        size = sum(os.path.getsize(os.path.join(work_dir, f)) for f in files)
+        self.manifest.update(job_id, status="downloaded", files=files, downloaded_bytes=size)
+        log(f"[下载] {job['url']} {len(files)} 个文件 {format_mib(size)}，{time.perf_counter() - started:.1f} 秒")
+        self.queues["convert"].put(job_id)
+
+    def convert(self, job_id):
+        job = self.manifest.jobs[job_id]
+        outputs = list(job.get("outputs", []))
+        copied = 0
+        seconds = 0.0
+        for filename in job["files"]:
+            target, copy, elapsed = extract_audio(os.path.join(self.work_dir(job_id), filename), self.output_dir,
+                                                  self.progress(job_id, "convert"))
+            outputs.append(os.path.basename(target))
+            copied += copy
+            seconds += elapsed
+            log(f"[{'复制' if copy else '转换'}] {target}，{elapsed:.1f} 秒")
+        self.manifest.update(job_id, status="done", outputs=outputs, copied=copied,
+                             convert_seconds=round(seconds, 3), error=None)
+        self.sources.add(job["url"], outputs)
+        shutil.rmtree(self.work_dir(job_id), ignore_errors=True)
+        self.emit("download_done", job_id, outputs=outputs, directory=os.path.abspath(self.output_dir),
+                  bytes_saved=job.get("bytes_saved"), convert_seconds=round(seconds, 3))
+
+def run_batch(urls, manifest_path, output_dir, work_root, download_jobs, convert_jobs, playlist=False,
+              quality="small"):
+    """批量下载一组网址，返回 (完成数, 失败数, 跳过数)"""
+    manifest = Manifest(manifest_path)
+    pipeline = Pipeline(manifest, output_dir, work_root, download_jobs, convert_jobs, playlist, quality)
+    pipeline.start()
+    skipped = 0
+    job_ids = []
+    for url in urls:
+        job_id, done = pipeline.submit(url)
+        job_ids.append(job_id)
+        skipped += done
+    if skipped:
+        log(f"清单中已完成 {skipped} 个，跳过")
+    pipeline.close()
+
+    statuses = [manifest.jobs[job_id]["status"] for job_id in job_ids]
+    finished = [manifest.jobs[job_id] for job_id in job_ids if manifest.jobs[job_id]["status"] == "done"]
+    if finished:
+        log(f"[统计] 下载 {format_mib(sum(job.get('downloaded_bytes') or 0 for job in finished))}，"
+            f"比下载最高画质少 {format_mib(sum(job.get('bytes_saved') or 0 for job in finished))}；"
+            f"复制音频流 {sum(job.get('copied', 0) for job in finished)} 个，"
+            f"转换耗时共 {sum(job.get('convert_seconds', 0) for job in finished):.1f} 秒")
+    return statuses.count("done") - skipped, statuses.count("failed"), skipped
+
+def read_url_list(path):
+    urls = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith('#') and line not in urls:
+                urls.append(line)
+    return urls
+
+def batch_main(args):
+    if not (check_dependency("you-get", "you-get") and check_dependency("ffmpeg", "ffmpeg")):
+        return 1
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    urls = read_url_list(args.batch)
+    manifest_path = args.manifest or args.batch + ".manifest.json"
+    output_dir = args.output or os.path.join(script_dir, "music")
+    work_root = args.work_dir or os.path.join(script_dir, "downloads")
+    log(f"共 {len(urls)} 个网址，下载并发 {args.download_jobs}，转换并发 {args.convert_jobs}")
+    started = time.perf_counter()
+    done, failed, skipped = run_batch(
+        urls, manifest_path, output_dir, work_root,
+        args.download_jobs, args.convert_jobs, args.playlist, args.quality
+    )
+    log(f"\n完成 {done}，失败 {failed}，跳过 {skipped}，用时 {time.perf_counter() - started:.1f} 秒")
+    if failed:
+        log(f"失败的任务记录在 {manifest_path}，重新运行会重试")
+    return 1 if failed else 0
+
+# ============ 服务模式 ============
+def send_event(event_type, data):
+    """向 stdout 写一行 JSON 事件（和 music.py 的协议格式相同）"""
+    line = json.dumps({"event": event_type, "data": data}, ensure_ascii=False)
+    with log_lock:
+        sys.stdout.write(line + "\n")
+        sys.stdout.flush()
+
+def service_main(args):
+    """常驻进程：从 stdin 读 JSON 命令，进度和结果以 JSON 事件写到 stdout"""
+    global log_stream
+    log_stream = sys.stderr
+    sys.stdout.reconfigure(encoding='utf-8')
+    sys.stdin.reconfigure(encoding='utf-8')
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    output_dir = args.output or os.path.join(script_dir, "music")
+    work_root = args.work_dir or os.path.join(script_dir, "downloads")
+    os.makedirs(work_root, exist_ok=True)
+    manifest = Manifest(args.manifest or os.path.join(work_root, "service.manifest.json"))
+    pipeline = Pipeline(manifest, output_dir, work_root, args.download_jobs, args.convert_jobs,
+                        args.playlist, args.quality, on_event=send_event)
+    pipeline.start()
+
+    missing = [tool for tool in ("you-get", "ffmpeg") if shutil.which(tool) is None]
+    # 上次退出时没做完的任务接着做
+    resumed = 0
+    if not missing:
+        for job in list(manifest.jobs.values()):
+            if job["status"] not in ("done", "failed"):
+                pipeline.submit(job["url"])
+                resumed += 1
+    send_event("ready", {"missing": missing, "resumed": resumed})
+
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command_obj = json.loads(line)
+        except json.JSONDecodeError as e:
+            log(f"JSON解析错误: {e}")
+            continue
+        command = command_obj.get("command")
+        if command == "download":
+            url = (command_obj.get("url") or "").strip()
+            if not url or missing:
+                send_event("download_error", {
+                    "id": None, "url": url, "stage": "queued",
+                    "message": f"未找到 {', '.join(missing)}" if missing else "网址不能为空"
+                })
+                continue
+            job_id, done = pipeline.submit(url)
+            if done:
+                # 以前下载过：直接回复结果，播放器 ingest 时会忽略已有的曲目
+                job = manifest.jobs[job_id]
+                send_event("download_done", {
+                    "id": job_id, "url": url, "outputs": job.get("outputs", []),
+                    "directory": os.path.abspath(output_dir), "skipped": True
+                })
+        elif command == "get_status":
+            counts = {}
+            for job in list(manifest.jobs.values()):
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            send_event("status", {"jobs": counts, "missing": missing})
+        elif command == "exit":
+            break
+    # stdin 关闭（父进程已退出）或 exit：未完成的任务已记在清单里，下次启动继续
+    log("下载服务已退出")
+    return 0
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description="视频网站音乐下载工具")
+    parser.add_argument("--batch", metavar="URL_LIST", help="批量模式：网址列表文件，每行一个")
+    parser.add_argument("--service", action="store_true", help="服务模式：通过 stdin/stdout 的 JSON 行通信")
+    parser.add_argument("--playlist", action="store_true", help="把每个网址当作播放列表下载")
+    parser.add_argument("--download-jobs", type=int, default=3, help="同时获取信息/下载的任务数")
+    parser.add_argument("--convert-jobs", type=int, default=max(1, (os.cpu_count() or 2) // 2),
+                        help="同时转换的任务数")
+    parser.add_argument("--quality", choices=("small", "best"), default="small",
+                        help="small: 优先纯音频/体积最小的格式（默认）；best: 画质最高的格式")
+    parser.add_argument("--manifest",
+                        help="任务清单路径（默认为网址列表文件名加 .manifest.json，服务模式为 downloads/service.manifest.json）")
+    parser.add_argument("--output", help="mp3 保存目录（默认为 music/）")
+    parser.add_argument("--work-dir", help="下载中间文件目录（默认为 downloads/，每个任务一个子目录）")
+    args = parser.parse_args()
+    if args.service:
+        sys.exit(service_main(args))
+    if args.batch:
+        sys.exit(batch_main(args))
+    main(args.quality)
@@ -1,2 +1,4 @@
-pyinstaller --onefile music.py
-copy /Y "dist\music.exe" "music.exe"
\ No newline at end of file
+pyinstaller --onefile --paths ..\sidecar --hidden-import numpy --hidden-import soundfile --hidden-import sounddevice music.py
+copy /Y "dist\music.exe" "music.exe"
+pyinstaller --onefile youget_download.py
+copy /Y "dist\youget_download.exe" "youget_download.exe"
\ No newline at end of file
@@ -70,6 +70,12 @@ const { contextBridge, ipcRenderer } = require('electron')
   musicGetStatus: () => ipcRenderer.send('music-get-status'),
   musicGetDevices: () => ipcRenderer.send('music-get-devices'),
   musicSetDevice: (deviceId) => ipcRenderer.send('music-set-device', deviceId),
+  musicRefreshDevices: () => ipcRenderer.send('music-refresh-devices'),
+  musicGetWaveform: (name) => ipcRenderer.send('music-get-waveform', name),
+  musicGetMetrics: (format) => ipcRenderer.send('music-get-metrics', format),
+  musicStartProfile: (options) => ipcRenderer.send('music-start-profile', options),
+  musicStopProfile: () => ipcRenderer.send('music-stop-profile'),
+  musicDownload: (url) => ipcRenderer.send('music-download', url),
   
   // 音乐播放器事件监听
   onMusicReady: (callback) => {
@@ -99,6 +105,30 @@ const { contextBridge, ipcRenderer } = require('electron')
   onMusicVolumeChange: (callback) => {
     ipcRenderer.on('music-volume-change', (event, data) => callback(data))
   },
+  onMusicWaveform: (callback) => {
+    ipcRenderer.on('music-waveform', (event, data) => callback(data))
+  },
+  onMusicTrackAdded: (callback) => {
+    ipcRenderer.on('music-track-added', (event, data) => callback(data))
+  },
+  onMusicMetrics: (callback) => {
+    ipcRenderer.on('music-metrics', (event, data) => callback(data))
+  },
+  onMusicProfile: (callback) => {
+    ipcRenderer.on('music-profile', (event, data) => callback(data))
+  },
+  onMusicStall: (callback) => {
+    ipcRenderer.on('music-stall', (event, data) => callback(data))
+  },
+  onMusicDownloadProgress: (callback) => {
+    ipcRenderer.on('music-download-progress', (event, data) => callback(data))
+  },
+  onMusicDownloadDone: (callback) => {
+    ipcRenderer.on('music-download-done', (event, data) => callback(data))
+  },
+  onMusicDownloadError: (callback) => {
+    ipcRenderer.on('music-download-error', (event, data) => callback(data))
+  },
   
   // 移除监听器
   removeMusicListeners: () => {
@@ -157,6 +187,11 @@ const { contextBridge, ipcRenderer } = require('electron')
   foregroundAddBlacklist: (keyword) => ipcRenderer.send('foreground-add-blacklist', keyword),
   foregroundMarkHistoryNot: (windowTitle) => ipcRenderer.send('foreground-mark-history-not', windowTitle),
   foregroundMoveBlacklistToWhitelist: (keyword) => ipcRenderer.send('foreground-move-blacklist-to-whitelist', keyword),
+  foregroundSetAudit: (enabled, interval) => ipcRenderer.send('foreground-set-audit', enabled, interval),
+  foregroundQueryActivity: (options) => ipcRenderer.send('foreground-query-activity', options),
+  foregroundGetMetrics: (format) => ipcRenderer.send('foreground-get-metrics', format),
+  foregroundStartProfile: (options) => ipcRenderer.send('foreground-start-profile', options),
+  foregroundStopProfile: () => ipcRenderer.send('foreground-stop-profile'),
   
   // 前台检测事件监听
   onForegroundReady: (callback) => {
@@ -174,6 +209,21 @@ const { contextBridge, ipcRenderer } = require('electron')
   onForegroundError: (callback) => {
     ipcRenderer.on('foreground-error', (event, data) => callback(data))
   },
+  onForegroundActivity: (callback) => {
+    ipcRenderer.on('foreground-activity', (event, data) => callback(data))
+  },
+  onForegroundMetrics: (callback) => {
+    ipcRenderer.on('foreground-metrics', (event, data) => callback(data))
+  },
+  onForegroundProfile: (callback) => {
+    ipcRenderer.on('foreground-profile', (event, data) => callback(data))
+  },
+  onForegroundStall: (callback) => {
+    ipcRenderer.on('foreground-stall', (event, data) => callback(data))
+  },
+  onForegroundBackgroundEntertainment: (callback) => {
+    ipcRenderer.on('foreground-background-entertainment', (event, data) => callback(data))
+  },
   
   // 移除前台检测监听器
   removeForegroundListeners: () => {
@@ -181,6 +231,11 @@ const { contextBridge, ipcRenderer } = require('electron')
     ipcRenderer.removeAllListeners('foreground-entertainment-detected')
     ipcRenderer.removeAllListeners('foreground-status')
     ipcRenderer.removeAllListeners('foreground-error')
+    ipcRenderer.removeAllListeners('foreground-activity')
+    ipcRenderer.removeAllListeners('foreground-metrics')
+    ipcRenderer.removeAllListeners('foreground-profile')
+    ipcRenderer.removeAllListeners('foreground-stall')
+    ipcRenderer.removeAllListeners('foreground-background-entertainment')
   },
   
   // ============ 窗口置顶 API ============
@@ -0,0 +1,239 @@
+"""
+合并宿主进程性能测试：分开启动 music.py + foreground_inspection.py vs 一个 sidecar_host.py
+
+用法:
+  python benchmark.py [--runs 5] [--tracks 3]
+    两种方式各启动 runs 次（音乐用 null 后端，前台检测用 mock 窗口来源，源码复制到临时目录），统计
+    启动到两个服务都发出 ready 的耗时、ready 后 2 秒的总常驻内存(RSS)、播放 3 秒的总 CPU，
+    最后在合并模式下检查两个服务的命令互不阻塞、host exit 后进程退出（CPU/内存读取 /proc，只支持 Linux）
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+import numpy as np
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(SCRIPT_DIR)
+SOURCES = {
+    "music-player": ["music.py"],
+    "foreground_inspection": ["foreground_inspection.py", "activity_recorder.py", "verdict_pack.py"],
+    "sidecar": ["sidecar_host.py", "metrics.py", "profiler.py", "stall_watchdog.py"],
+}
+
+
+def process_rss(pid):
+    """/proc 中指定进程的常驻内存（MB）"""
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def process_cpu(pid):
+    """进程累计 CPU 时间（秒）"""
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def copy_sources(tmp):
+    """按仓库的目录结构复制源码（前台检测的 activity/ 等文件写在临时目录里）"""
+    for folder, names in SOURCES.items():
+        os.makedirs(os.path.join(tmp, folder), exist_ok=True)
+        for name in names:
+            shutil.copy(os.path.join(ROOT, folder, name), os.path.join(tmp, folder, name))
+
+
+def write_tracks(folder, tracks, seconds=30, samplerate=44100):
+    os.makedirs(folder, exist_ok=True)
+    t = np.arange(samplerate * seconds) / samplerate
+    for i in range(tracks):
+        y = (np.sin(2 * np.pi * (220 + 110 * i) * t) * 0.2 * 32767).astype(np.int16)
+        with wave.open(os.path.join(folder, f"track{i}.wav"), 'wb') as w:
+            w.setnchannels(2)
+            w.setsampwidth(2)
+            w.setframerate(samplerate)
+            w.writeframes(np.repeat(y[:, None], 2, axis=1).tobytes())
+
+
+class Process:
+    """说 JSON 行协议的子进程；events 里记录 (时间戳, 服务, 事件名, 数据)"""
+    def __init__(self, cmd, service=None):
+        self.service = service  # 单独运行的程序不带 service 字段，用这个名字记录
+        self.proc = subprocess.Popen(
+            cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+            text=True, encoding='utf-8'
+        )
+        self.events = []
+        self.cond = threading.Condition()
+        threading.Thread(target=self._read, daemon=True).start()
+
+    def _read(self):
+        for line in self.proc.stdout:
+            try:
+                message = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            with self.cond:
+                self.events.append((time.perf_counter(), message.get("service", self.service),
+                                    message["event"], message.get("data")))
+                self.cond.notify_all()
+
+    def send(self, command, service=None, **fields):
+        fields["command"] = command
+        if service and not self.service:
+            fields["service"] = service
+        t = time.perf_counter()
+        self.proc.stdin.write(json.dumps(fields) + "\n")
+        self.proc.stdin.flush()
+        return t
+
+    def wait(self, service, event, since=0, timeout=30.0):
+        deadline = time.perf_counter() + timeout
+        with self.cond:
+            while True:
+                for t, s, name, data in self.events:
+                    if t >= since and s == service and name == event:
+                        return t, data
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.proc.poll() is not None:
+                    raise TimeoutError(f"等待 {service} {event} 超时")
+                self.cond.wait(remaining)
+
+
+def music_args(tmp):
+    return ['--backend', 'null', '--no-hotkeys', '--music-dir', os.path.join(tmp, 'music')]
+
+
+def foreground_args():
+    return ['--window-source', 'mock']
+
+
+class Separate:
+    """两个独立进程（Electron 默认的方式）"""
+    def __init__(self, tmp):
+        self.music = Process([sys.executable, os.path.join(tmp, 'music-player', 'music.py')] + music_args(tmp), "music")
+        self.foreground = Process([sys.executable, os.path.join(tmp, 'foreground_inspection', 'foreground_inspection.py')]
+                                  + foreground_args(), "foreground")
+        self.processes = {"music": self.music, "foreground": self.foreground}
+
+    def wait(self, service, event, since=0):
+        return self.processes[service].wait(service, event, since)
+
+    def send(self, service, command, **fields):
+        return self.processes[service].send(command, **fields)
+
+    def pids(self):
+        return [p.proc.pid for p in self.processes.values()]
+
+    def close(self):
+        for p in self.processes.values():
+            p.send("exit")
+        for p in self.processes.values():
+            p.proc.wait(timeout=10)
+
+
+class Combined:
+    """一个宿主进程"""
+    def __init__(self, tmp):
+        self.host = Process([sys.executable, os.path.join(tmp, 'sidecar', 'sidecar_host.py'),
+                             '--music-args', json.dumps(music_args(tmp)),
+                             '--foreground-args', json.dumps(foreground_args())])
+
+    def wait(self, service, event, since=0):
+        return self.host.wait(service, event, since)
+
+    def send(self, service, command, **fields):
+        return self.host.send(command, service, **fields)
+
+    def pids(self):
+        return [self.host.proc.pid]
+
+    def close(self):
+        self.host.send("exit", "host")
+        self.host.proc.wait(timeout=10)
+
+
+def measure(mode, tmp):
+    start = time.perf_counter()
+    sidecars = mode(tmp)
+    try:
+        ready = max(sidecars.wait(service, "ready")[0] for service in ("music", "foreground"))
+        time.sleep(2.0)
+        rss = sum(process_rss(pid) for pid in sidecars.pids())
+        sidecars.send("music", "toggle")
+        sidecars.send("foreground", "start")
+        time.sleep(0.5)
+        cpu0 = sum(process_cpu(pid) for pid in sidecars.pids())
+        time.sleep(3.0)
+        cpu = (sum(process_cpu(pid) for pid in sidecars.pids()) - cpu0) / 3.0 * 1000
+    finally:
+        sidecars.close()
+    return (ready - start) * 1000, rss, cpu
+
+
+def check_isolation(tmp):
+    """合并模式：前台检测的命令（query_activity 要等配置加载）和音乐命令各自响应；host exit 后两个服务都退出"""
+    sidecars = Combined(tmp)
+    try:
+        sidecars.wait("music", "ready")
+        sidecars.wait("foreground", "ready")
+        time.sleep(1.0)  # 等播放器的后台启动步骤（设备、曲库）结束
+        sent = sidecars.send("foreground", "query_activity")
+        toggle = sidecars.send("music", "toggle")
+        t, _ = sidecars.wait("music", "play_state", toggle)
+        print(f"  音乐 toggle 响应 {(t - toggle) * 1000:.1f} ms；"
+              f"前台检测 query_activity 响应 {(sidecars.wait('foreground', 'activity', sent)[0] - sent) * 1000:.1f} ms")
+    finally:
+        start = time.perf_counter()
+        sidecars.close()
+    exits = sorted(data["service"] for _, s, name, data in sidecars.host.events if s == "host" and name == "service_exit")
+    print(f"  host exit 到进程结束 {(time.perf_counter() - start) * 1000:.0f} ms，service_exit: {exits}")
+
+
+def summarize(values):
+    return f"中位数 {statistics.median(values):7.1f}  最大 {max(values):7.1f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合并宿主进程性能测试")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--tracks", type=int, default=3)
+    args = parser.parse_args()
+    if not os.path.exists('/proc/self/stat'):
+        print("需要 /proc（Linux）", file=sys.stderr)
+        return
+
+    with tempfile.TemporaryDirectory() as tmp:
+        copy_sources(tmp)
+        write_tracks(os.path.join(tmp, 'music'), args.tracks)
+        results = {}
+        # 交替运行两种方式，减少机器负载变化的影响
+        for _ in range(args.runs):
+            for label, mode in (("分开启动", Separate), ("合并宿主", Combined)):
+                results.setdefault(label, []).append(measure(mode, tmp))
+
+        for label, rows in results.items():
+            ready, rss, cpu = zip(*rows)
+            print(f"\n{label}（{args.runs} 次）")
+            print(f"  启动到两个 ready (ms)  {summarize(ready)}")
+            print(f"  总 RSS (MB)            {summarize(rss)}")
+            print(f"  播放+检测 CPU (ms/秒)  {summarize(cpu)}")
+
+        print("\n合并模式的服务隔离")
+        check_isolation(tmp)
+
+
+if __name__ == "__main__":
+    main()
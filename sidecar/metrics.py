@@ -0,0 +1,237 @@
+"""
+sidecar 共用的进程内指标：计数器（counter）、仪表（gauge）和固定分桶的直方图（histogram）
+
+music.py 和 foreground_inspection.py 各自建一个 Registry（名字前缀 music_ / foreground_），在热路径上计数、计时，
+通过 get_metrics 命令取回（JSON 或 Prometheus 文本格式），也可以用 --metrics-file 定期写成 Prometheus 文本文件。
+只用标准库，导入不拖慢启动；记录一次只是加锁后改几个数，可以放在音频循环里。
+"""
+
+import bisect
+import os
+import sys
+import threading
+import time
+
+# 默认分桶（秒）：覆盖 0.1 ms 的本地查表到 10 s 的 API 超时
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def format_labels(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """只增不减的计数"""
+    kind = "counter"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {"value": self.value}
+
+    def samples(self, name, labels):
+        yield name + format_labels(labels), self.value
+
+
+class Gauge:
+    """
+    可增可减的当前值（队列长度、进行中的请求数、开关状态）
+    fn 不为空时每次读取都调用它取值（已有的状态不用在热路径上同步维护）
+    """
+    kind = "gauge"
+
+    def __init__(self, fn=None):
+        self.lock = threading.Lock()
+        self.value = 0
+        self.fn = fn
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self.lock:
+            self.value -= amount
+
+    def get(self):
+        return self.value if self.fn is None else self.fn()
+
+    def snapshot(self):
+        return {"value": self.get()}
+
+    def samples(self, name, labels):
+        yield name + format_labels(labels), self.get()
+
+
+class Histogram:
+    """固定分桶的直方图：counts[i] 是落在 (buckets[i-1], buckets[i]] 里的次数，最后一格是超出最大分桶的"""
+    kind = "histogram"
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.lock = threading.Lock()
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+            if value > self.max:
+                self.max = value
+
+    def time(self):
+        """with histogram.time(): ... 记录代码块的耗时（秒）"""
+        return Timer(self)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                "count": self.count,
+                "sum": round(self.sum, 6),
+                "max": round(self.max, 6),
+                "buckets": dict(zip([format_value(b) for b in self.buckets] + ["+Inf"], self.counts)),
+            }
+
+    def samples(self, name, labels):
+        with self.lock:
+            counts, count, total = list(self.counts), self.count, self.sum
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            yield name + "_bucket" + format_labels(labels, ("le", format_value(bound))), cumulative
+        yield name + "_sum" + format_labels(labels), total
+        yield name + "_count" + format_labels(labels), count
+
+
+class Timer:
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+
+class Registry:
+    """
+    一个进程（服务）的全部指标
+    同名同标签的指标只创建一次，热路径上可以先取出来存在变量里，省去每次查字典
+    """
+
+    def __init__(self, prefix):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.families = {}  # 名字 -> (类型, 说明, {标签元组: 指标})
+        self.started = time.time()
+        self.exporter = None
+        self.gauge("uptime_seconds", "进程启动以来的秒数", fn=lambda: round(time.time() - self.started, 3))
+
+    def _get(self, cls, name, help_text, labels, **kwargs):
+        key = tuple(sorted(labels.items()))
+        family = self.families.get(name)
+        if family is not None:
+            metric = family[2].get(key)
+            if metric is not None:
+                return metric
+        with self.lock:
+            family = self.families.setdefault(name, (cls.kind, help_text, {}))
+            if family[0] != cls.kind:
+                raise ValueError(f"指标 {name} 已注册为 {family[0]}")
+            metric = family[2].get(key)
+            if metric is None:
+                metric = family[2][key] = cls(**kwargs)
+            return metric
+
+    def counter(self, name, help_text="", **labels):
+        return self._get(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text="", fn=None, **labels):
+        return self._get(Gauge, name, help_text, labels, fn=fn)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS, **labels):
+        return self._get(Histogram, name, help_text, labels, buckets=buckets)
+
+    def _families(self):
+        with self.lock:
+            return [(name, kind, help_text, list(series.items()))
+                    for name, (kind, help_text, series) in sorted(self.families.items())]
+
+    def snapshot(self):
+        """JSON 格式：{名字: {"type", "help", "series": [{"labels": {...}, ...}]}}"""
+        result = {}
+        for name, kind, help_text, series in self._families():
+            result[f"{self.prefix}_{name}"] = {
+                "type": kind,
+                "help": help_text,
+                "series": [dict(metric.snapshot(), labels=dict(key)) for key, metric in series],
+            }
+        return result
+
+    def prometheus(self):
+        """Prometheus 文本格式（exposition format 0.0.4）"""
+        lines = []
+        for name, kind, help_text, series in self._families():
+            full_name = f"{self.prefix}_{name}" + ("_total" if kind == "counter" else "")
+            if help_text:
+                lines.append(f"# HELP {full_name} {help_text}")
+            lines.append(f"# TYPE {full_name} {kind}")
+            for key, metric in series:
+                for sample, value in metric.samples(full_name, key):
+                    lines.append(f"{sample} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def payload(self, fmt="json"):
+        """get_metrics 命令返回的事件数据"""
+        if fmt == "prometheus":
+            return {"format": "prometheus", "text": self.prometheus()}
+        return {"format": "json", "uptime": round(time.time() - self.started, 3), "metrics": self.snapshot()}
+
+    def write(self, path):
+        """写成 Prometheus 文本文件（先写临时文件再替换，node_exporter 的 textfile 收集器不会读到半个文件）"""
+        with open(path + ".tmp", "w", encoding="utf-8", newline="\n") as f:
+            f.write(self.prometheus())
+        os.replace(path + ".tmp", path)
+
+    def start_export(self, path, interval):
+        """后台线程每 interval 秒写一次 path"""
+        if self.exporter is not None or not path or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write(path)
+                except OSError as e:
+                    print(f"写入指标文件失败: {e}", file=sys.stderr)
+
+        self.exporter = threading.Thread(target=run, name=f"{self.prefix}-metrics", daemon=True)
+        self.exporter.start()
@@ -0,0 +1,149 @@
+"""
+sidecar 共用的采样分析器：按需（start_profile / stop_profile 命令）对所有线程做栈采样，
+输出 collapsed stack 格式（每行 "线程;函数 (文件:行);...;最内层函数 次数"），可以直接给 flamegraph.pl / speedscope 用。
+
+- 后台线程定时调用 sys._current_frames()，只读栈、不挂钩子，不采样时没有任何开销
+- 一次采样只在线程里遍历栈帧（代码对象 -> 标签的结果缓存），不做 IO；文件在 stop 时一次写出
+- 开销有上限：采样耗时超过间隔的 budget（默认 2%）时自动拉长间隔；栈深度和不同栈的数量也有上限
+- 采的是墙钟时间：阻塞在 wait/write 上的线程同样计数，能看出播放循环卡在哪
+"""
+
+import os
+import sys
+import threading
+import time
+
+MAX_DEPTH = 64  # 每个栈最多保留的帧数（从最内层数）
+MAX_STACKS = 20000  # 不同栈的数量上限，超出的计入 "[其它]"
+MAX_DURATION = 600.0  # 最长采样时间（秒），忘了 stop 时自动结束
+
+
+class Profiler:
+    def __init__(self, service, on_saved=None):
+        self.service = service
+        self.on_saved = on_saved  # 到时间自动结束时回调（结果同 stop 的返回值）
+        self.lock = threading.Lock()
+        self.thread = None
+        self.stop_event = threading.Event()
+        self.labels = {}  # 代码对象 -> "函数 (文件:行)"
+
+    @property
+    def running(self):
+        return self.thread is not None
+
+    def start(self, path, interval_ms=5.0, duration=60.0, budget=0.02):
+        """开始采样；已经在采样时抛出 RuntimeError"""
+        with self.lock:
+            if self.thread is not None:
+                raise RuntimeError(f"已经在采样，输出文件 {self.path}")
+            folder = os.path.dirname(os.path.abspath(path))
+            os.makedirs(folder, exist_ok=True)
+            self.path = path
+            self.interval = max(float(interval_ms), 1.0) / 1000
+            self.duration = min(float(duration), MAX_DURATION) if duration else MAX_DURATION
+            self.budget = budget
+            self.counts = {}
+            self.samples = 0
+            self.busy = 0.0
+            self.max_sample = 0.0
+            self.stretched = 0
+            self.started = time.perf_counter()
+            self.stop_event.clear()
+            self.thread = threading.Thread(target=self._run, name=f"{self.service}-profiler", daemon=True)
+            self.thread.start()
+        return {"running": True, "path": path, "interval_ms": round(self.interval * 1000, 2), "duration": self.duration}
+
+    def stop(self):
+        """结束采样并写出文件，返回统计；没有在采样时抛出 RuntimeError"""
+        with self.lock:
+            thread = self.thread
+            if thread is None:
+                raise RuntimeError("没有在采样")
+            self.stop_event.set()
+        if thread is not threading.current_thread():
+            thread.join()
+        return self._save()
+
+    def _label(self, code):
+        label = self.labels.get(code)
+        if label is None:
+            label = self.labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    def _run(self):
+        own = threading.get_ident()
+        names = {}
+        names_at = 0.0
+        deadline = self.started + self.duration
+        next_at = time.perf_counter()
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if self.stop_event.wait(max(0.0, next_at - now)):
+                break
+            t0 = time.perf_counter()
+            if t0 - names_at > 1.0:
+                # 线程名每秒刷新一次（threading.enumerate 比取栈贵）
+                names = {t.ident: t.name for t in threading.enumerate()}
+                names_at = t0
+            counts = self.counts
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < MAX_DEPTH:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                key = ";".join(reversed(stack))
+                if key in counts:
+                    counts[key] += 1
+                elif len(counts) < MAX_STACKS:
+                    counts[key] = 1
+                else:
+                    counts["[其它]"] = counts.get("[其它]", 0) + 1
+            cost = time.perf_counter() - t0
+            self.samples += 1
+            self.busy += cost
+            self.max_sample = max(self.max_sample, cost)
+            # 采样太贵（线程多、栈深）时拉长间隔，保证采样线程占用不超过 budget
+            interval = self.interval
+            if cost > interval * self.budget:
+                interval = cost / self.budget
+                self.stretched += 1
+            next_at = max(next_at + interval, time.perf_counter())
+
+        if not self.stop_event.is_set():
+            # 到时间自动结束
+            try:
+                result = self._save()
+            except OSError as e:
+                print(f"写入采样结果失败: {e}", file=sys.stderr)
+                return
+            if self.on_saved:
+                self.on_saved(result)
+
+    def _save(self):
+        with self.lock:
+            if self.thread is None:
+                return self.result
+            elapsed = time.perf_counter() - self.started
+            lines = [f"{stack} {count}\n" for stack, count in sorted(self.counts.items(), key=lambda kv: -kv[1])]
+            self.result = {
+                "running": False,
+                "path": self.path,
+                "elapsed": round(elapsed, 3),
+                "samples": self.samples,
+                "stacks": len(lines),
+                "overhead_pct": round(self.busy / elapsed * 100, 3) if elapsed else 0.0,
+                "max_sample_ms": round(self.max_sample * 1000, 3),
+                "stretched": self.stretched,
+            }
+            self.thread = None
+            try:
+                with open(self.path, "w", encoding="utf-8", newline="\n") as f:
+                    f.writelines(lines)
+            finally:
+                self.counts = {}
+            return self.result
@@ -0,0 +1,174 @@
+"""
+合并的 sidecar 宿主进程：在一个 Python 进程里同时运行音乐播放器（music.py）和前台检测（foreground_inspection.py）
+
+两个程序分开运行时各自带一份 Python 解释器、numpy 等依赖，PyInstaller --onefile 的 exe 每次启动
+还要各解压一遍；合并后只启动一个进程，共用解释器和已导入的模块。
+两个程序本身不变，仍然可以单独运行（Electron 默认仍是分开启动，设置里打开 combinedSidecar 才用宿主进程）。
+
+通信协议（stdin/stdout 共用一条 JSON 行通道，用 "service" 字段区分）:
+- Electron -> 宿主: 原来的命令加上 "service"
+  - {"service": "music", "command": "toggle"}
+  - {"service": "foreground", "command": "start"}
+  - {"service": "host", "command": "exit"} - 退出全部服务（stdin 关闭时同样退出）
+- 宿主 -> Electron: 原来的事件加上 "service"
+  - {"service": "music", "event": "progress", "data": {...}}
+  - {"service": "host", "event": "service_exit", "data": {"service": "music"}} - 某个服务已退出
+每个服务有自己的命令队列和分发线程，一个服务的命令阻塞（如等待配置加载）不会卡住另一个。
+
+用法:
+  python sidecar_host.py [--services music,foreground] [--music-args '["5", "--music-dir", "..."]']
+                         [--foreground-args '["--audit-interval", "30"]']
+  --music-args / --foreground-args 是 JSON 数组，原样传给各自的 parse_args（避免 Windows 路径的引号/转义问题）
+"""
+
+import time
+STARTED_AT = time.perf_counter()
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+
+if not getattr(sys, "frozen", False):
+    # 开发时直接引用两个程序的源码目录；打包时由 pyinstaller --paths 收进 exe
+    ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for folder in ("music-player", "foreground_inspection"):
+        sys.path.insert(0, os.path.join(ROOT, folder))
+
+SERVICES = ("music", "foreground")
+
+
+class Channel:
+    """共享的 stdout：各服务的事件线程都往这里写，一次写一整行"""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        with self.lock:
+            self.stream.write(text)
+
+    def flush(self):
+        with self.lock:
+            self.stream.flush()
+
+    def send_event(self, event_type, data):
+        output = json.dumps({"service": "host", "event": event_type, "data": data}, ensure_ascii=False)
+        with self.lock:
+            self.stream.write(output + "\n")
+            self.stream.flush()
+
+
+class Service:
+    """宿主里的一个服务：主流程线程 + 命令分发线程"""
+
+    def __init__(self, name, module, args):
+        self.name = name
+        self.module = module
+        self.args = args
+        self.commands = queue.Queue()
+        self.thread = None
+        self.exited = threading.Event()
+
+    def start(self, channel):
+        self.thread = threading.Thread(target=self.run, args=(channel,), name=self.name, daemon=True)
+        self.thread.start()
+        threading.Thread(target=self.dispatch, name=f"{self.name}-commands", daemon=True).start()
+
+    def run(self, channel):
+        try:
+            self.module.main(self.args, read_stdin=False)
+        except Exception as e:
+            print(f"[{self.name}] 异常退出: {e!r}", file=sys.stderr)
+        finally:
+            self.exited.set()
+            channel.send_event("service_exit", {"service": self.name})
+
+    def dispatch(self):
+        """按顺序把命令交给服务的 process_command（和单独运行时的 stdin 读取线程一样）"""
+        while not self.exited.is_set():
+            command = self.commands.get()
+            try:
+                self.module.process_command(command)
+            except Exception as e:
+                print(f"[{self.name}] 处理命令失败: {e!r}", file=sys.stderr)
+
+    def stop(self):
+        if not self.exited.is_set():
+            self.commands.put({"command": "exit"})
+
+
+def load_service(name, argv, channel):
+    """导入服务模块，把它的事件输出接到共享通道上"""
+    if name == "music":
+        import music as module
+        module.events.stream = channel
+        module.events.service = name
+    else:
+        import foreground_inspection as module
+        module.state.stream = channel
+        module.state.service = name
+    return Service(name, module, module.parse_args(argv))
+
+
+def stdin_reader(services):
+    """读取 Electron 的命令，按 service 字段转给各服务"""
+    for line in sys.stdin:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            command = json.loads(line)
+        except json.JSONDecodeError as e:
+            print(f"JSON解析错误: {e}", file=sys.stderr)
+            continue
+        name = command.pop("service", None)
+        if name == "host":
+            if command.get("command") == "exit":
+                break
+        elif name in services:
+            services[name].commands.put(command)
+        else:
+            print(f"未知服务: {name}", file=sys.stderr)
+    # stdin 关闭或收到 host exit：通知全部服务退出
+    for service in services.values():
+        service.stop()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="合并的 sidecar 宿主进程")
+    parser.add_argument("--services", default=",".join(SERVICES), help="要运行的服务，逗号分隔")
+    parser.add_argument("--music-args", default="[]", help="传给 music.py 的参数（JSON 数组）")
+    parser.add_argument("--foreground-args", default="[]", help="传给 foreground_inspection.py 的参数（JSON 数组）")
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    channel = Channel(sys.stdout)
+    argv = {"music": json.loads(args.music_args), "foreground": json.loads(args.foreground_args)}
+    services = {}
+    for name in args.services.split(","):
+        name = name.strip()
+        if name not in SERVICES:
+            print(f"未知服务: {name}", file=sys.stderr)
+            continue
+        services[name] = load_service(name, [str(a) for a in argv[name]], channel)
+
+    for service in services.values():
+        service.start(channel)
+    print(f"宿主进程已启动: {', '.join(services)}（{(time.perf_counter() - STARTED_AT) * 1000:.0f} ms）", file=sys.stderr)
+
+    threading.Thread(target=stdin_reader, args=(services,), daemon=True).start()
+
+    # 全部服务退出后结束进程（服务的后台线程都是 daemon，不用逐个等）
+    for service in services.values():
+        service.exited.wait()
+    channel.flush()
+
+
+if __name__ == "__main__":
+    main()
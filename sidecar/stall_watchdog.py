@@ -0,0 +1,161 @@
+"""
+sidecar 共用的卡顿看门狗：长时间运行的循环（播放循环、前台检测循环）每轮发一次心跳，
+看门狗线程发现某个循环超过阈值没有心跳时，抓取所有线程的栈（sys._current_frames）并回调 on_stall，
+由程序发出 stall_detected 事件，Electron 由此知道 sidecar 卡住了、卡在哪里。
+
+- 心跳只是给两个属性赋值，不加锁，可以放在音频循环里
+- 循环正常地长时间等待（暂停、空闲）前调用 idle()，下一次 beat() 之前不算卡顿
+- 同一次卡顿只报告一次；恢复后把总时长计入指标（stalls / stall_seconds），get_status 里有次数和最长一次
+"""
+
+import os
+import sys
+import threading
+import time
+
+MAX_DEPTH = 32  # 每个线程的栈最多保留的帧数（从最内层数）
+STALL_BUCKETS = (0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def format_stack(frame):
+    """栈帧 -> ["最外层 (文件:行)", ..., "最内层 (文件:行)"]"""
+    stack = []
+    while frame is not None and len(stack) < MAX_DEPTH:
+        stack.append(frame_label(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+class Heartbeat:
+    """一个循环的心跳：循环每轮调用 beat()"""
+
+    def __init__(self, name, threshold, source):
+        self.name = name
+        self.threshold = threshold  # None 表示用看门狗的默认阈值
+        self.source = source  # 循环所在的源文件，卡顿位置优先报告这个文件里的帧
+        self.last = time.monotonic()
+        self.active = False
+        self.ident = None
+        self.reported = None  # 已报告的卡顿开始时的 last
+        self.stalls = 0
+        self.longest = 0.0
+
+    def beat(self):
+        self.ident = threading.get_ident()
+        self.last = time.monotonic()
+        self.active = True
+
+    def idle(self):
+        """接下来的等待是正常的（暂停、等命令），不算卡顿"""
+        self.last = time.monotonic()
+        self.active = False
+
+
+class Watchdog:
+    def __init__(self, service, registry=None, on_stall=None):
+        self.service = service
+        self.registry = registry
+        self.on_stall = on_stall  # 发现卡顿时回调（参数同 stall_detected 事件的 data）
+        self.threshold = 0.0
+        self.heartbeats = []
+        self.thread = None
+
+    def heartbeat(self, name, threshold=None):
+        """登记一个循环（在循环所在的模块里调用，卡顿位置据此定位到该模块的代码）"""
+        source = sys._getframe(1).f_code.co_filename
+        heartbeat = Heartbeat(name, threshold, source)
+        self.heartbeats.append(heartbeat)
+        return heartbeat
+
+    def start(self, threshold):
+        """启动看门狗线程；threshold <= 0 时不启动（心跳照常，只是没人检查）"""
+        if self.thread is not None or threshold <= 0:
+            return
+        self.threshold = threshold
+        self.thread = threading.Thread(target=self._run, name=f"{self.service}-watchdog", daemon=True)
+        self.thread.start()
+
+    def _threshold(self, heartbeat):
+        return heartbeat.threshold or self.threshold
+
+    def _run(self):
+        # 检查间隔取最小阈值的 1/4，卡顿最多晚 25% 被发现
+        period = min(max(min(self._threshold(h) for h in self.heartbeats) / 4, 0.05), 1.0) if self.heartbeats else 1.0
+        while True:
+            time.sleep(period)
+            now = time.monotonic()
+            for heartbeat in self.heartbeats:
+                last = heartbeat.last
+                if heartbeat.reported is not None and (last != heartbeat.reported or not heartbeat.active):
+                    self._recovered(heartbeat, last)
+                if heartbeat.active and heartbeat.reported is None and now - last > self._threshold(heartbeat):
+                    heartbeat.reported = last
+                    try:
+                        self._report(heartbeat, now - last)
+                    except Exception as e:
+                        print(f"报告卡顿失败: {e!r}", file=sys.stderr)
+
+    def _recovered(self, heartbeat, last):
+        """卡顿结束：从卡住前最后一次心跳到恢复后第一次心跳（或转为空闲）"""
+        duration = last - heartbeat.reported
+        heartbeat.reported = None
+        heartbeat.longest = max(heartbeat.longest, duration)
+        if self.registry is not None:
+            self.registry.histogram("stall_seconds", "循环卡顿（超过阈值没有心跳）的总时长",
+                                    buckets=STALL_BUCKETS, loop=heartbeat.name).observe(duration)
+        print(f"[{self.service}] {heartbeat.name} 循环已恢复，卡顿 {duration:.2f} 秒", file=sys.stderr)
+
+    def _report(self, heartbeat, stalled):
+        heartbeat.stalls += 1
+        if self.registry is not None:
+            self.registry.counter("stalls", "循环卡顿（超过阈值没有心跳）的次数", loop=heartbeat.name).inc()
+        names = {t.ident: t.name for t in threading.enumerate()}
+        own = threading.get_ident()
+        threads = {}
+        stack = []
+        location = None
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            formatted = format_stack(frame)
+            threads[names.get(ident, f"thread-{ident}")] = formatted
+            if ident == heartbeat.ident:
+                stack = formatted
+                # 卡顿位置：循环所在文件里最内层的帧（卡在 openai/sounddevice 内部时指向调用它的那一行）
+                while frame is not None and frame.f_code.co_filename != heartbeat.source:
+                    frame = frame.f_back
+                location = frame_label(frame) if frame is not None else None
+        data = {
+            "loop": heartbeat.name,
+            "thread": names.get(heartbeat.ident, f"thread-{heartbeat.ident}"),
+            "stalled": round(stalled, 3),
+            "threshold": self._threshold(heartbeat),
+            "location": location,
+            "innermost": stack[-1] if stack else None,
+            "stack": stack,
+            "threads": threads,
+        }
+        print(f"[{self.service}] {heartbeat.name} 循环 {stalled:.2f} 秒没有心跳，卡在 {location or '未知位置'}"
+              f"（最内层 {data['innermost']}）", file=sys.stderr)
+        if self.on_stall:
+            self.on_stall(data)
+
+    def snapshot(self):
+        """get_status 用：{循环名: {"stalls", "longest", "stalled"}}，stalled 是正在进行的卡顿已持续的秒数"""
+        now = time.monotonic()
+        result = {}
+        for heartbeat in self.heartbeats:
+            reported = heartbeat.reported
+            stalled = now - reported if reported is not None else 0.0
+            result[heartbeat.name] = {
+                "stalls": heartbeat.stalls,
+                "longest": round(max(heartbeat.longest, stalled), 3),
+                "stalled": round(stalled, 3),
+            }
+        return result
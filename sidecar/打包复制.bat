@@ -0,0 +1,2 @@
+pyinstaller --onefile --paths ..\music-player --paths ..\foreground_inspection --hidden-import numpy --hidden-import soundfile --hidden-import sounddevice sidecar_host.py
+copy /Y "dist\sidecar_host.exe" "sidecar_host.exe"
\ No newline at end of file
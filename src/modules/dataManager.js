@@ -51,6 +51,7 @@ function createDefaultData() {
     },
     planList: [],
     audioDevice: null,
+    combinedSidecar: false, // 音乐播放器和前台检测合并到一个 sidecar_host 进程（需要打包 sidecar_host.exe）
     // 菜园子系统
     garden: {
       coins: 0,
@@ -0,0 +1,208 @@
+/**
+ * 下载器进程管理模块
+ * 负责与 youget_download.exe --service 通过 stdin/stdout 通信
+ * 第一次下载时才启动进程；下载完成后由主进程通知播放器 ingest
+ */
+
+const { spawn } = require('child_process')
+const path = require('path')
+const readline = require('readline')
+
+class DownloaderProcess {
+  constructor() {
+    this.process = null
+    this.isRunning = false
+    this.exePath = null
+    this.musicDir = null
+    this.onReadyCallback = null
+    this.onProgressCallback = null
+    this.onDoneCallback = null
+    this.onErrorCallback = null
+  }
+
+  /**
+   * 设置可执行文件和音乐文件夹（进程在第一次下载时启动）
+   * @param {string} exePath - youget_download.exe 的路径
+   * @param {string} musicDir - 播放器的音乐文件夹，下载结果保存在这里
+   */
+  configure(exePath, musicDir) {
+    this.exePath = exePath
+    this.musicDir = musicDir
+  }
+
+  /**
+   * 启动下载器进程
+   */
+  start() {
+    if (this.process) {
+      return
+    }
+
+    const fullPath = this.exePath || path.join(__dirname, '../../music-player/youget_download.exe')
+    const cwd = path.dirname(fullPath)
+    const musicDir = this.musicDir || path.join(cwd, 'music')
+    const args = ['--service', '--output', musicDir, '--work-dir', path.join(cwd, 'downloads')]
+
+    try {
+      this.process = spawn(fullPath, args, {
+        stdio: ['pipe', 'pipe', 'pipe'],
+        cwd,
+        env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
+      })
+
+      this.isRunning = true
+      console.log('[DownloaderProcess] 进程已启动:', fullPath)
+
+      const rl = readline.createInterface({
+        input: this.process.stdout.setEncoding('utf8'),
+        crlfDelay: Infinity
+      })
+
+      rl.on('line', (line) => {
+        this.handleMessage(line)
+      })
+
+      this.process.stderr.on('data', (data) => {
+        console.error('[DownloaderProcess] stderr:', data.toString())
+      })
+
+      this.process.on('close', (code) => {
+        console.log('[DownloaderProcess] 进程已退出, code:', code)
+        this.process = null
+        this.isRunning = false
+      })
+
+      this.process.on('error', (err) => {
+        console.error('[DownloaderProcess] 进程错误:', err)
+        this.process = null
+        this.isRunning = false
+        if (this.onErrorCallback) {
+          this.onErrorCallback({ id: null, url: null, stage: 'start', message: '下载器启动失败' })
+        }
+      })
+
+    } catch (err) {
+      console.error('[DownloaderProcess] 启动失败:', err)
+      this.process = null
+      this.isRunning = false
+    }
+  }
+
+  /**
+   * 停止下载器进程（未完成的任务记在清单里，下次启动继续）
+   */
+  stop() {
+    if (this.process) {
+      const pid = this.process.pid
+
+      // 在 Windows 上使用 taskkill 终止进程树（包括正在运行的 you-get/ffmpeg）
+      if (process.platform === 'win32' && pid) {
+        try {
+          const { execSync } = require('child_process')
+          execSync(`taskkill /pid ${pid} /T /F`, { stdio: 'ignore' })
+        } catch (e) {
+          this.process.kill('SIGKILL')
+        }
+      } else {
+        this.process.kill('SIGKILL')
+      }
+
+      this.process = null
+      this.isRunning = false
+      console.log('[DownloaderProcess] 进程已停止')
+    }
+  }
+
+  /**
+   * 处理来自下载器的消息
+   * @param {string} line - JSON格式的消息
+   */
+  handleMessage(line) {
+    try {
+      const { event, data } = JSON.parse(line)
+
+      switch (event) {
+        case 'ready':
+          console.log('[DownloaderProcess] 就绪:', data)
+          if (this.onReadyCallback) {
+            this.onReadyCallback(data)
+          }
+          break
+        case 'download_progress':
+          if (this.onProgressCallback) {
+            this.onProgressCallback(data)
+          }
+          break
+        case 'download_done':
+          console.log('[DownloaderProcess] 下载完成:', data)
+          if (this.onDoneCallback) {
+            this.onDoneCallback(data)
+          }
+          break
+        case 'download_error':
+          console.error('[DownloaderProcess] 下载失败:', data)
+          if (this.onErrorCallback) {
+            this.onErrorCallback(data)
+          }
+          break
+        default:
+          console.log('[DownloaderProcess] 未知事件:', event)
+      }
+    } catch (err) {
+      console.error('[DownloaderProcess] 解析消息失败:', err, line)
+    }
+  }
+
+  /**
+   * 发送命令到下载器（未运行时先启动）
+   * @param {object} command - 命令对象
+   */
+  sendCommand(command) {
+    this.start()
+    if (!this.process || !this.process.stdin.writable) {
+      console.error('[DownloaderProcess] 进程未运行,无法发送命令')
+      return false
+    }
+
+    try {
+      this.process.stdin.write(JSON.stringify(command) + '\n', 'utf8')
+      console.log('[DownloaderProcess] 发送命令:', command)
+      return true
+    } catch (err) {
+      console.error('[DownloaderProcess] 发送命令失败:', err)
+      return false
+    }
+  }
+
+  // ============ 控制命令 ============
+
+  /**
+   * 下载网址中的音频（进度通过 download_progress 事件返回）
+   * @param {string} url - 视频网址
+   */
+  download(url) {
+    return this.sendCommand({ command: 'download', url })
+  }
+
+  // ============ 回调设置 ============
+
+  onReady(callback) {
+    this.onReadyCallback = callback
+  }
+
+  onProgress(callback) {
+    this.onProgressCallback = callback
+  }
+
+  onDone(callback) {
+    this.onDoneCallback = callback
+  }
+
+  onError(callback) {
+    this.onErrorCallback = callback
+  }
+}
+
+// 导出单例
+const downloaderProcess = new DownloaderProcess()
+module.exports = downloaderProcess
@@ -17,6 +17,11 @@ class ForegroundInspection {
     this.onEntertainmentDetectedCallback = null
     this.onStatusCallback = null
     this.onErrorCallback = null
+    this.onActivityCallback = null
+    this.onBackgroundEntertainmentCallback = null
+    this.onMetricsCallback = null
+    this.onProfileCallback = null
+    this.onStallCallback = null
   }
 
   /**
@@ -83,6 +88,26 @@ class ForegroundInspection {
     }
   }
 
+  /**
+   * 合并模式：不单独启动 foreground_inspection.exe，通过 sidecar 宿主进程收发消息
+   * @param {object} host - 已启动的 sidecarHost
+   */
+  attach(host) {
+    if (this.process) {
+      console.log('[ForegroundInspection] 进程已在运行')
+      return
+    }
+
+    this.process = host.channel('foreground', (line) => this.handleMessage(line), () => {
+      console.log('[ForegroundInspection] 宿主进程中的前台检测已退出')
+      this.process = null
+      this.isRunning = false
+      this.isDetecting = false
+    })
+    this.isRunning = true
+    console.log('[ForegroundInspection] 已接入 sidecar 宿主进程')
+  }
+
   /**
    * 停止前台检测进程
    */
@@ -159,6 +184,34 @@ class ForegroundInspection {
             this.onErrorCallback(data)
           }
           break
+        case 'activity':
+          if (this.onActivityCallback) {
+            this.onActivityCallback(data)
+          }
+          break
+        case 'metrics':
+          if (this.onMetricsCallback) {
+            this.onMetricsCallback(data)
+          }
+          break
+        case 'profile_started':
+        case 'profile_saved':
+        case 'profile_error':
+          if (this.onProfileCallback) {
+            this.onProfileCallback({ event, ...data })
+          }
+          break
+        case 'stall_detected':
+          console.warn(`[ForegroundInspection] ${data.loop} 循环卡顿 ${data.stalled} 秒:`, data.location, data.innermost)
+          if (this.onStallCallback) {
+            this.onStallCallback(data)
+          }
+          break
+        case 'background_entertainment':
+          if (this.onBackgroundEntertainmentCallback) {
+            this.onBackgroundEntertainmentCallback(data)
+          }
+          break
         default:
           console.log('[ForegroundInspection] 未知事件:', event)
       }
@@ -251,6 +304,46 @@ class ForegroundInspection {
     return this.sendCommand({ command: 'move_blacklist_to_whitelist', keyword })
   }
 
+  /**
+   * 开关后台巡检：检测运行期间定期分类所有可见窗口，发现后台娱乐窗口时发送 background_entertainment
+   * @param {boolean} enabled - 是否开启
+   * @param {number} interval - 巡检间隔（秒）
+   */
+  setAudit(enabled, interval = 30) {
+    return this.sendCommand({ command: 'set_audit', enabled, interval })
+  }
+
+  /**
+   * 查询各窗口的前台时长（结果通过 activity 事件返回）
+   * @param {object} options - { group: 'app'|'category'|'title', period: 'day'|'week', days: 7, limit: 10 }
+   */
+  queryActivity(options = {}) {
+    return this.sendCommand({ command: 'query_activity', ...options })
+  }
+
+  /**
+   * 获取指标（结果通过 metrics 事件返回）
+   * @param {string} [format] - "json"（默认）或 "prometheus"
+   */
+  getMetrics(format = 'json') {
+    return this.sendCommand({ command: 'get_metrics', format })
+  }
+
+  /**
+   * 开始对前台检测的所有线程栈采样（结果通过 profile_started 事件返回，出错时为 profile_error 事件）
+   * @param {object} [options] - { interval_ms, duration, path }
+   */
+  startProfile(options = {}) {
+    return this.sendCommand({ command: 'start_profile', ...options })
+  }
+
+  /**
+   * 结束采样并写出火焰图文件（结果通过 profile_saved 事件返回）
+   */
+  stopProfile() {
+    return this.sendCommand({ command: 'stop_profile' })
+  }
+
   /**
    * 设置API Key（运行时通过 stdin 发送）
    * @param {string|null} apiKey - DeepSeek API Key，null 表示清除
@@ -285,6 +378,26 @@ class ForegroundInspection {
   onError(callback) {
     this.onErrorCallback = callback
   }
+
+  onActivity(callback) {
+    this.onActivityCallback = callback
+  }
+
+  onMetrics(callback) {
+    this.onMetricsCallback = callback
+  }
+
+  onProfile(callback) {
+    this.onProfileCallback = callback
+  }
+
+  onStall(callback) {
+    this.onStallCallback = callback
+  }
+
+  onBackgroundEntertainment(callback) {
+    this.onBackgroundEntertainmentCallback = callback
+  }
 }
 
 // 导出单例
@@ -21,6 +21,11 @@ class MusicProcess {
     this.onPlayErrorCallback = null
     this.onProcessDeadCallback = null  // 进程死亡回调
     this.onVolumeChangeCallback = null  // 音量变化回调
+    this.onWaveformCallback = null  // 波形概览回调（分块）
+    this.onTrackAddedCallback = null  // 新曲目加入播放列表回调
+    this.onMetricsCallback = null  // 指标回调
+    this.onProfileCallback = null  // 采样开始/结束/出错回调
+    this.onStallCallback = null  // 循环卡顿回调
   }
 
   /**
@@ -83,6 +88,25 @@ class MusicProcess {
     }
   }
 
+  /**
+   * 合并模式：不单独启动 music.exe，通过 sidecar 宿主进程收发消息
+   * @param {object} host - 已启动的 sidecarHost
+   */
+  attach(host) {
+    if (this.process) {
+      console.log('[MusicProcess] 进程已在运行')
+      return
+    }
+
+    this.process = host.channel('music', (line) => this.handleMessage(line), () => {
+      console.log('[MusicProcess] 宿主进程中的播放器已退出')
+      this.process = null
+      this.isRunning = false
+    })
+    this.isRunning = true
+    console.log('[MusicProcess] 已接入 sidecar 宿主进程')
+  }
+
   /**
    * 停止音乐播放器进程
    */
@@ -167,6 +191,34 @@ class MusicProcess {
             this.onVolumeChangeCallback(data)
           }
           break
+        case 'waveform':
+          if (this.onWaveformCallback) {
+            this.onWaveformCallback(data)
+          }
+          break
+        case 'track_added':
+          if (this.onTrackAddedCallback) {
+            this.onTrackAddedCallback(data)
+          }
+          break
+        case 'metrics':
+          if (this.onMetricsCallback) {
+            this.onMetricsCallback(data)
+          }
+          break
+        case 'profile_started':
+        case 'profile_saved':
+        case 'profile_error':
+          if (this.onProfileCallback) {
+            this.onProfileCallback({ event, ...data })
+          }
+          break
+        case 'stall_detected':
+          console.warn(`[MusicProcess] ${data.loop} 循环卡顿 ${data.stalled} 秒:`, data.location, data.innermost)
+          if (this.onStallCallback) {
+            this.onStallCallback(data)
+          }
+          break
         default:
           console.log('[MusicProcess] 未知事件:', event)
       }
@@ -261,6 +313,52 @@ class MusicProcess {
     return this.sendCommand({ command: 'set_device', device_id: deviceId })
   }
 
+  /**
+   * 获取波形概览（结果通过 waveform 事件分块返回）
+   * @param {string} [name] - 曲目文件名，省略时为当前曲目
+   */
+  getWaveform(name) {
+    return this.sendCommand(name ? { command: 'get_waveform', name } : { command: 'get_waveform' })
+  }
+
+  /**
+   * 设备插拔后重新枚举输出设备（结果通过 devices 事件返回）
+   */
+  refreshDevices() {
+    return this.sendCommand({ command: 'refresh_devices' })
+  }
+
+  /**
+   * 把刚下载到音乐文件夹的曲目加入播放列表（结果通过 track_added 事件返回）
+   * @param {string} name - 曲目文件名
+   */
+  ingest(name) {
+    return this.sendCommand({ command: 'ingest', name })
+  }
+
+  /**
+   * 获取指标（结果通过 metrics 事件返回）
+   * @param {string} [format] - "json"（默认）或 "prometheus"
+   */
+  getMetrics(format = 'json') {
+    return this.sendCommand({ command: 'get_metrics', format })
+  }
+
+  /**
+   * 开始对播放器的所有线程栈采样（结果通过 profile_started 事件返回）
+   * @param {object} [options] - { interval_ms, duration, path }
+   */
+  startProfile(options = {}) {
+    return this.sendCommand({ command: 'start_profile', ...options })
+  }
+
+  /**
+   * 结束采样并写出火焰图文件（结果通过 profile_saved 事件返回）
+   */
+  stopProfile() {
+    return this.sendCommand({ command: 'stop_profile' })
+  }
+
   // ============ 回调设置 ============
 
   onReady(callback) {
@@ -298,6 +396,26 @@ class MusicProcess {
   onVolumeChange(callback) {
     this.onVolumeChangeCallback = callback
   }
+
+  onWaveform(callback) {
+    this.onWaveformCallback = callback
+  }
+
+  onTrackAdded(callback) {
+    this.onTrackAddedCallback = callback
+  }
+
+  onMetrics(callback) {
+    this.onMetricsCallback = callback
+  }
+
+  onProfile(callback) {
+    this.onProfileCallback = callback
+  }
+
+  onStall(callback) {
+    this.onStallCallback = callback
+  }
 }
 
 // 导出单例
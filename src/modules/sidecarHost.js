@@ -0,0 +1,203 @@
+/**
+ * 合并的 sidecar 宿主进程管理模块
+ * 负责与 sidecar_host.exe 通过 stdin/stdout 通信：一个进程里同时运行音乐播放器和前台检测，
+ * 消息用 "service" 字段区分（协议见 sidecar/sidecar_host.py）
+ * musicProcess / foregroundInspection 通过 channel() 拿到一个和子进程用法相同的对象，其余代码不变
+ */
+
+const { spawn } = require('child_process')
+const path = require('path')
+const readline = require('readline')
+
+class SidecarHost {
+  constructor() {
+    this.process = null
+    this.isRunning = false
+    this.channels = {}  // 服务名 -> { onLine, onClose, closed }
+  }
+
+  /**
+   * 启动宿主进程
+   * @param {string} exePath - sidecar_host.exe 的路径
+   * @param {object} options - { music: [...], foreground: [...] } 分别传给两个服务的命令行参数
+   */
+  start(exePath, options = {}) {
+    if (this.process) {
+      console.log('[SidecarHost] 进程已在运行')
+      return
+    }
+
+    const fullPath = exePath || path.join(__dirname, '../../sidecar/sidecar_host.exe')
+    const args = [
+      '--music-args', JSON.stringify((options.music || []).map(String)),
+      '--foreground-args', JSON.stringify((options.foreground || []).map(String))
+    ]
+
+    try {
+      this.process = spawn(fullPath, args, {
+        stdio: ['pipe', 'pipe', 'pipe'],
+        cwd: path.dirname(fullPath),
+        env: { ...process.env, PYTHONIOENCODING: 'utf-8' }
+      })
+
+      this.isRunning = true
+      console.log('[SidecarHost] 进程已启动:', fullPath)
+
+      const rl = readline.createInterface({
+        input: this.process.stdout.setEncoding('utf8'),
+        crlfDelay: Infinity
+      })
+
+      rl.on('line', (line) => {
+        this.handleMessage(line)
+      })
+
+      this.process.stderr.on('data', (data) => {
+        console.error('[SidecarHost] stderr:', data.toString())
+      })
+
+      this.process.on('close', (code) => {
+        console.log('[SidecarHost] 进程已退出, code:', code)
+        this.process = null
+        this.isRunning = false
+        this.closeAll()
+      })
+
+      this.process.on('error', (err) => {
+        console.error('[SidecarHost] 进程错误:', err)
+        this.process = null
+        this.isRunning = false
+        this.closeAll()
+      })
+
+    } catch (err) {
+      console.error('[SidecarHost] 启动失败:', err)
+      this.process = null
+      this.isRunning = false
+    }
+  }
+
+  /**
+   * 按 service 字段把消息转给对应的服务
+   * @param {string} line - JSON格式的消息
+   */
+  handleMessage(line) {
+    let message
+    try {
+      message = JSON.parse(line)
+    } catch (err) {
+      console.error('[SidecarHost] 解析消息失败:', err, line)
+      return
+    }
+
+    if (message.service === 'host') {
+      if (message.event === 'service_exit') {
+        this.closeChannel(message.data.service)
+      }
+      return
+    }
+
+    const channel = this.channels[message.service]
+    if (channel && !channel.closed) {
+      channel.onLine(line)
+    } else {
+      console.log('[SidecarHost] 未知服务的消息:', message.service, message.event)
+    }
+  }
+
+  /**
+   * 发送命令给某个服务（"host" 为宿主进程本身）
+   * @param {string} service - 服务名
+   * @param {object} command - 命令对象
+   */
+  send(service, command) {
+    if (!this.process || !this.process.stdin.writable) {
+      return false
+    }
+    try {
+      this.process.stdin.write(JSON.stringify({ ...command, service }) + '\n', 'utf8')
+      return true
+    } catch (err) {
+      console.error('[SidecarHost] 发送命令失败:', err)
+      return false
+    }
+  }
+
+  /**
+   * 某个服务的通道：和 spawn 返回的子进程一样有 stdin.writable / stdin.write / kill，
+   * kill 时让该服务退出，全部服务都退出后停止宿主进程
+   * @param {string} service - 服务名
+   * @param {function} onLine - 收到该服务的一行消息
+   * @param {function} onClose - 服务退出或宿主进程退出
+   */
+  channel(service, onLine, onClose) {
+    this.channels[service] = { onLine, onClose, closed: false }
+    const host = this
+    return {
+      pid: undefined,
+      stdin: {
+        get writable() {
+          return Boolean(host.process && host.process.stdin.writable && !host.channels[service].closed)
+        },
+        write(commandStr) {
+          return host.send(service, JSON.parse(commandStr))
+        }
+      },
+      kill() {
+        host.send(service, { command: 'exit' })
+        host.closeChannel(service)
+      }
+    }
+  }
+
+  closeChannel(service) {
+    const channel = this.channels[service]
+    if (!channel || channel.closed) {
+      return
+    }
+    channel.closed = true
+    if (channel.onClose) {
+      channel.onClose()
+    }
+    if (Object.values(this.channels).every((c) => c.closed)) {
+      // 给服务一点时间正常退出（保存会话等），然后结束宿主进程
+      setTimeout(() => this.stop(), 1000)
+    }
+  }
+
+  closeAll() {
+    for (const service of Object.keys(this.channels)) {
+      this.closeChannel(service)
+    }
+  }
+
+  /**
+   * 停止宿主进程
+   */
+  stop() {
+    if (this.process) {
+      const pid = this.process.pid
+
+      // 在 Windows 上使用 taskkill 强制终止进程树
+      if (process.platform === 'win32' && pid) {
+        try {
+          const { execSync } = require('child_process')
+          execSync(`taskkill /pid ${pid} /T /F`, { stdio: 'ignore' })
+          console.log('[SidecarHost] 使用 taskkill 终止进程:', pid)
+        } catch (e) {
+          this.process.kill('SIGKILL')
+        }
+      } else {
+        this.process.kill('SIGKILL')
+      }
+
+      this.process = null
+      this.isRunning = false
+      console.log('[SidecarHost] 进程已停止')
+    }
+  }
+}
+
+// 导出单例
+const sidecarHost = new SidecarHost()
+module.exports = sidecarHost
@@ -24,11 +24,14 @@ const MusicPlayer = (function() {
     volume: 1.0,  // 音量 0-1
     isVolumeSliderOpen: false,  // 音量滑块是否展开
     lastVolumeSendTime: 0,  // 上次发送音量的时间戳（节流用）
-    isCollapsed: false  // 是否收起
+    isCollapsed: false,  // 是否收起
+    waveform: null  // 当前曲目的波形概览 { name, resolution, peak: Uint8Array, rms: Uint8Array, complete }
   }
   
   // 播放超时时间（毫秒）
   const PLAY_TIMEOUT_MS = 3000
+  // 设备插拔事件合并的等待时间（毫秒）
+  const DEVICE_CHANGE_DEBOUNCE_MS = 500
 
   // ============ DOM 元素引用 ============
   let elements = {
@@ -57,6 +60,19 @@ const MusicPlayer = (function() {
   // 使用统一的格式化函数（不显示分钟前导零）
   const formatTime = (seconds) => Utils.formatTime(seconds, false)
 
+  // ============ 波形概览 ============
+  
+  // 切歌时向 Python 请求新曲目的波形，旧曲目还没到的分块会被丢弃
+  function requestWaveform(name) {
+    if (!name) {
+      state.waveform = null
+      return
+    }
+    if (state.waveform && state.waveform.name === name) return
+    state.waveform = { name, resolution: 0, peak: null, rms: null, complete: false }
+    window.electronAPI.musicGetWaveform(name)
+  }
+
   // ============ 播放超时检测 ============
   
   /**
@@ -438,6 +454,17 @@ const MusicPlayer = (function() {
       elements.deviceList.addEventListener('click', handleDeviceClick)
     }
     
+    // 系统音频设备插拔时让 Python 重新枚举（短时间内多次触发只发一次）
+    if (navigator.mediaDevices) {
+      let deviceChangeTimer = null
+      navigator.mediaDevices.addEventListener('devicechange', () => {
+        clearTimeout(deviceChangeTimer)
+        deviceChangeTimer = setTimeout(() => {
+          window.electronAPI.musicRefreshDevices()
+        }, DEVICE_CHANGE_DEBOUNCE_MS)
+      })
+    }
+    
     // 音量按钮
     if (elements.volumeBtn) {
       elements.volumeBtn.addEventListener('click', toggleVolumeSlider)
@@ -482,6 +509,7 @@ const MusicPlayer = (function() {
       updateProgressUI()
       updatePlayButton()
       updatePrevButton()
+      requestWaveform(data.name)
       console.log('[MusicPlayer] 收到 ready 事件:', data)
     })
 
@@ -511,6 +539,7 @@ const MusicPlayer = (function() {
       }
       updateProgressUI()
       updatePrevButton()
+      requestWaveform(data.name)
     })
 
     // 监听播放状态
@@ -571,6 +600,28 @@ const MusicPlayer = (function() {
       updateVolumeUI()
     })
     
+    // 监听波形概览（大文件分多块到达，按 offset 拼接）
+    window.electronAPI.onMusicWaveform((data) => {
+      const waveform = state.waveform
+      if (!waveform || waveform.name !== data.name) return
+      if (data.offset === 0) {
+        waveform.resolution = data.resolution
+        waveform.peak = new Uint8Array(data.total)
+        waveform.rms = new Uint8Array(data.total)
+      }
+      if (!waveform.peak) return
+      waveform.peak.set(data.peak, data.offset)
+      waveform.rms.set(data.rms, data.offset)
+      waveform.complete = data.done
+    })
+    
+    // 监听新曲目加入（下载完成后由主进程通知播放器 ingest）
+    window.electronAPI.onMusicTrackAdded((data) => {
+      handlePythonResponse()  // Python 端响应正常
+      state.hasMusic = true
+      console.log('[MusicPlayer] 新曲目已加入播放列表:', data.name, '共', data.count, '首')
+    })
+    
   }
 
   // ============ 公共API ============